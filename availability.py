@@ -0,0 +1,311 @@
+"""
+場地借用狀況 (Default.aspx 的借用清單) 的擷取與記憶體內索引。
+
+SlotIndex 以 場地 × 日期 為格子，每格存一個 24 位元的遮罩 (第 h 位元代表 h:00~h+1:00)，
+查詢「下週 18:00 有空的 VOL* 場地」只需要整數位元運算。
+"""
+import datetime
+import re
+from array import array
+
+import requests
+
+import booking_service
+import telemetry
+from booking_targets import TIME_SLOTS_MAPPING, VENUE_CODES_MAPPING, expand_venues, parse_time_slot
+from http_client import get_session
+from session_cache import LOGIN_FORM_MARKER
+
+DATE_FORMAT = "%Y/%m/%d"
+FULL_DAY_MASK = (1 << 24) - 1
+
+_ROW_RE = re.compile(r"<tr\b[^>]*>(.*?)</tr\s*>", re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]+>")
+_VENUE_RE = re.compile(r"\b([A-Z]{3}[0-9A-Z]{2})")
+_DATE_RE = re.compile(r"(\d{4})/(\d{1,2})/(\d{1,2})")
+_HOURS_RE = re.compile(r"(\d{1,2})(?::\d{2})?\s*~\s*(\d{1,2})(?::\d{2})?")
+# 下拉選單 (例如 DropDownList1 的場地選單) 列出所有選項，不代表頁面列出了它們的借用
+_SELECT_RE = re.compile(r"<select\b.*?</select\s*>", re.IGNORECASE | re.DOTALL)
+# 頁面標示的日期區間，例如 "2025/06/01 ~ 2025/06/07"
+_RANGE_RE = re.compile(r"(\d{4}/\d{1,2}/\d{1,2})\s*(?:~|～|-|至|到)\s*(\d{4}/\d{1,2}/\d{1,2})")
+
+
+def to_date(value):
+    """接受 datetime.date 或 "YYYY/MM/DD" 字串。"""
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(value, DATE_FORMAT).date()
+
+
+def hours_mask(start_hour, end_hour):
+    """[start_hour, end_hour) 的位元遮罩。"""
+    start_hour, end_hour = max(int(start_hour), 0), min(int(end_hour), 24)
+    if end_hour <= start_hour:
+        return 0
+    return ((1 << (end_hour - start_hour)) - 1) << start_hour
+
+
+def slot_mask(start_hour_key):
+    """時段索引 (例如 "06") 所涵蓋小時的遮罩；索引無效時為 0。"""
+    parsed_slot = parse_time_slot(start_hour_key)
+    return hours_mask(parsed_slot[1], parsed_slot[2]) if parsed_slot else 0
+
+
+class SlotIndex:
+    """
+    場地 × 日期 × 小時 的借用狀況索引。
+
+    occupied 記錄已被借用的小時，known 記錄已擷取過 (狀態可信) 的小時；
+    兩者都是以 場地 × 日期 攤平的 array，每個元素為 24 位元遮罩。
+
+    Args:
+        start_date (date or str): 索引涵蓋的第一天。
+        days (int): 涵蓋天數。
+        venues (iterable, optional): 場地代碼，預設為 VENUE_CODES_MAPPING 中的所有場地。
+    """
+
+    def __init__(self, start_date, days, venues=None):
+        self.start_date = to_date(start_date)
+        self.days = days
+        self.venues = list(venues or VENUE_CODES_MAPPING)
+        self._venue_pos = {venue: i for i, venue in enumerate(self.venues)}
+        self.occupied = array("L", [0]) * (len(self.venues) * days)
+        self.known = array("L", [0]) * (len(self.venues) * days)
+        self._date_strings = [date.strftime(DATE_FORMAT) for date in self.dates()]
+        self._pattern_cells = {}
+
+    def _cell(self, venue_code, date):
+        venue_pos = self._venue_pos.get(venue_code)
+        day = (to_date(date) - self.start_date).days
+        if venue_pos is None or not 0 <= day < self.days:
+            return None
+        return venue_pos * self.days + day
+
+    def dates(self):
+        return [self.start_date + datetime.timedelta(days=i) for i in range(self.days)]
+
+    def _venue_cells(self, venue_patterns):
+        """樣式對應的場地在 array 中的起始位置 (快取，避免每次查詢都做萬用字元比對)。"""
+        venue_patterns = tuple(venue_patterns)
+        cells = self._pattern_cells.get(venue_patterns)
+        if cells is None:
+            cells = [self._venue_pos[v] * self.days for v in expand_venues(venue_patterns) if v in self._venue_pos]
+            self._pattern_cells[venue_patterns] = cells
+        return cells
+
+    def mark_known(self, venue_code, date, mask=FULL_DAY_MASK):
+        cell = self._cell(venue_code, date)
+        if cell is not None:
+            self.known[cell] |= mask
+
+    def mark_all_known(self):
+        for cell in range(len(self.known)):
+            self.known[cell] = FULL_DAY_MASK
+
+    def mark_occupied(self, venue_code, date, start_hour, end_hour):
+        """記錄一筆借用；超出索引範圍的場地或日期會被忽略。回傳是否有記錄。"""
+        cell = self._cell(venue_code, date)
+        if cell is None:
+            return False
+        self.occupied[cell] |= hours_mask(start_hour, end_hour)
+        return True
+
+    def is_free(self, venue_code, date, start_hour_key):
+        """該時段是否可借用；狀態未知 (未擷取或超出範圍) 時回傳 None。"""
+        cell = self._cell(venue_code, date)
+        mask = slot_mask(start_hour_key)
+        if cell is None or not mask or self.known[cell] & mask != mask:
+            return None
+        return self.occupied[cell] & mask == 0
+
+    def find_free(self, venue_patterns=("*",), start_hour_keys=None, date_from=None, date_to=None):
+        """
+        找出可借用的 (venue_code, "YYYY/MM/DD", start_hour_key)。
+
+        Args:
+            venue_patterns (iterable, optional): 場地代碼或萬用字元樣式 (例如 "VOL*")。
+            start_hour_keys (iterable, optional): 時段索引，預設為 TIME_SLOTS_MAPPING 中的所有時段。
+            date_from, date_to (date or str, optional): 日期範圍 (含兩端)，預設為整個索引範圍。
+
+        Returns:
+            list: 依 日期 → 時段 → 場地 排序的可借用時段。
+        """
+        venue_cells = self._venue_cells(venue_patterns)
+        slots = [(key, slot_mask(key)) for key in (start_hour_keys or TIME_SLOTS_MAPPING)]
+        first_day = max((to_date(date_from) - self.start_date).days, 0) if date_from else 0
+        last_day = min((to_date(date_to) - self.start_date).days, self.days - 1) if date_to else self.days - 1
+
+        occupied, known, free = self.occupied, self.known, []
+        for day in range(first_day, last_day + 1):
+            date_str = self._date_strings[day]
+            for key, mask in slots:
+                if not mask:
+                    continue
+                for base in venue_cells:
+                    cell = base + day
+                    if known[cell] & mask == mask and not occupied[cell] & mask:
+                        free.append((self.venues[base // self.days], date_str, key))
+        return free
+
+    def changed_cells(self, previous):
+        """與前一次快照 (相同範圍與場地) 相比，借用或已知狀態有變化的格子。"""
+        return [cell for cell in range(len(self.occupied))
+                if self.occupied[cell] != previous.occupied[cell] or self.known[cell] != previous.known[cell]]
+
+    def freed_slots(self, previous, venue_patterns=("*",), start_hour_keys=None):
+        """
+        前一次快照中不可借用 (已被借用或未知)、這次變成可借用的時段。
+
+        只檢查 changed_cells 回傳的格子，回傳格式與 find_free 相同。
+        """
+        wanted = set(self._venue_cells(venue_patterns))
+        slots = [(key, slot_mask(key)) for key in (start_hour_keys or TIME_SLOTS_MAPPING)]
+        freed = []
+        for cell in self.changed_cells(previous):
+            base, day = divmod(cell, self.days)
+            if base * self.days not in wanted:
+                continue
+            for key, mask in slots:
+                free_now = mask and self.known[cell] & mask == mask and not self.occupied[cell] & mask
+                free_before = previous.known[cell] & mask == mask and not previous.occupied[cell] & mask
+                if free_now and not free_before:
+                    freed.append((self.venues[base], self._date_strings[day], key))
+        freed.sort(key=lambda slot: (slot[1], slot[2]))
+        return freed
+
+
+def parse_schedule_rows(html_content):
+    """
+    從借用清單頁面中取出每一筆借用的 (venue_code, date, start_hour, end_hour)。
+
+    以表格列為單位，只要同一列中出現場地代碼、日期 (YYYY/MM/DD) 與時間區間 (HH~HH)
+    就視為一筆借用，不依賴欄位順序。
+    """
+    if isinstance(html_content, bytes):
+        html_content = html_content.decode("utf-8", errors="replace")
+    bookings = []
+    for row_match in _ROW_RE.finditer(html_content):
+        text = _TAG_RE.sub(" ", row_match.group(1))
+        venue_code = next((code for code in _VENUE_RE.findall(text) if code in VENUE_CODES_MAPPING), None)
+        date_match = _DATE_RE.search(text)
+        hours_match = _HOURS_RE.search(text[date_match.end():] if date_match else text)
+        if not (venue_code and date_match and hours_match):
+            continue
+        try:
+            date = datetime.date(*(int(part) for part in date_match.groups()))
+        except ValueError:
+            continue
+        bookings.append((venue_code, date, int(hours_match.group(1)), int(hours_match.group(2))))
+    return bookings
+
+
+def page_coverage(html_content, bookings=None):
+    """
+    頁面實際列出的 (日期集合, 場地集合)，只有這些 場地 × 日期 的狀態是可信的。
+
+    日期：頁面標示的日期區間 (例如 "2025/06/01 ~ 2025/06/07")；沒有標示時為借用列中出現的日期。
+    場地：借用列中出現的場地。下拉選單 (<select>) 會列出所有場地，不計入；
+          沒有任何借用列的場地無法確認狀態，維持未知。
+
+    Args:
+        bookings (list, optional): parse_schedule_rows 的結果，省略時重新解析。
+    """
+    if isinstance(html_content, bytes):
+        html_content = html_content.decode("utf-8", errors="replace")
+    html_content = _SELECT_RE.sub(" ", html_content)
+    if bookings is None:
+        bookings = parse_schedule_rows(html_content)
+    dates = set()
+    for first, last in _RANGE_RE.findall(html_content):
+        try:
+            first, last = to_date(first), to_date(last)
+        except ValueError:
+            continue
+        dates.update(first + datetime.timedelta(days=i) for i in range((last - first).days + 1))
+    if not dates:
+        dates = {date for _, date, _, _ in bookings}
+    venues = {venue_code for venue_code, _, _, _ in bookings}
+    return dates, venues
+
+
+def build_index(html_pages, start_date, days, venues=None):
+    """
+    由一或多個借用清單頁面建立 SlotIndex。
+
+    只有頁面列出的日期與場地 (見 page_coverage) 標記為已知；其餘格子維持未知，
+    不會因為頁面沒有列出而被當成可借用。
+    """
+    index = SlotIndex(start_date, days, venues)
+    with telemetry.span("parse.schedule") as attrs:
+        count = 0
+        for html_content in html_pages:
+            if isinstance(html_content, bytes):
+                html_content = html_content.decode("utf-8", errors="replace")
+            bookings = parse_schedule_rows(_SELECT_RE.sub(" ", html_content))
+            dates, page_venues = page_coverage(html_content, bookings)
+            for venue_code in page_venues:
+                for date in dates:
+                    index.mark_known(venue_code, date)
+            for venue_code, date, start_hour, end_hour in bookings:
+                count += index.mark_occupied(venue_code, date, start_hour, end_hour)
+        attrs["bookings"] = count
+        attrs["known_cells"] = sum(1 for mask in index.known if mask)
+    return index
+
+
+def fetch_schedule_page(session=None):
+    """
+    GET Default.aspx (登入後的首頁，含借用清單)。
+
+    Returns:
+        bytes: 頁面內容；擷取失敗或登入狀態已失效時回傳 None。
+    """
+    http = session or get_session()
+    try:
+        with telemetry.span("step.availability"):
+            response = http.get(booking_service.BASE_URL, headers=booking_service.COMMON_HEADERS, timeout=15)
+            response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"[availability] 擷取借用清單時發生錯誤: {e}")
+        return None
+    if LOGIN_FORM_MARKER.encode() in response.content:
+        print("[availability] 登入狀態已失效，無法擷取借用清單。")
+        return None
+    return response.content
+
+
+def scrape_availability(start_date, venues=None, session=None):
+    """
+    擷取 Default.aspx 首頁的借用清單並建立 SlotIndex。
+
+    只索引首頁本身列出的借用：不會切換日期或送出場地選擇，首頁沒有列出的日期與場地維持未知。
+    索引範圍為 start_date 到頁面列出的最後一天 (至少一天)。
+
+    Returns:
+        SlotIndex: 擷取失敗或登入狀態已失效時回傳 None (避免把空白頁面當成全部可借用)。
+    """
+    html_content = fetch_schedule_page(session)
+    if html_content is None:
+        return None
+    start_date = to_date(start_date)
+    dates, _ = page_coverage(html_content)
+    days = max([(date - start_date).days + 1 for date in dates] + [1])
+    index = build_index([html_content], start_date, days, venues)
+    known = sum(1 for mask in index.known if mask)
+    print(f"[availability] 已擷取 {start_date.strftime(DATE_FORMAT)} 起 {days} 天的借用狀況 (首頁列出 {known} 個 場地 × 日期)。")
+    return index
+
+
+if __name__ == "__main__":
+    # 回歸檢查：場地選單列出所有場地，但只有借用列中的場地與日期是已知的
+    page = ("<select name=\"ctl00$MainContent$DropDownList1\">"
+            + "".join(f"<option value=\"{code}\">{code}</option>" for code in VENUE_CODES_MAPPING)
+            + "</select><table><tr><td>VOL0A</td><td>2025/06/05</td><td>06~08</td></tr></table>")
+    index = build_index([page], "2025/06/01", 14)
+    assert index.is_free("VOL0A", "2025/06/05", "06") is False
+    assert index.is_free("VOL0A", "2025/06/05", "18") is True
+    assert index.is_free("VOL0C", "2025/06/05", "18") is None
+    assert index.is_free("VOL0A", "2025/06/06", "18") is None
+    free = index.find_free()
+    assert {(venue, date) for venue, date, _ in free} == {("VOL0A", "2025/06/05")}, free
+    print(f"[availability] 回歸檢查通過 (可借用 {len(free)} 個時段，皆為 VOL0A 2025/06/05)。")
@@ -0,0 +1,106 @@
+"""
+比較最終預約 POST 的兩種組法：每次重建 payload dict 交給 requests 編碼，
+以及 BookingPayloadTemplate (同一個表單狀態只編碼一次，之後每個候選只填入變動欄位)。
+
+用法:
+    python benchmarks/bench_booking_template.py [--candidates N] [--viewstate-kb KB] [--repeat N]
+
+每一輪模擬競速時對 N 個候選 (場地 × 時段) 各組一次 body，並先確認兩種寫法的 bytes 完全相同
+(包括欄位值為 None 的候選：requests 會省略該欄位，樣板也必須省略)。
+"""
+import argparse
+import base64
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from requests.models import RequestEncodingMixin  # noqa: E402
+
+from booking_service import FINAL_POST_HEADERS, BookingPayloadTemplate, COMMON_HEADERS, build_booking_payload  # noqa: E402
+from booking_targets import TIME_SLOTS_MAPPING, VENUE_CODES_MAPPING, build_booking_details  # noqa: E402
+
+
+def _synthetic_form_params(viewstate_bytes):
+    """與 trigger_add_application_form 回傳結構相同的表單狀態 (大型 __VIEWSTATE)。"""
+    return {
+        "__VIEWSTATE": base64.b64encode(os.urandom(viewstate_bytes)).decode(),
+        "__VIEWSTATEGENERATOR": "2A9F5B6C",
+        "__EVENTVALIDATION": base64.b64encode(os.urandom(2_000)).decode(),
+        "__RequestVerificationToken": os.urandom(24).hex(),
+        "MainContent_ToolkitScriptManager1_HiddenField_Value": ";;AjaxControlToolkit, Version=4.1.50508.0:zh-TW:abc",
+        "ctl00$MainContent$hfEncryptedYMDH": "vZP1eU+ZCOVm/bjOJHqI0HrBsJf/UaFiPmYxh/LfDHoK58yb0gGJoQ==",
+        "ctl00$MainContent$AppYMDH": "vZP1eU+ZCOVm/bjOJHqI0HrBsJf/UaFiPmYxh/LfDHoK58yb0gGJoQ==",
+        "ctl00$MainContent$hfCaptchaId": os.urandom(8).hex(),
+        "ctl00$MainContent$hfCaptchaImageBase64": "data:image/jpeg;base64," + base64.b64encode(os.urandom(6_000)).decode(),
+    }
+
+
+def _candidates(count):
+    venues, hours = list(VENUE_CODES_MAPPING), list(TIME_SLOTS_MAPPING)
+    return [(venues[i % len(venues)], hours[i % len(hours)]) for i in range(count)]
+
+
+def build_with_dict(form_params, details_list, captcha):
+    """原本的寫法：每個候選重建 headers 與 payload dict，再由 requests 整個 url-encode。"""
+    bodies = []
+    for booking_details in details_list:
+        headers = COMMON_HEADERS.copy()
+        headers.update(FINAL_POST_HEADERS)
+        bodies.append(RequestEncodingMixin._encode_params(build_booking_payload(form_params, booking_details, captcha)))
+    return bodies
+
+
+def build_with_template(form_params, details_list, captcha):
+    """樣板寫法：表單狀態編碼一次，每個候選只編碼變動欄位。"""
+    template = BookingPayloadTemplate(form_params)
+    return [template.render(booking_details, captcha) for booking_details in details_list]
+
+
+def _time(func, args, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=16, help="每輪組幾個候選的 body")
+    parser.add_argument("--viewstate-kb", type=int, default=60, help="模擬 __VIEWSTATE 的大小 (KB)")
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    form_params = _synthetic_form_params(args.viewstate_kb * 1024)
+    details_list = [build_booking_details("2025/06/05", hour, venue, "材料科學與工程學系", "mock@gms.ndhu.edu.tw",
+                                          "0912345678") for venue, hour in _candidates(args.candidates)]
+    captcha = {"hfCaptchaId": form_params["ctl00$MainContent$hfCaptchaId"], "hfCaptchaValue": "AB12"}
+    call_args = (form_params, details_list, captcha)
+
+    # 欄位值為 None 的候選 (例如沒有備註)
+    none_details = [dict(details, note=None, reason=None) for details in details_list[:2]]
+
+    # build_booking_payload 會輸出進度訊息，量測時略過
+    with contextlib.redirect_stdout(io.StringIO()):
+        for checked_details in (details_list, none_details):
+            dict_bodies = [body.encode("ascii") for body in build_with_dict(form_params, checked_details, captcha)]
+            if dict_bodies != build_with_template(form_params, checked_details, captcha):
+                sys.exit("[!] 兩種寫法產生的 body 不一致")
+        dict_ms = _time(build_with_dict, call_args, args.repeat)
+        template_ms = _time(build_with_template, call_args, args.repeat)
+
+    print(f"__VIEWSTATE {args.viewstate_kb} KB，每輪 {args.candidates} 個候選 (中位數)")
+    print(f"{'method':<12} {'per round':>12} {'per candidate':>15}")
+    for label, ms in (("dict", dict_ms), ("template", template_ms)):
+        print(f"{label:<12} {ms:>10.3f}ms {ms / args.candidates:>13.4f}ms")
+    print(f"speedup {dict_ms / template_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
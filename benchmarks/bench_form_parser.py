@@ -0,0 +1,134 @@
+"""
+比較 form_parser 單次掃描擷取器與原本 BeautifulSoup 寫法的速度。
+
+用法:
+    python benchmarks/bench_form_parser.py [錄製的頁面.html ...] [--repeat N]
+
+若沒有提供錄製的頁面，會產生一個帶有大型 __VIEWSTATE 的模擬 Default.aspx。
+每個頁面都會先確認兩種寫法回傳的 dict 完全相同，再各自計時。
+"""
+import argparse
+import base64
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from booking_service import _extract_aspnet_form_params  # noqa: E402
+
+
+def _extract_with_beautifulsoup(html_content):
+    """原本 booking_service._extract_aspnet_form_params 的 BeautifulSoup 寫法 (不含警告輸出)。"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    params = {}
+    for name in ("__VIEWSTATE", "__VIEWSTATEGENERATOR", "__EVENTVALIDATION", "__RequestVerificationToken"):
+        tag = soup.find('input', {'name': name})
+        if tag:
+            params[name] = tag['value']
+
+    tag = soup.find('input', {'name': 'MainContent_ToolkitScriptManager1_HiddenField'})
+    if tag and tag.get('value') is not None:
+        params["MainContent_ToolkitScriptManager1_HiddenField_Value"] = tag['value']
+    else:
+        tag = soup.find('input', {'id': 'MainContent_ToolkitScriptManager1_HiddenField'})
+        if tag and tag.get('value') is not None:
+            params["MainContent_ToolkitScriptManager1_HiddenField_Value"] = tag['value']
+
+    tag = soup.find('input', {'name': 'ctl00$MainContent$hfEncryptedYMDH'})
+    if tag and tag.get('value') is not None:
+        params["ctl00$MainContent$hfEncryptedYMDH"] = tag['value']
+    tag = soup.find('input', {'name': 'ctl00$MainContent$AppYMDH'})
+    if tag and tag.get('value') is not None:
+        params["ctl00$MainContent$AppYMDH"] = tag['value']
+    elif "ctl00$MainContent$hfEncryptedYMDH" in params:
+        params["ctl00$MainContent$AppYMDH"] = params["ctl00$MainContent$hfEncryptedYMDH"]
+
+    for name, key in (
+        ('ctl00$MainContent$hfCaptchaId', 'ctl00$MainContent$hfCaptchaId'),
+        ('ctl00$MainContent$hfCaptchaImageBase64', 'ctl00$MainContent$hfCaptchaImageBase64'),
+        ('ctl00$MainContent$AppDeptTextBox', 'AppDeptTextBox_Value'),
+        ('ctl00$MainContent$EmailTextBox', 'EmailTextBox_Value'),
+        ('ctl00$MainContent$PhoneTextBox', 'PhoneTextBox_Value'),
+        ('ctl00$MainContent$TextBox1', 'TextBox1_Value'),
+    ):
+        tag = soup.find('input', {'name': name})
+        if tag and tag.get('value') is not None:
+            params[key] = tag['value']
+    return params
+
+
+def _synthetic_page(viewstate_bytes=120_000, rows=300):
+    """產生一個結構類似 Default.aspx 的模擬頁面 (大型 __VIEWSTATE + 預約列表)。"""
+    viewstate = base64.b64encode(os.urandom(viewstate_bytes)).decode()
+    captcha = "data:image/jpeg;base64," + base64.b64encode(os.urandom(6_000)).decode()
+    table_rows = "".join(
+        f'<tr><td align="center" style="white-space:nowrap;">VOL0{chr(65 + i % 8)}</td>'
+        f'<td>2025/06/{1 + i % 28:02d}</td><td>{6 + i % 16:02d}~{8 + i % 16:02d}</td><td>運動 &amp; 練習</td></tr>'
+        for i in range(rows)
+    )
+    return f"""<!DOCTYPE html><html><head><title>場地借用</title></head><body>
+<form method="post" action="./Default.aspx" id="form1">
+<div class="aspNetHidden">
+<input type="hidden" name="MainContent_ToolkitScriptManager1_HiddenField" id="MainContent_ToolkitScriptManager1_HiddenField" value=";;AjaxControlToolkit, Version=4.1.50508.0:zh-TW:abc" />
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />
+</div>
+<input name="__RequestVerificationToken" type="hidden" value="tok-{os.urandom(16).hex()}" />
+<div class="aspNetHidden">
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="2A9F5B6C" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{base64.b64encode(os.urandom(2_000)).decode()}" />
+</div>
+<input type="hidden" name="ctl00$MainContent$hfEncryptedYMDH" id="MainContent_hfEncryptedYMDH" value="vZP1eU+ZCOVm/bjOJHqI0HrBsJf/UaFiPmYxh/LfDHoK58yb0gGJoQ==" />
+<input type="hidden" name="ctl00$MainContent$hfCaptchaId" id="MainContent_hfCaptchaId" value="{os.urandom(8).hex()}" />
+<input type="hidden" name="ctl00$MainContent$hfCaptchaImageBase64" id="MainContent_hfCaptchaImageBase64" value="{captcha}" />
+<input name="ctl00$MainContent$AppDeptTextBox" type="text" value="材料科學與工程學系" id="MainContent_AppDeptTextBox" />
+<input name="ctl00$MainContent$EmailTextBox" type="text" value="someone@gms.ndhu.edu.tw" id="MainContent_EmailTextBox" />
+<input name="ctl00$MainContent$PhoneTextBox" type="text" value="0912345678" id="MainContent_PhoneTextBox" />
+<input name="ctl00$MainContent$TextBox1" type="text" value="2025/06/02" id="MainContent_TextBox1" />
+<table id="MainContent_GridView1">{table_rows}</table>
+</form></body></html>"""
+
+
+def _time(func, html_content, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(html_content)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", help="錄製的 login.aspx / Default.aspx HTML 檔案")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, "rb") as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        pages = [("synthetic Default.aspx", _synthetic_page().encode("utf-8"))]
+
+    print(f"{'page':<32} {'size':>9} {'bs4 median':>12} {'single-pass':>12} {'speedup':>8}")
+    for label, content in pages:
+        text = content.decode("utf-8", errors="replace")
+        expected = _extract_with_beautifulsoup(text)
+        actual = _extract_aspnet_form_params(content)
+        if expected != actual:
+            diff = sorted(k for k in set(expected) | set(actual) if expected.get(k) != actual.get(k))
+            print(f"[!] {label}: 兩種寫法結果不一致，差異欄位: {diff}")
+            continue
+        bs_median, _ = _time(_extract_with_beautifulsoup, text, args.repeat)
+        fast_median, _ = _time(_extract_aspnet_form_params, content, args.repeat)
+        print(f"{label:<32} {len(content):>9} {bs_median:>10.2f}ms {fast_median:>10.3f}ms {bs_median / fast_median:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+以本機替身伺服器 (mock_ndhu_server) 量測預約流程各步驟與端到端延遲。
+
+每一輪都會重新建立 session，依序執行
+LoginClient.login → trigger_add_application_form → make_booking_post_request，
+最後回報每個步驟與整體的 p50 / p95 / p99 (毫秒)。OCR 不在量測範圍內
+(直接使用替身伺服器接受的答案)。
+
+    python benchmarks/bench_pipeline.py --iterations 50 --latency-ms 40 --jitter-ms 10
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_ndhu_server import MOCK_CAPTCHA_TEXT, MockNDHUServer, point_clients_at  # noqa: E402
+from booking_service import BookingStatus, trigger_add_application_form, make_booking_post_request  # noqa: E402
+from booking_targets import build_booking_details  # noqa: E402
+from http_client import get_session, reset_session  # noqa: E402
+import rate_limiter  # noqa: E402
+import telemetry  # noqa: E402
+from login_module import LoginClient  # noqa: E402
+
+STEPS = ("login", "add_application", "final_post", "end_to_end")
+
+
+def percentile(samples, pct):
+    """最近排名法 (nearest-rank) 百分位數。"""
+    ordered = sorted(samples)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def run_once():
+    """執行一輪完整流程，回傳各步驟耗時 (毫秒)；任一步驟失敗時丟出 RuntimeError。"""
+    reset_session()
+    timings = {}
+    started_at = time.perf_counter()
+
+    step_start = time.perf_counter()
+    active_session, login_response, _ = LoginClient("bench", "bench", session=get_session()).login()
+    timings["login"] = (time.perf_counter() - step_start) * 1000
+    if not (active_session and login_response):
+        raise RuntimeError("登入失敗")
+
+    step_start = time.perf_counter()
+    add_app_response, _, form_params = trigger_add_application_form(session=active_session)
+    timings["add_application"] = (time.perf_counter() - step_start) * 1000
+    if not (add_app_response and form_params):
+        raise RuntimeError("trigger_add_application_form 失敗")
+
+    booking_details = build_booking_details("2025/06/05", "06", "VOL0C", "系所", "mock@gms.ndhu.edu.tw", "0912345678")
+    captcha_details = {"hfCaptchaId": form_params["ctl00$MainContent$hfCaptchaId"], "hfCaptchaValue": MOCK_CAPTCHA_TEXT}
+    step_start = time.perf_counter()
+    result = make_booking_post_request(None, form_params, booking_details, captcha_details, session=active_session)
+    timings["final_post"] = (time.perf_counter() - step_start) * 1000
+    if result.status is BookingStatus.ERROR:
+        raise RuntimeError("make_booking_post_request 失敗")
+
+    timings["end_to_end"] = (time.perf_counter() - started_at) * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="替身伺服器每個回應注入的延遲 (毫秒)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--viewstate-kb", type=int, default=60, help="模擬頁面 __VIEWSTATE 的大小 (KB)")
+    parser.add_argument("--fixtures", default=None, help="錄製頁面目錄 (見 mock_ndhu_server.FIXTURE_FILES)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, metavar="RATE",
+                        help="rate_limiter 每個 host 的初始速率 (預設 0：停用，只量測流程本身)")
+    parser.add_argument("--verbose", action="store_true", help="顯示各模組的輸出")
+    args = parser.parse_args()
+    rate_limiter.configure(args.rate_limit)
+    telemetry.enable_from_env()  # NDHU_TRACE_FILE (環境變數或 .env)
+
+    server = MockNDHUServer(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                            fixtures_dir=args.fixtures, viewstate_bytes=args.viewstate_kb * 1024).start()
+    restore_urls = point_clients_at(server.base_url)
+    samples = {step: [] for step in STEPS}
+    failures = 0
+    try:
+        for i in range(args.warmup + args.iterations):
+            output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            try:
+                with output:
+                    timings = run_once()
+            except RuntimeError as e:
+                failures += 1
+                print(f"[bench] 第 {i + 1} 輪失敗: {e}")
+                continue
+            if i >= args.warmup:
+                for step in STEPS:
+                    samples[step].append(timings[step])
+    finally:
+        restore_urls()
+        reset_session()
+        server.stop()
+
+    print(f"[bench] 替身伺服器延遲 {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms，"
+          f"{len(samples['end_to_end'])} 輪成功，{failures} 輪失敗")
+    print(f"{'step':<18} {'p50':>9} {'p95':>9} {'p99':>9}  (ms)")
+    for step in STEPS:
+        if samples[step]:
+            print(f"{step:<18} {percentile(samples[step], 50):>9.2f} {percentile(samples[step], 95):>9.2f} "
+                  f"{percentile(samples[step], 99):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+"""
+常駐預約服務：登入一次後保持 session、連線池與 OCR client 溫熱，透過本機 HTTP API
+(Unix socket 或 127.0.0.1 的 TCP 埠) 接收預約工作，並以 NDJSON 即時回傳各步驟耗時與結果。
+
+    python booking_daemon.py --socket /tmp/ndhu.sock
+    python booking_daemon.py --port 8765
+
+API：
+  POST /jobs        內容為一筆工作 (欄位同 booking_jobs 的工作檔：date, venue, hours[, priority, reason, note])
+                    或 {"jobs": [...]}。回應為 NDJSON，每行一個事件：
+                      {"event": "queued", ...}   已排入佇列
+                      {"event": "started", ...}  開始執行
+                      {"event": "step", ...}     一個步驟完成 (span 名稱、毫秒與屬性，同 telemetry 的 JSON line)
+                      {"event": "result", ...}   工作結束 (status、venue_code、start_hour_key、elapsed)
+                    加上 ?wait=0 時只回傳工作編號，之後以 GET /jobs/<id> 查詢。
+  GET  /jobs        最近的工作與狀態
+  GET  /jobs/<id>   單一工作的狀態與結果
+  GET  /health      登入狀態、佇列長度與運行時間
+
+Unix socket 以 0600 權限建立，只有同一使用者可以連線。TCP 模式下任何本機程式 (包括瀏覽器中的網頁) 都能連到
+127.0.0.1，因此每個請求都必須帶 token (Authorization: Bearer <token>)：token 取自 NDHU_DAEMON_TOKEN，
+沒有設定時使用 (或產生) 權限 0600 的 .daemon_token 檔。
+
+    curl --unix-socket /tmp/ndhu.sock -d '{"date": "2025/06/05", "venue": "VOL0*", "hours": "18"}' http://localhost/jobs
+    curl -H "Authorization: Bearer $(cat .daemon_token)" -d '{"date": "2025/06/05", "venue": "VOL0*", "hours": "18"}' \
+         http://127.0.0.1:8765/jobs
+"""
+import argparse
+import hmac
+import itertools
+import json
+import os
+import queue
+import secrets
+import socketserver
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rate_limiter
+import settings
+import telemetry
+from booking_jobs import make_job, run_jobs_sync
+from booking_service import CAPTCHA_RETRY_ATTEMPTS
+from http_client import get_session
+from login_module import perform_login
+from session_cache import is_session_valid, restore_or_login
+
+# 登入狀態與連線的保溫間隔 (秒)；ASP.NET session 與 keep-alive 連線閒置過久都會失效
+DEFAULT_KEEPALIVE = 90.0
+# GET /jobs 保留的最近工作數
+MAX_KEPT_JOBS = 200
+# TCP 模式的存取 token
+TOKEN_ENV = "NDHU_DAEMON_TOKEN"
+DEFAULT_TOKEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".daemon_token")
+
+
+@dataclass
+class DaemonJob:
+    """一筆已提交的工作。events 為提交者的事件佇列 (同一次提交的工作共用)。"""
+    id: str
+    job: object
+    events: queue.Queue
+    submitted_at: float = field(default_factory=time.time)
+    state: str = "queued"  # queued / running / done
+    result: dict = None
+
+    def emit(self, event, **data):
+        self.events.put(dict(event=event, job=self.id, **data))
+
+    def summary(self):
+        return {"job": self.id, "state": self.state, "describe": self.job.describe(), "priority": self.job.priority,
+                "submitted_at": self.submitted_at, "result": self.result}
+
+
+class BookingDaemon:
+    """
+    保持登入的 session 並以 job_concurrency 個工作執行緒執行提交的工作 (依 priority 由高到低)。
+
+    Args:
+        ocr_name (str, optional): 驗證碼辨識方式 ("gemini" / "local" / "hedged" / "router")。
+        job_concurrency (int, optional): 同時執行的工作數。
+        captcha_attempts (int, optional): 每個候選最多送出幾次最終 POST。
+        keepalive (float, optional): 確認登入狀態 (並保持連線) 的間隔秒數。
+        use_session_cache (bool, optional): 登入時是否使用 session_cache 的快取。
+    """
+
+    def __init__(self, ocr_name="gemini", job_concurrency=2, captcha_attempts=CAPTCHA_RETRY_ATTEMPTS,
+                 keepalive=DEFAULT_KEEPALIVE, use_session_cache=True):
+        self.ocr_name = ocr_name
+        self.job_concurrency = job_concurrency
+        self.captcha_attempts = captcha_attempts
+        self.keepalive = keepalive
+        self.use_session_cache = use_session_cache
+        self.session = get_session()
+        self.logged_in = False
+        self.last_probe = None
+        self.started_at = time.time()
+        self.ocr_func = None
+        self.user_details = {}
+        self._queue = queue.PriorityQueue()
+        self._jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """登入並預先載入 OCR 與預約模組，再啟動工作與保溫執行緒。登入失敗時丟出 RuntimeError。"""
+        settings.load_env()
+        telemetry.enable()
+        self.user_details = {
+            "department": settings.getenv("USER_DEPARTMENT", "材料科學與工程學系"),
+            "email": settings.getenv("USER_EMAIL", "your_email@gms.ndhu.edu.tw"),
+            "phone": settings.getenv("USER_PHONE", "0912345678"),
+        }
+        if not self.ensure_login():
+            raise RuntimeError("登入失敗")
+        self._warm_up()
+        for i in range(self.job_concurrency):
+            self._threads.append(threading.Thread(target=self._worker, name=f"daemon-job-{i}", daemon=True))
+        self._threads.append(threading.Thread(target=self._keepalive_loop, name="daemon-keepalive", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for _ in range(self.job_concurrency):
+            self._queue.put((float("inf"), 0, None))
+
+    def _warm_up(self):
+        """先建立 OCR client 並 import 預約流程用到的模組，讓第一筆工作不必付出這些成本。"""
+        import captcha_preprocess
+        from main import resolve_ocr_func
+        captcha_preprocess.warm_up()
+        self.ocr_func = resolve_ocr_func(self.ocr_name)
+        if self.ocr_name in ("gemini", "hedged"):
+            from gemini_service import get_client
+            get_client()
+        elif self.ocr_name == "router":
+            self.ocr_func.warm_up()
+        import booking_engine  # noqa: F401  (asyncio 等)
+
+    def ensure_login(self, force=False):
+        """登入狀態失效 (或 force) 時重新登入；回傳是否為已登入狀態。"""
+        with self._login_lock:
+            if self.logged_in and not force:
+                return True
+            self.session.cookies.clear()
+            login = lambda: perform_login(session=self.session)  # noqa: E731
+            if self.use_session_cache:
+                active_session, login_response, _ = restore_or_login(login, settings.getenv("NDHU_USERNAME"),
+                                                                     session=self.session)
+            else:
+                active_session, login_response, _ = login()
+            self.logged_in = bool(active_session and login_response)
+            self.last_probe = time.time()
+            print(f"[booking_daemon] {'已登入' if self.logged_in else '登入失敗'}。")
+            return self.logged_in
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive):
+            valid = is_session_valid(self.session)
+            self.last_probe = time.time()
+            if not valid:
+                print("[booking_daemon] 登入狀態已失效，重新登入。")
+                self.logged_in = False
+                self.ensure_login()
+
+    def submit(self, jobs, events=None):
+        """將 BookingJob 排入佇列，回傳 DaemonJob 清單。events 為接收事件的佇列 (預設每次提交各自一個)。"""
+        events = events or queue.Queue()
+        submitted = []
+        with self._jobs_lock:
+            for job in jobs:
+                daemon_job = DaemonJob(str(next(self._ids)), job, events)
+                self._jobs[daemon_job.id] = daemon_job
+                while len(self._jobs) > MAX_KEPT_JOBS:
+                    self._jobs.popitem(last=False)
+                submitted.append(daemon_job)
+        for daemon_job in submitted:
+            daemon_job.emit("queued", describe=daemon_job.job.describe(), priority=daemon_job.job.priority)
+            self._queue.put((-daemon_job.job.priority, int(daemon_job.id), daemon_job))
+        return submitted
+
+    def get_job(self, job_id):
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._jobs_lock:
+            return [daemon_job.summary() for daemon_job in self._jobs.values()]
+
+    def health(self):
+        with self._jobs_lock:
+            states = [daemon_job.state for daemon_job in self._jobs.values()]
+        health = {"logged_in": self.logged_in, "last_probe": self.last_probe, "ocr": self.ocr_name,
+                  "uptime": round(time.time() - self.started_at, 1), "queued": states.count("queued"),
+                  "running": states.count("running"), "done": states.count("done")}
+        if hasattr(self.ocr_func, "snapshot"):
+            health["ocr_backends"] = self.ocr_func.snapshot()  # ocr_router 各後端的統計與斷路狀態
+        limiter = rate_limiter.get_limiter()
+        if limiter is not None:
+            health["rate_limits"] = limiter.snapshot()
+        return health
+
+    def _worker(self):
+        while True:
+            _, _, daemon_job = self._queue.get()
+            if daemon_job is None:
+                return
+            self._run(daemon_job)
+
+    def _run(self, daemon_job):
+        daemon_job.state = "running"
+        daemon_job.emit("started", describe=daemon_job.job.describe())
+        started_at = time.perf_counter()
+        try:
+            if not self.ensure_login():
+                raise RuntimeError("登入失敗")
+            with telemetry.collect(lambda line: daemon_job.emit("step", **line)):
+                job_result = run_jobs_sync([daemon_job.job], self.user_details, ocr_func=self.ocr_func,
+                                           session=self.session, max_concurrent=1,
+                                           captcha_attempts=self.captcha_attempts)[0]
+            daemon_job.result = {
+                "status": str(job_result.status), "venue_code": job_result.venue_code,
+                "start_hour_key": job_result.start_hour_key, "attempts": job_result.attempts,
+            }
+        except Exception as e:
+            print(f"[booking_daemon] 工作 {daemon_job.id} 發生錯誤: {e}")
+            daemon_job.result = {"status": "error", "error": str(e)}
+        daemon_job.result["elapsed"] = round(time.perf_counter() - started_at, 3)
+        daemon_job.state = "done"
+        daemon_job.emit("result", **daemon_job.result)
+
+
+def parse_job_request(body):
+    """
+    將 POST /jobs 的 JSON 內容轉成 BookingJob 清單。
+
+    Raises:
+        ValueError: JSON 格式錯誤或有無效的工作 (所有錯誤一次列出)。
+    """
+    try:
+        data = json.loads(body or b"null")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON 格式錯誤: {e}") from None
+    rows = data.get("jobs") if isinstance(data, dict) and "jobs" in data else [data]
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("沒有工作")
+    jobs, errors = [], []
+    for i, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            errors.append(f"第 {i} 筆: 格式錯誤")
+            continue
+        try:
+            jobs.append(make_job(row, source=f"第 {i} 筆"))
+        except ValueError as e:
+            errors.append(f"第 {i} 筆: {e}")
+    if errors:
+        raise ValueError("; ".join(errors))
+    return jobs
+
+
+def load_token(path=DEFAULT_TOKEN_PATH):
+    """TCP 模式的存取 token：NDHU_DAEMON_TOKEN，沒有設定時讀取 token 檔 (不存在時產生，權限 0600)。"""
+    token = settings.getenv(TOKEN_ENV)
+    if token:
+        return token
+    try:
+        with open(path, encoding="utf-8") as f:
+            token = f.read().strip()
+    except FileNotFoundError:
+        token = None
+    if not token:
+        token = secrets.token_urlsafe(32)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(token + "\n")
+        print(f"[booking_daemon] 已產生存取 token: {path}")
+    return token
+
+
+def _make_handler(daemon, token=None):
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "NDHUBookingDaemon/1.0"
+
+        def _authorized(self):
+            """token 不為 None 時，請求必須帶 Authorization: Bearer <token>；否則回應 401。"""
+            if token is None:
+                return True
+            scheme, _, presented = (self.headers.get("Authorization") or "").partition(" ")
+            if scheme.lower() == "bearer" and hmac.compare_digest(presented.strip().encode(), token.encode()):
+                return True
+            self._send_json({"error": "需要有效的 token (Authorization: Bearer <token>)"}, 401)
+            return False
+
+        def log_message(self, format, *args):
+            # Unix socket 沒有 client_address，不使用預設的格式
+            print(f"[booking_daemon] {self.command} {self.path} - {format % args}")
+
+        def _send_json(self, data, status=200):
+            body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+            if path == "/health":
+                self._send_json(daemon.health())
+            elif path == "/jobs":
+                self._send_json({"jobs": daemon.list_jobs()})
+            elif path.startswith("/jobs/"):
+                daemon_job = daemon.get_job(path[len("/jobs/"):])
+                if daemon_job is None:
+                    self._send_json({"error": "找不到工作"}, 404)
+                else:
+                    self._send_json(daemon_job.summary())
+            else:
+                self._send_json({"error": "找不到路徑"}, 404)
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            url = urllib.parse.urlsplit(self.path)
+            if url.path.rstrip("/") != "/jobs":
+                self._send_json({"error": "找不到路徑"}, 404)
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            try:
+                jobs = parse_job_request(body)
+            except ValueError as e:
+                self._send_json({"error": str(e)}, 400)
+                return
+            wait = urllib.parse.parse_qs(url.query).get("wait", ["1"])[0] not in ("0", "false")
+            submitted = daemon.submit(jobs)
+            if not wait:
+                self._send_json({"jobs": [daemon_job.id for daemon_job in submitted]}, 202)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.end_headers()
+            remaining = len(submitted)
+            events = submitted[0].events
+            while remaining:
+                event = events.get()
+                if event["event"] == "result":
+                    remaining -= 1
+                try:
+                    self.wfile.write((json.dumps(event, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                except OSError:
+                    # 提交者已離線；工作仍會執行完畢，結果可用 GET /jobs/<id> 查詢
+                    return
+
+    return Handler
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(daemon, socket_path=None, host="127.0.0.1", port=8765, token=None):
+    """
+    啟動 HTTP API 並持續服務 (Ctrl+C 結束)。
+
+    Args:
+        token (str, optional): 每個請求都必須帶的 token。TCP 模式一定需要，未指定時使用 load_token()；
+                               Unix socket 模式以檔案權限限制存取，只在有指定時檢查。
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # bind 時 socket 檔就以 0600 建立，不會短暫地讓其他使用者連線
+        previous_umask = os.umask(0o177)
+        try:
+            server = _UnixHTTPServer(socket_path, _make_handler(daemon, token))
+        finally:
+            os.umask(previous_umask)
+        os.chmod(socket_path, 0o600)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), _make_handler(daemon, token or load_token()))
+        address = f"http://{host}:{server.server_address[1]}"
+    print(f"[booking_daemon] 服務已啟動: {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[booking_daemon] 停止服務。")
+    finally:
+        server.server_close()
+        daemon.stop()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=None, metavar="PATH", help="Unix socket 路徑 (未指定時使用 TCP)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ocr", choices=["gemini", "local", "hedged", "router"], default="gemini")
+    parser.add_argument("--job-concurrency", type=int, default=2, help="同時執行的工作數 (預設 2)")
+    parser.add_argument("--captcha-attempts", type=int, default=CAPTCHA_RETRY_ATTEMPTS)
+    parser.add_argument("--keepalive", type=float, default=DEFAULT_KEEPALIVE,
+                        help=f"確認登入狀態並保持連線的間隔秒數 (預設 {DEFAULT_KEEPALIVE:.0f})")
+    parser.add_argument("--no-session-cache", action="store_true", help="不使用登入狀態快取")
+    parser.add_argument("--trace", default=None, metavar="FILE", help="同時將各步驟耗時寫入 FILE (JSON lines)")
+    parser.add_argument("--rate-limit", type=float, default=None, metavar="RATE",
+                        help="每個 host 每秒的初始請求數 (0 停用限速與重試，見 rate_limiter.py)")
+    args = parser.parse_args(argv)
+    if args.captcha_attempts < 1:
+        parser.error("--captcha-attempts 至少為 1")
+
+    if args.trace:
+        telemetry.enable(args.trace)
+    else:
+        telemetry.enable_from_env()
+    if args.rate_limit is not None:
+        rate_limiter.configure(args.rate_limit)
+    daemon = BookingDaemon(ocr_name=args.ocr, job_concurrency=args.job_concurrency,
+                           captcha_attempts=args.captcha_attempts, keepalive=args.keepalive,
+                           use_session_cache=not args.no_session_cache)
+    try:
+        daemon.start()
+    except RuntimeError as e:
+        print(f"[booking_daemon] 無法啟動：{e}")
+        return
+    serve(daemon, socket_path=args.socket, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
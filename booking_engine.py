@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+
+from booking_service import trigger_add_application_form, book_with_captcha_retry, BookingStatus, CAPTCHA_RETRY_ATTEMPTS
+from booking_targets import build_booking_details
+from http_client import get_session
+
+
+def _candidate_result(venue_code, start_hour_key, status, started_at, response=None, error=None):
+    return {
+        "venue_code": venue_code,
+        "start_hour_key": start_hour_key,
+        "status": status,  # booking_service.BookingStatus (等同 "success" / "captcha_rejected" / ... 字串)
+        "response": response,
+        "error": error,
+        "elapsed": time.perf_counter() - started_at,
+    }
+
+
+async def _run_candidate(venue_code, start_hour_key, date, user_details, ocr_func, session, semaphore,
+                         captcha_pool=None, captcha_attempts=CAPTCHA_RETRY_ATTEMPTS, stop_event=None):
+    """
+    對單一 (場地, 時段) 候選執行 新增申請 → 驗證碼辨識 → 最終 POST (驗證碼錯誤時直接重試)。
+    stop_event 被設定後 (其他候選已成功) 不再進入下一個步驟，也不再送出最終 POST。
+    """
+    async with semaphore:
+        started_at = time.perf_counter()
+        tag = f"[booking_engine {venue_code}@{start_hour_key}]"
+        if stop_event is not None and stop_event.is_set():
+            return _candidate_result(venue_code, start_hour_key, BookingStatus.CANCELLED, started_at,
+                                     error="其他候選已成功，未開始")
+
+        add_app_response, _, form_params = await asyncio.to_thread(
+            trigger_add_application_form, session=session
+        )
+        if not (add_app_response and form_params):
+            return _candidate_result(venue_code, start_hour_key, "error", started_at, error="觸發「新增申請」表單失敗")
+
+        # Use form values if they exist, otherwise fallback to the caller's defaults
+        booking_details = build_booking_details(
+            date, start_hour_key, venue_code,
+            department=form_params.get("AppDeptTextBox_Value") or user_details["department"],
+            email=form_params.get("EmailTextBox_Value") or user_details["email"],
+            phone=form_params.get("PhoneTextBox_Value") or user_details["phone"],
+            reason=user_details.get("reason", "運動"),
+            note=user_details.get("note", "自動預約測試"),
+        )
+        if booking_details is None:
+            return _candidate_result(venue_code, start_hour_key, "error", started_at, error="無效的場地或時段")
+
+        print(f"{tag} 辨識驗證碼並送出最終預約 POST...")
+        result = await asyncio.to_thread(
+            book_with_captcha_retry, form_params, booking_details, ocr_func, session, captcha_attempts, captcha_pool,
+            stop_event,
+        )
+        if result.status is BookingStatus.ERROR:
+            return _candidate_result(venue_code, start_hour_key, result.status, started_at,
+                                     error=f"驗證碼處理或最終預約 POST 請求失敗: {result.error}")
+        if result.status is BookingStatus.CANCELLED:
+            return _candidate_result(venue_code, start_hour_key, result.status, started_at,
+                                     error=f"其他候選已成功，停止送出 (已送出 {result.attempts} 次)")
+
+        print(f"{tag} 結果: {result.status} (共送出 {result.attempts} 次，讀取 {result.bytes_read} bytes)")
+        return _candidate_result(venue_code, start_hour_key, result.status, started_at, response=result.response)
+
+
+async def race_bookings(candidates, date, user_details, ocr_func=None, session=None, max_parallel=None,
+                        captcha_pool=None, captcha_attempts=CAPTCHA_RETRY_ATTEMPTS):
+    """
+    同時對多個 (場地, 時段) 候選執行預約流程，第一個確認成功後停止其餘流程。
+
+    其餘候選在工作執行緒中執行，無法中途取消：成功後設定 stop_event，它們在下一次驗證碼辨識或
+    最終 POST 前停止。已經送出的最終 POST 無法撤回，因此會等所有候選結束，其中也成功的 (重複預約)
+    一併列在 results 並印出警告 (見 also_booked)。
+
+    Args:
+        candidates (list): (venue_code, start_hour_key) 清單，例如 booking_targets.expand_candidates 的結果。
+        date (str): 預約日期，格式 "YYYY/MM/DD"。
+        user_details (dict): department / email / phone (以及選填的 reason / note) 的預設值，
+                             表單有預填時以表單為準。
+        ocr_func (callable, optional): 驗證碼辨識函式，預設為 gemini_service.get_text_from_image_gemini。
+        session (requests.Session, optional): 已登入的 session，預設為 http_client 的共用 session。
+        max_parallel (int, optional): 同時進行的候選數量上限，預設為全部同時進行。
+        captcha_pool (captcha_pool.CaptchaPool, optional): 表單接受外部驗證碼時使用的預先辨識池。
+        captcha_attempts (int, optional): 每個候選最多送出幾次最終 POST (驗證碼錯誤時重試)。
+
+    Returns:
+        tuple: (winner, results)。winner 為第一個成功的候選結果 dict (沒有則為 None)，
+               results 為所有候選的結果 (停止的候選為 BookingStatus.CANCELLED)。
+    """
+    if ocr_func is None:
+        from gemini_service import get_text_from_image_gemini
+        ocr_func = get_text_from_image_gemini
+    session = session or get_session()
+    semaphore = asyncio.Semaphore(max_parallel or max(len(candidates), 1))
+    stop_event = threading.Event()
+
+    pending = {
+        asyncio.create_task(
+            _run_candidate(venue, hour, date, user_details, ocr_func, session, semaphore, captcha_pool,
+                           captcha_attempts, stop_event)
+        )
+        for venue, hour in candidates
+    }
+    results = []
+    winner = None
+    try:
+        while pending:
+            # 有人成功後仍等其餘候選結束 (它們會在下一個最終 POST 前停止)，已送出的成功預約才不會被漏掉
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    print(f"[booking_engine] 候選流程發生未預期錯誤: {task.exception()}")
+                    continue
+                result = task.result()
+                results.append(result)
+                if result["status"] == "success" and winner is None:
+                    winner = result
+                    stop_event.set()
+        for result in also_booked(winner, results):
+            print(f"[booking_engine] 警告：{result['venue_code']}@{result['start_hour_key']} 也預約成功 (重複預約)，"
+                  f"請確認並取消多餘的預約。")
+        return winner, results
+    finally:
+        # 被外部取消時：停止仍在工作執行緒中的候選
+        stop_event.set()
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def also_booked(winner, results):
+    """winner 之外也預約成功的候選結果 (其他候選的最終 POST 在停止前已經送出)。"""
+    return [result for result in results if result["status"] == "success" and result is not winner]
+
+
+def run_race(candidates, date, user_details, **kwargs):
+    """race_bookings 的同步包裝，供 main 等同步程式呼叫。"""
+    return asyncio.run(race_bookings(candidates, date, user_details, **kwargs))
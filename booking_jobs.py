@@ -0,0 +1,234 @@
+"""
+批次預約：從工作檔讀取多筆 (日期, 場地, 時段, 優先順序, 事由/備註)，事先驗證後依優先順序
+以有限的同時數執行，並回報每一筆的結果。
+
+工作檔格式 (依副檔名判斷)：
+
+  CSV   標題列 date,venue,hours[,priority,reason,note]
+  TOML  [[jobs]] 陣列，欄位同上 (hours 可為字串或陣列)
+  YAML  jobs: 清單 (或直接是清單)，欄位同上，需要 PyYAML
+
+欄位說明：
+  venue     場地代碼，可使用萬用字元 (例如 "VOL0*")，多個以逗號分隔
+  hours     開始時段索引，例如 "18"、"18,19" 或範圍 "17-19" (含兩端)；依序為備選，
+            每筆工作最多預約一個時段
+  priority  數字越大越先執行 (預設 0)
+"""
+import asyncio
+import csv
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from booking_engine import race_bookings
+from booking_service import CAPTCHA_RETRY_ATTEMPTS
+from booking_targets import TIME_SLOTS_MAPPING, expand_candidates, expand_venues
+from http_client import get_session
+
+JOB_FIELDS = ("date", "venue", "hours", "priority", "reason", "note")
+DEFAULT_REASON = "運動"
+DEFAULT_NOTE = "自動預約測試"
+
+
+@dataclass
+class BookingJob:
+    """一筆預約工作。source 為工作檔中的位置 (用於錯誤訊息)。"""
+    date: str
+    venues: list
+    hours: list
+    priority: int = 0
+    reason: str = DEFAULT_REASON
+    note: str = DEFAULT_NOTE
+    source: str = ""
+
+    def candidates(self):
+        """(venue_code, start_hour_key) 候選清單，順序即優先順序。"""
+        return expand_candidates(self.venues, self.hours)
+
+    def describe(self):
+        return f"{self.date} {','.join(self.venues)} @ {','.join(self.hours)}"
+
+
+@dataclass
+class JobResult:
+    """一筆工作的執行結果。status 同 booking_engine 的候選結果 (另有 "skipped")。"""
+    job: BookingJob
+    status: str
+    venue_code: str = None
+    start_hour_key: str = None
+    elapsed: float = 0.0
+    attempts: list = field(default_factory=list)
+
+
+def _split(value):
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value or "").split(",") if item.strip()]
+
+
+def parse_hours(value):
+    """將 "18"、"18,19"、"17-19" 或清單轉成時段索引清單 (兩位數字串)。"""
+    hours = []
+    for item in _split(value):
+        if "-" in item:
+            start, end = (int(part) for part in item.split("-", 1))
+            keys = [f"{hour:02d}" for hour in range(start, end + 1)]
+        else:
+            keys = [f"{int(item):02d}" if item.isdigit() else item]
+        hours.extend(key for key in keys if key not in hours)
+    return hours
+
+
+def _normalize_date(value):
+    value = str(value).strip()
+    for fmt in ("%Y/%m/%d", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y/%m/%d")
+        except ValueError:
+            continue
+    raise ValueError(f"日期 '{value}' 格式錯誤 (應為 YYYY/MM/DD)")
+
+
+def make_job(row, source=""):
+    """
+    由一列資料建立並驗證 BookingJob。
+
+    Raises:
+        ValueError: 日期、場地或時段無效 (場地需對應到 VENUE_CODES_MAPPING，時段需在 TIME_SLOTS_MAPPING 中)。
+    """
+    unknown_fields = set(row) - set(JOB_FIELDS)
+    if unknown_fields:
+        raise ValueError(f"未知的欄位 {sorted(unknown_fields)}")
+    date = _normalize_date(row.get("date", ""))
+    venues = _split(row.get("venue"))
+    if not venues:
+        raise ValueError("缺少 venue")
+    unmatched = [pattern for pattern in venues if not expand_venues([pattern])]
+    if unmatched:
+        raise ValueError(f"場地 {unmatched} 不在 VENUE_CODES_MAPPING 中")
+    try:
+        hours = parse_hours(row.get("hours"))
+    except ValueError:
+        raise ValueError(f"時段 '{row.get('hours')}' 格式錯誤") from None
+    if not hours:
+        raise ValueError("缺少 hours")
+    invalid_hours = [key for key in hours if key not in TIME_SLOTS_MAPPING]
+    if invalid_hours:
+        raise ValueError(f"時段 {invalid_hours} 不在 TIME_SLOTS_MAPPING 中")
+    try:
+        priority = int(row.get("priority") or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"priority '{row.get('priority')}' 不是整數") from None
+    return BookingJob(date=date, venues=venues, hours=hours, priority=priority,
+                      reason=str(row.get("reason") or DEFAULT_REASON), note=str(row.get("note") or DEFAULT_NOTE),
+                      source=source)
+
+
+def _read_rows(path):
+    lower_path = path.lower()
+    if lower_path.endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            return [{k: v for k, v in row.items() if v not in (None, "")} for row in csv.DictReader(f)]
+    if lower_path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f).get("jobs", [])
+    if lower_path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("讀取 YAML 工作檔需要 PyYAML (pip install pyyaml)") from None
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f) or []
+        return data.get("jobs", []) if isinstance(data, dict) else data
+    raise ValueError(f"不支援的工作檔格式: {path} (請使用 .csv / .toml / .yaml)")
+
+
+def load_jobs(path):
+    """
+    讀取並驗證工作檔。所有錯誤會一次列出，任何一筆無效就不執行。
+
+    Returns:
+        list: BookingJob 清單 (依檔案順序)。
+
+    Raises:
+        ValueError: 格式不支援或有無效的工作。
+    """
+    rows = _read_rows(path)
+    jobs, errors = [], []
+    for i, row in enumerate(rows, 1):
+        source = f"{path} 第 {i} 筆"
+        if not isinstance(row, dict):
+            errors.append(f"{source}: 格式錯誤")
+            continue
+        try:
+            jobs.append(make_job(row, source))
+        except ValueError as e:
+            errors.append(f"{source}: {e}")
+    if errors:
+        raise ValueError("工作檔有誤：\n  " + "\n  ".join(errors))
+    if not jobs:
+        raise ValueError(f"工作檔 {path} 中沒有工作")
+    return jobs
+
+
+async def _job_worker(queue, results, user_details, ocr_func, session, captcha_pool, captcha_attempts):
+    while True:
+        try:
+            _, _, job = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        started_at = time.perf_counter()
+        print(f"[booking_jobs] 開始 {job.describe()} (優先順序 {job.priority})")
+        details = dict(user_details, reason=job.reason, note=job.note)
+        winner, attempts = await race_bookings(job.candidates(), job.date, details, ocr_func=ocr_func,
+                                               session=session, max_parallel=1, captcha_pool=captcha_pool,
+                                               captcha_attempts=captcha_attempts)
+        if winner:
+            result = JobResult(job, "success", winner["venue_code"], winner["start_hour_key"])
+        else:
+            statuses = {attempt["status"] for attempt in attempts}
+            result = JobResult(job, "error" if statuses <= {"error"} else "failure")
+        result.elapsed = time.perf_counter() - started_at
+        result.attempts = [{key: attempt[key] for key in ("venue_code", "start_hour_key", "status", "error")}
+                           for attempt in attempts]
+        results[id(job)] = result
+        print(f"[booking_jobs] 完成 {job.describe()}: {result.status}")
+
+
+async def run_jobs(jobs, user_details, ocr_func=None, session=None, max_concurrent=2, captcha_pool=None,
+                   captcha_attempts=CAPTCHA_RETRY_ATTEMPTS):
+    """
+    依優先順序執行工作，同時最多 max_concurrent 筆，共用同一個已登入的 session。
+
+    每筆工作內的候選依序嘗試 (max_parallel=1)，第一個成功即停止，避免同一筆工作預約到多個時段。
+
+    Returns:
+        list: JobResult 清單，順序與 jobs 相同。
+    """
+    session = session or get_session()
+    queue = asyncio.PriorityQueue()
+    for index, job in enumerate(jobs):
+        queue.put_nowait((-job.priority, index, job))
+    results = {}
+    await asyncio.gather(*(
+        _job_worker(queue, results, user_details, ocr_func, session, captcha_pool, captcha_attempts)
+        for _ in range(max(1, min(max_concurrent, len(jobs))))
+    ))
+    return [results.get(id(job)) or JobResult(job, "skipped") for job in jobs]
+
+
+def run_jobs_sync(jobs, user_details, **kwargs):
+    """run_jobs 的同步包裝。"""
+    return asyncio.run(run_jobs(jobs, user_details, **kwargs))
+
+
+def print_job_results(results):
+    succeeded = sum(result.status == "success" for result in results)
+    print(f"\n[booking_jobs] {len(results)} 筆工作，{succeeded} 筆成功：")
+    for result in results:
+        booked = f" → {result.venue_code}@{result.start_hour_key}" if result.status == "success" else ""
+        print(f"  [{result.status:<8}] {result.job.describe()}{booked} ({result.elapsed:.2f}s)")
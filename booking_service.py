@@ -1,6 +1,13 @@
+import re
 import requests
-from bs4 import BeautifulSoup
+import threading
 import urllib.parse
+from dataclasses import dataclass, field
+from enum import Enum
+from form_parser import HiddenFieldExtractor, StreamMatcher, extract_input_values
+from http_client import get_session, merge_cookies, get_cookies
+from captcha_service import solve_form_captcha, report_captcha_verdict
+import telemetry
 
 # Base URL for the sports facility booking page
 BASE_URL = "https://sys.ndhu.edu.tw/gc/sportcenter/SportsFields/Default.aspx"
@@ -19,76 +26,122 @@ COMMON_HEADERS = {
     "Sec-Fetch-Site": "same-origin",
 }
 
+# Input names read from Default.aspx, mapped to the keys used in the returned params dict.
+ASPNET_FORM_FIELDS = {
+    # Standard ASP.NET parameters
+    "__VIEWSTATE": "__VIEWSTATE",
+    "__VIEWSTATEGENERATOR": "__VIEWSTATEGENERATOR",
+    "__EVENTVALIDATION": "__EVENTVALIDATION",
+    "__RequestVerificationToken": "__RequestVerificationToken",
+    # ToolkitScriptManager HiddenField
+    "MainContent_ToolkitScriptManager1_HiddenField": "MainContent_ToolkitScriptManager1_HiddenField_Value",
+    # Booking specific parameters
+    "ctl00$MainContent$hfEncryptedYMDH": "ctl00$MainContent$hfEncryptedYMDH",
+    "ctl00$MainContent$AppYMDH": "ctl00$MainContent$AppYMDH",
+    # Captcha related parameters
+    "ctl00$MainContent$hfCaptchaId": "ctl00$MainContent$hfCaptchaId",
+    "ctl00$MainContent$hfCaptchaImageBase64": "ctl00$MainContent$hfCaptchaImageBase64",
+    "ctl00$MainContent$hfCaptchaErrMsg": "ctl00$MainContent$hfCaptchaErrMsg",
+    # User details that might be pre-filled in the form
+    "ctl00$MainContent$AppDeptTextBox": "AppDeptTextBox_Value",
+    "ctl00$MainContent$EmailTextBox": "EmailTextBox_Value",
+    "ctl00$MainContent$PhoneTextBox": "PhoneTextBox_Value",
+    # Date textbox (TextBox1)
+    "ctl00$MainContent$TextBox1": "TextBox1_Value",
+}
+# Fields that may only be found by ID (name is more common for form submission)
+ASPNET_FORM_FIELD_IDS = ("MainContent_ToolkitScriptManager1_HiddenField",)
+# Params that must be present in a page before its form can be posted back
+REQUIRED_FORM_PARAMS = [
+    "__VIEWSTATE", "__VIEWSTATEGENERATOR", "__EVENTVALIDATION",
+    "__RequestVerificationToken", "MainContent_ToolkitScriptManager1_HiddenField_Value"
+]
+# Total final POST attempts (first try + retries) when the captcha is rejected
+CAPTCHA_RETRY_ATTEMPTS = 3
+
+# Streamed reads stop as soon as these inputs (by name) have been seen
+PAGE_STATE_FIELDS = (
+    "__VIEWSTATE", "__VIEWSTATEGENERATOR", "__EVENTVALIDATION", "__RequestVerificationToken",
+    "MainContent_ToolkitScriptManager1_HiddenField",
+)
+# Everything the final booking payload takes from the Add Application page
+# (AppYMDH is only replaced by hfEncryptedYMDH when the page really lacks it, so reading must not stop before it)
+ADD_APPLICATION_FIELDS = PAGE_STATE_FIELDS + (
+    "ctl00$MainContent$hfEncryptedYMDH", "ctl00$MainContent$AppYMDH", "ctl00$MainContent$hfCaptchaId",
+    "ctl00$MainContent$hfCaptchaImageBase64", "ctl00$MainContent$AppDeptTextBox", "ctl00$MainContent$EmailTextBox",
+    "ctl00$MainContent$PhoneTextBox", "ctl00$MainContent$TextBox1",
+)
+# What a captcha-rejection page must provide for an immediate retry
+REJECTION_RETRY_FIELDS = PAGE_STATE_FIELDS + ("ctl00$MainContent$hfCaptchaId", "ctl00$MainContent$hfCaptchaImageBase64")
+# Substrings used to judge the final booking response
+SUCCESS_INDICATORS = ["預約成功", "成功借用"]
+# Checked before FAILURE_INDICATORS: a wrong captcha is worth retrying, other failures are not
+CAPTCHA_REJECTED_INDICATORS = ["驗證碼錯誤", "驗證碼不正確", "驗證碼輸入錯誤"]
+FAILURE_INDICATORS = ["失敗", "錯誤", "已被預約", "無法借用"]
+STREAM_CHUNK_SIZE = 16 * 1024
+RESPONSE_PREVIEW_CHARS = 1000
+
+class BookingStatus(str, Enum):
+    """Verdict of a final booking POST. Values equal the plain strings used before, so comparisons still work."""
+    SUCCESS = "success"
+    CAPTCHA_REJECTED = "captcha_rejected"
+    FAILURE = "failure"
+    UNKNOWN = "unknown"
+    ERROR = "error"
+    CANCELLED = "cancelled"  # not sent: another racing candidate already succeeded
+
+    def __str__(self):
+        return self.value
+
+@dataclass
+class BookingResult:
+    """
+    Typed outcome of a final booking POST.
+    `matched` lists the indicators that were seen; `complete` is False when reading stopped early,
+    in which case `preview` only covers the bytes read. `form_params` is filled for captcha rejections
+    (the state needed to retry); `attempts` counts final POSTs sent by book_with_captcha_retry.
+    """
+    status: BookingStatus
+    response: requests.Response = None
+    status_code: int = None
+    matched: tuple = ()
+    form_params: dict = field(default_factory=dict)
+    bytes_read: int = 0
+    complete: bool = True
+    preview: str = ""
+    attempts: int = 1
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.status is BookingStatus.SUCCESS
+
 def _extract_aspnet_form_params(html_content):
-    """Helper function to extract ASP.NET form parameters and user details from HTML."""
-    soup = BeautifulSoup(html_content, 'html.parser')
+    """
+    Helper function to extract ASP.NET form parameters and user details from HTML.
+    Uses the single-pass extractor in form_parser; accepts str or bytes.
+    """
+    with telemetry.span("parse.aspnet_form", bytes=len(html_content)):
+        by_name, by_id = extract_input_values(html_content, ASPNET_FORM_FIELDS, ASPNET_FORM_FIELD_IDS)
+        return _build_aspnet_form_params(by_name, by_id)
+
+def _build_aspnet_form_params(by_name, by_id):
+    """Maps raw input values (by name / by id) to the params dict used by the booking steps."""
     params = {}
+    for field_name, param_key in ASPNET_FORM_FIELDS.items():
+        if field_name in by_name:
+            params[param_key] = by_name[field_name]
 
-    # Standard ASP.NET parameters
-    viewstate = soup.find('input', {'name': '__VIEWSTATE'})
-    if viewstate: params["__VIEWSTATE"] = viewstate['value']
-    
-    viewstategenerator = soup.find('input', {'name': '__VIEWSTATEGENERATOR'})
-    if viewstategenerator: params["__VIEWSTATEGENERATOR"] = viewstategenerator['value']
-    
-    eventvalidation = soup.find('input', {'name': '__EVENTVALIDATION'})
-    if eventvalidation: params["__EVENTVALIDATION"] = eventvalidation['value']
-    
-    requestverificationtoken_form = soup.find('input', {'name': '__RequestVerificationToken'})
-    if requestverificationtoken_form: params["__RequestVerificationToken"] = requestverificationtoken_form['value']
-    
-    # ToolkitScriptManager HiddenField
-    toolkit_script_manager_field = soup.find('input', {'name': 'MainContent_ToolkitScriptManager1_HiddenField'})
-    if toolkit_script_manager_field and toolkit_script_manager_field.get('value') is not None:
-        params["MainContent_ToolkitScriptManager1_HiddenField_Value"] = toolkit_script_manager_field['value']
-    else:
+    if "MainContent_ToolkitScriptManager1_HiddenField_Value" not in params:
         # Try finding by ID as a fallback, though name is more common for form submission
-        toolkit_script_manager_field_by_id = soup.find('input', {'id': 'MainContent_ToolkitScriptManager1_HiddenField'})
-        if toolkit_script_manager_field_by_id and toolkit_script_manager_field_by_id.get('value') is not None:
-            params["MainContent_ToolkitScriptManager1_HiddenField_Value"] = toolkit_script_manager_field_by_id['value']
+        if "MainContent_ToolkitScriptManager1_HiddenField" in by_id:
+            params["MainContent_ToolkitScriptManager1_HiddenField_Value"] = by_id["MainContent_ToolkitScriptManager1_HiddenField"]
         else:
             print("Warning: MainContent_ToolkitScriptManager1_HiddenField not found in HTML.")
 
-
-    # Booking specific parameters
-    hf_encrypted_ymdh_tag = soup.find('input', {'name': 'ctl00$MainContent$hfEncryptedYMDH'})
-    if hf_encrypted_ymdh_tag and hf_encrypted_ymdh_tag.get('value') is not None:
-        params["ctl00$MainContent$hfEncryptedYMDH"] = hf_encrypted_ymdh_tag['value']
-        
-    app_ymdh_tag = soup.find('input', {'name': 'ctl00$MainContent$AppYMDH'})
-    if app_ymdh_tag and app_ymdh_tag.get('value') is not None:
-        params["ctl00$MainContent$AppYMDH"] = app_ymdh_tag['value']
-    elif "ctl00$MainContent$hfEncryptedYMDH" in params: 
+    if "ctl00$MainContent$AppYMDH" not in params and "ctl00$MainContent$hfEncryptedYMDH" in params:
         params["ctl00$MainContent$AppYMDH"] = params["ctl00$MainContent$hfEncryptedYMDH"]
 
-    # Captcha related parameters
-    hf_captcha_id_tag = soup.find('input', {'name': 'ctl00$MainContent$hfCaptchaId'})
-    if hf_captcha_id_tag and hf_captcha_id_tag.get('value') is not None:
-        params["ctl00$MainContent$hfCaptchaId"] = hf_captcha_id_tag['value']
-        
-    hf_captcha_image_base64_tag = soup.find('input', {'name': 'ctl00$MainContent$hfCaptchaImageBase64'})
-    if hf_captcha_image_base64_tag and hf_captcha_image_base64_tag.get('value') is not None:
-        params["ctl00$MainContent$hfCaptchaImageBase64"] = hf_captcha_image_base64_tag['value']
-
-    # User details that might be pre-filled in the form
-    app_dept_textbox = soup.find('input', {'name': 'ctl00$MainContent$AppDeptTextBox'})
-    if app_dept_textbox and app_dept_textbox.get('value') is not None:
-        params["AppDeptTextBox_Value"] = app_dept_textbox['value']
-        
-    email_textbox = soup.find('input', {'name': 'ctl00$MainContent$EmailTextBox'})
-    if email_textbox and email_textbox.get('value') is not None:
-        params["EmailTextBox_Value"] = email_textbox['value']
-        
-    phone_textbox = soup.find('input', {'name': 'ctl00$MainContent$PhoneTextBox'})
-    if phone_textbox and phone_textbox.get('value') is not None:
-        params["PhoneTextBox_Value"] = phone_textbox['value']
-    
-    # Date textbox (TextBox1)
-    date_textbox = soup.find('input', {'name': 'ctl00$MainContent$TextBox1'})
-    if date_textbox and date_textbox.get('value') is not None:
-        params["TextBox1_Value"] = date_textbox['value']
-
-
     # Check for essential ASP.NET params
     required_asp_params = ["__VIEWSTATE", "__VIEWSTATEGENERATOR", "__EVENTVALIDATION", "__RequestVerificationToken", "MainContent_ToolkitScriptManager1_HiddenField_Value"]
     if not all(k in params for k in required_asp_params):
@@ -97,35 +150,125 @@ def _extract_aspnet_form_params(html_content):
 
     return params
 
-def get_initial_page_and_cookies(session_cookies):
+def _release_connection(response):
+    """
+    Hands a partially read streamed response to a background thread that drains the rest,
+    so its keep-alive connection goes back to the pool without the caller waiting for the page.
+    """
+    def drain():
+        try:
+            response.raw.drain_conn()
+            response.raw.release_conn()
+        except Exception:
+            response.close()
+    threading.Thread(target=drain, name="drain-response", daemon=True).start()
+
+def _has_fields(extractor, fields):
+    return all(name in extractor.by_name or name in extractor.by_id for name in fields)
+
+def _stream_form_params(response, stop_fields, span_name):
+    """Reads a streamed response until every input in `stop_fields` was seen (or EOF) and returns the params dict."""
+    extractor = HiddenFieldExtractor(ASPNET_FORM_FIELDS, ASPNET_FORM_FIELD_IDS)
+    with telemetry.span(span_name) as attrs:
+        bytes_read, stopped_early = 0, False
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            bytes_read += len(chunk)
+            extractor.feed(chunk)
+            if _has_fields(extractor, stop_fields):
+                stopped_early = True
+                break
+        extractor.close()
+        attrs.update(bytes=bytes_read, early=stopped_early)
+    if stopped_early:
+        _release_connection(response)
+    return _build_aspnet_form_params(extractor.by_name, extractor.by_id)
+
+def read_booking_response(response, venue_code=None):
+    """
+    Streams the final booking response through an incremental matcher and returns a BookingResult.
+    Stops reading as soon as a success indicator appears, or a captcha-rejection indicator appears
+    and the fields needed for a retry have been seen; other verdicts need the whole page
+    (a success indicator may still follow).
+    """
+    success_indicators = list(SUCCESS_INDICATORS)
+    if venue_code:
+        success_indicators.append(f'<td align="center" style="white-space:nowrap;">{venue_code}</td>')
+    matcher = StreamMatcher(success_indicators + CAPTCHA_REJECTED_INDICATORS + FAILURE_INDICATORS)
+    extractor = HiddenFieldExtractor(ASPNET_FORM_FIELDS, ASPNET_FORM_FIELD_IDS)
+    head = bytearray()
+    bytes_read, stopped_early = 0, False
+
+    with telemetry.span("read.final_post") as attrs:
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            bytes_read += len(chunk)
+            if len(head) < RESPONSE_PREVIEW_CHARS * 3:
+                head += chunk[:RESPONSE_PREVIEW_CHARS * 3 - len(head)]
+            extractor.feed(chunk)
+            matcher.feed(chunk)
+            if matcher.any_found(success_indicators):
+                stopped_early = True
+                break
+            if (matcher.any_found(CAPTCHA_REJECTED_INDICATORS)
+                    and _has_fields(extractor, REJECTION_RETRY_FIELDS)):
+                stopped_early = True
+                break
+        extractor.close()
+        status = _verdict(matcher, success_indicators)
+        attrs.update(bytes=bytes_read, early=stopped_early, status=status.value)
+    if stopped_early:
+        _release_connection(response)
+
+    result = BookingResult(
+        status=status, response=response, status_code=response.status_code, matched=tuple(matcher.found),
+        bytes_read=bytes_read, complete=not stopped_early,
+        preview=bytes(head).decode(response.encoding or "utf-8", errors="replace")[:RESPONSE_PREVIEW_CHARS],
+    )
+    if status is BookingStatus.CAPTCHA_REJECTED:
+        result.form_params = _build_aspnet_form_params(extractor.by_name, extractor.by_id)
+    return result
+
+def _verdict(matcher, success_indicators):
+    if matcher.any_found(success_indicators):
+        return BookingStatus.SUCCESS
+    if matcher.any_found(CAPTCHA_REJECTED_INDICATORS):
+        return BookingStatus.CAPTCHA_REJECTED
+    if matcher.any_found(FAILURE_INDICATORS):
+        return BookingStatus.FAILURE
+    return BookingStatus.UNKNOWN
+
+def get_initial_page_and_cookies(session_cookies=None, session=None):
     """
     Performs a GET request to the booking page to retrieve initial form parameters and cookies.
     This is a preparatory step.
+    The request goes through the shared pooled session (or `session`); `session_cookies`,
+    if given, are merged into its cookie jar first.
     """
     print("[get_initial_page_and_cookies] Fetching initial page...")
     headers = COMMON_HEADERS.copy()
     headers["Sec-Fetch-User"] = "?1" 
     headers["Priority"] = "u=0, i"   
     
-    current_cookies = session_cookies.copy()
+    http = session or get_session()
+    merge_cookies(session_cookies, http)
 
     try:
-        response = requests.get(BASE_URL, headers=headers, cookies=current_cookies, timeout=10, verify=False)
+        response = http.get(BASE_URL, headers=headers, timeout=10)
         response.raise_for_status()
         
-        form_params = _extract_aspnet_form_params(response.text)
-        current_cookies.update(response.cookies.get_dict())
+        form_params = _extract_aspnet_form_params(response.content)
         
         print(f"[get_initial_page_and_cookies] Successfully fetched. Cookies updated: {response.cookies.get_dict()}")
-        return response.text, form_params, current_cookies
+        return response.text, form_params, get_cookies(http)
     except requests.exceptions.RequestException as e:
         print(f"Error during initial GET request: {e}")
-        return None, None, current_cookies
+        return None, None, get_cookies(http)
 
-def trigger_add_application_form(session_cookies_after_login):
+@telemetry.timed("step.add_application")
+def trigger_add_application_form(session_cookies_after_login=None, session=None):
     """
     Simulates clicking the '新增申請' (Add Application) button.
     This typically refreshes the form and may present a CAPTCHA and pre-fill user data.
+    Both requests reuse the shared pooled session (or `session`) and its cookie jar.
     """
     print("\n[trigger_add_application_form] Starting 'Add Application' POST simulation...")
     
@@ -135,29 +278,26 @@ def trigger_add_application_form(session_cookies_after_login):
     get_headers["Sec-Fetch-User"] = "?1" 
     get_headers["Priority"] = "u=0, i"
 
-    current_cookies = session_cookies_after_login.copy()
+    http = session or get_session()
+    merge_cookies(session_cookies_after_login, http)
 
     try:
-        response_get = requests.get(BASE_URL, headers=get_headers, cookies=current_cookies, timeout=10, verify=False)
+        response_get = http.get(BASE_URL, headers=get_headers, timeout=10, stream=True)
         response_get.raise_for_status()
         print("[trigger_add_application_form] GET request successful.")
-        current_cookies.update(response_get.cookies.get_dict())
-        print(f"[trigger_add_application_form] Cookies after GET: {current_cookies}")
+        print(f"[trigger_add_application_form] Cookies after GET: {get_cookies(http)}")
         
-        params_from_get = _extract_aspnet_form_params(response_get.text)
-        required_params_for_add_app = [
-            "__VIEWSTATE", "__VIEWSTATEGENERATOR", "__EVENTVALIDATION", 
-            "__RequestVerificationToken", "MainContent_ToolkitScriptManager1_HiddenField_Value"
-        ]
+        params_from_get = _stream_form_params(response_get, PAGE_STATE_FIELDS, "read.default_get")
+        required_params_for_add_app = REQUIRED_FORM_PARAMS
         if not all(k in params_from_get for k in required_params_for_add_app):
             missing_params = [k for k in required_params_for_add_app if k not in params_from_get]
             print(f"[trigger_add_application_form] Error: Missing critical ASP.NET/Toolkit parameters after GET: {missing_params}")
-            return None, current_cookies, None
+            return None, get_cookies(http), None
         print("[trigger_add_application_form] Successfully extracted ASP.NET/Toolkit parameters from GET response.")
 
     except requests.exceptions.RequestException as e:
         print(f"[trigger_add_application_form] Error during pre-POST GET request: {e}")
-        return None, current_cookies, None
+        return None, get_cookies(http), None
 
     # Use the dynamically extracted ToolkitScriptManager value from the GET response
     toolkit_script_manager_value_add_app = params_from_get["MainContent_ToolkitScriptManager1_HiddenField_Value"]
@@ -197,19 +337,17 @@ def trigger_add_application_form(session_cookies_after_login):
     
     print("[trigger_add_application_form] Step 3: Sending POST request...")
     try:
-        response_post = requests.post(BASE_URL, headers=post_headers, cookies=current_cookies, data=payload, timeout=15, verify=False)
+        response_post = http.post(BASE_URL, headers=post_headers, data=payload, timeout=15, stream=True)
         response_post.raise_for_status()
         print(f"[trigger_add_application_form] 'Add Application' POST successful. Status: {response_post.status_code}")
         
-        current_cookies.update(response_post.cookies.get_dict())
+        current_cookies = get_cookies(http)
         print(f"[trigger_add_application_form] Cookies after POST: {current_cookies}")
 
-        new_form_params_from_post_html = _extract_aspnet_form_params(response_post.text)
+        new_form_params_from_post_html = _stream_form_params(response_post, ADD_APPLICATION_FIELDS,
+                                                             "read.add_application")
         # Check for essential params in the *new* form state for the *next* request
-        required_params_for_final_booking = [
-            "__VIEWSTATE", "__VIEWSTATEGENERATOR", "__EVENTVALIDATION", 
-            "__RequestVerificationToken", "MainContent_ToolkitScriptManager1_HiddenField_Value"
-        ]
+        required_params_for_final_booking = REQUIRED_FORM_PARAMS
         if not all(k in new_form_params_from_post_html for k in required_params_for_final_booking):
             missing_final_params = [k for k in required_params_for_final_booking if k not in new_form_params_from_post_html]
             print(f"[trigger_add_application_form] Warning: Missing critical ASP.NET/Toolkit parameters from 'Add Application' POST response HTML (for next step): {missing_final_params}")
@@ -222,22 +360,14 @@ def trigger_add_application_form(session_cookies_after_login):
         print(f"[trigger_add_application_form] Error during 'Add Application' POST request: {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"Response status: {e.response.status_code}, Text (first 300): {e.response.text[:300]}...")
-        return None, current_cookies, None
+        return None, get_cookies(http), None
 
-def make_booking_post_request(session_cookies, form_parameters, booking_details, captcha_details):
+def build_booking_payload(form_parameters, booking_details, captcha_details):
     """
-    Makes the POST request to book a sports facility (final submission).
-    `form_parameters` should now contain `MainContent_ToolkitScriptManager1_HiddenField_Value`
-    extracted from the response of `trigger_add_application_form`.
+    Builds the form payload for the final booking POST.
+    Split out of `make_booking_post_request` so callers (e.g. the release-time sniper)
+    can prepare it ahead of time and only send it at the last moment.
     """
-    print("\n[make_booking_post_request] Starting final booking POST...")
-    post_headers = COMMON_HEADERS.copy()
-    post_headers.update({
-        "Cache-Control": "max-age=0", "Content-Type": "application/x-www-form-urlencoded",
-        "Origin": "https://sys.ndhu.edu.tw", "Referer": BASE_URL,
-        "Sec-Fetch-User": "?1", "Priority": "u=0, i"
-    })
-
     # Dynamically get the ToolkitScriptManager value from the previous step's form parameters
     toolkit_script_manager_final_booking = form_parameters.get("MainContent_ToolkitScriptManager1_HiddenField_Value")
     if not toolkit_script_manager_final_booking:
@@ -277,17 +407,182 @@ def make_booking_post_request(session_cookies, form_parameters, booking_details,
     }
     print(f"[make_booking_post_request] Payload prepared. VIEWSTATE (first 30): {payload.get('__VIEWSTATE', '')[:30]}...")
     # print(f"Final booking payload: {payload}") # For debugging
+    return payload
+
+# Headers of the final booking POST; built once instead of on every attempt
+FINAL_POST_HEADERS = {
+    **COMMON_HEADERS,
+    "Cache-Control": "max-age=0", "Content-Type": "application/x-www-form-urlencoded",
+    "Origin": "https://sys.ndhu.edu.tw", "Referer": BASE_URL,
+    "Sec-Fetch-User": "?1", "Priority": "u=0, i",
+}
+# Values made only of these characters (base64 __VIEWSTATE, __EVENTVALIDATION, ...) are url-encoded
+# with three str.replace calls, which is ~10x faster than quote_plus on large values
+_BASE64_VALUE_RE = re.compile(r"[A-Za-z0-9+/=]*")
 
+def _quote_form_value(value):
+    if _BASE64_VALUE_RE.fullmatch(value):
+        return value.replace("+", "%2B").replace("/", "%2F").replace("=", "%3D")
+    return urllib.parse.quote_plus(value)
+
+class _Slot(str):
+    """Placeholder passed through build_booking_payload to mark a per-attempt field."""
+
+class BookingPayloadTemplate:
+    """
+    Pre-encoded body of the final booking POST for one form state.
+    The constant fields (__VIEWSTATE, __EVENTVALIDATION, captcha image, ...) are url-encoded once;
+    `render` only encodes the per-candidate fields (venue, date, hours, user details, captcha)
+    and joins the segments into the bytes `requests` would have produced for the payload dict.
+    """
+    BOOKING_SLOTS = ("time_slot_plain", "department", "email", "phone", "start_hour", "end_hour",
+                     "reason", "note", "venue_code", "date")
+    CAPTCHA_SLOTS = ("hfCaptchaId", "hfCaptchaValue")
+
+    def __init__(self, form_parameters):
+        payload = build_booking_payload(
+            form_parameters,
+            {key: _Slot(key) for key in self.BOOKING_SLOTS},
+            {key: _Slot(key) for key in self.CAPTCHA_SLOTS},
+        )
+        # Pre-joined runs of constant "name=value" pairs (str) and per-attempt (quoted name, slot) tuples
+        self._parts = []
+        constant = []
+        for name, value in payload.items():
+            if value is None:  # requests drops None values as well
+                continue
+            if isinstance(value, _Slot):
+                if constant:
+                    self._parts.append("&".join(constant))
+                    constant = []
+                self._parts.append((urllib.parse.quote_plus(name), str(value)))
+            else:
+                constant.append(f"{urllib.parse.quote_plus(name)}={_quote_form_value(str(value))}")
+        if constant:
+            self._parts.append("&".join(constant))
+
+    def render(self, booking_details, captcha_details):
+        """Returns the urlencoded body (bytes) for one candidate / captcha; None values are left out like requests does."""
+        values = {**booking_details, **captcha_details}
+        body = []
+        for part in self._parts:
+            if isinstance(part, str):
+                body.append(part)
+                continue
+            name, slot = part
+            value = values.get(slot, "")
+            if value is not None:
+                body.append(f"{name}={urllib.parse.quote_plus(str(value))}")
+        return "&".join(body).encode("ascii")
+
+@telemetry.timed("step.final_post")
+def send_booking_post(payload, session_cookies=None, session=None, venue_code=None):
+    """
+    Sends a payload built by `build_booking_payload` (dict) or `BookingPayloadTemplate.render` (bytes)
+    and streams the verdict out of the response. `venue_code` defaults to the payload's venue
+    when it is a dict. Returns a BookingResult; its status is BookingStatus.ERROR when the request failed.
+    """
+    if venue_code is None and isinstance(payload, dict):
+        venue_code = payload.get("ctl00$MainContent$DropDownList1")
     try:
-        response = requests.post(BASE_URL, headers=post_headers, cookies=session_cookies, data=payload, timeout=15, verify=False)
+        http = session or get_session()
+        merge_cookies(session_cookies, http)
+        response = http.post(BASE_URL, headers=FINAL_POST_HEADERS, data=payload, timeout=15, stream=True)
         response.raise_for_status()
         print(f"[make_booking_post_request] Final booking POST successful. Status: {response.status_code}")
-        return response
+        return read_booking_response(response, venue_code)
     except requests.exceptions.RequestException as e:
         print(f"Error during final booking POST request: {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"Response status: {e.response.status_code}, Text (first 300): {e.response.text[:300]}...")
+            return BookingResult(BookingStatus.ERROR, e.response, e.response.status_code, error=str(e))
+        return BookingResult(BookingStatus.ERROR, error=str(e))
+
+def make_booking_post_request(session_cookies, form_parameters, booking_details, captcha_details, session=None,
+                              template=None):
+    """
+    Makes the POST request to book a sports facility (final submission).
+    `form_parameters` should now contain `MainContent_ToolkitScriptManager1_HiddenField_Value`
+    extracted from the response of `trigger_add_application_form`.
+    `session_cookies` may be None when the shared session's cookie jar already holds the login state.
+    Pass a `template` built from the same `form_parameters` to skip re-encoding the form state.
+    Returns a BookingResult (see `send_booking_post`).
+    """
+    print("\n[make_booking_post_request] Starting final booking POST...")
+    template = template or BookingPayloadTemplate(form_parameters)
+    body = template.render(booking_details, captcha_details)
+    return send_booking_post(body, session_cookies, session, venue_code=booking_details["venue_code"])
+
+def evaluate_booking_response(response_text, venue_code=None):
+    """
+    Classifies a complete final booking response (str or bytes) in one pass.
+    A row showing `venue_code` in the application list also counts as success.
+    Streamed responses are classified by `read_booking_response` instead.
+    """
+    success_indicators = list(SUCCESS_INDICATORS)
+    if venue_code:
+        success_indicators.append(f'<td align="center" style="white-space:nowrap;">{venue_code}</td>')
+    matcher = StreamMatcher(success_indicators + CAPTCHA_REJECTED_INDICATORS + FAILURE_INDICATORS)
+    matcher.feed(response_text)
+    return _verdict(matcher, success_indicators)
+
+def form_params_after_rejection(result, form_parameters):
+    """
+    Builds the params for the next attempt from a captcha-rejection BookingResult.
+    The rejection page carries a fresh __VIEWSTATE/__EVENTVALIDATION (and usually a new
+    hfCaptchaId/image); the spent captcha is dropped so a missing one gets fetched anew.
+    Values the rejection page lacks (e.g. pre-filled user details) are kept from `form_parameters`.
+    Returns None when the page lacks the state needed to post back.
+    """
+    new_params = result.form_params
+    missing_params = [k for k in REQUIRED_FORM_PARAMS if k not in new_params]
+    if missing_params:
+        print(f"[book_with_captcha_retry] Rejection page lacks {missing_params}; cannot retry from it.")
         return None
+    merged_params = dict(form_parameters)
+    merged_params.pop("ctl00$MainContent$hfCaptchaId", None)
+    merged_params.pop("ctl00$MainContent$hfCaptchaImageBase64", None)
+    merged_params.update(new_params)
+    return merged_params
+
+def book_with_captcha_retry(form_parameters, booking_details, ocr_func, session=None,
+                            max_attempts=CAPTCHA_RETRY_ATTEMPTS, captcha_pool=None, stop_event=None):
+    """
+    Solves the captcha and sends the final booking POST; while the server rejects the captcha,
+    re-solves it from the rejection response and resubmits right away (no login / Add Application).
+    Returns the last BookingResult with `attempts` set; its status is BookingStatus.ERROR
+    when the captcha could not be solved or the POST failed.
+    `stop_event` (threading.Event) is checked before every captcha solve and final POST; once it is set
+    nothing more is sent and the result is BookingStatus.CANCELLED (`attempts` counts the POSTs sent).
+    """
+    result = None
+    max_attempts = max(1, max_attempts)  # always send at least one final POST
+    for attempt in range(1, max_attempts + 1):
+        if stop_event is not None and stop_event.is_set():
+            result = BookingResult(BookingStatus.CANCELLED, error="cancelled before solving the captcha")
+            attempt -= 1
+            break
+        captcha_id, captcha_text = solve_form_captcha(form_parameters, ocr_func, session, captcha_pool)
+        if captcha_id is None:
+            result = BookingResult(BookingStatus.ERROR, error="captcha could not be solved")
+            break
+        if stop_event is not None and stop_event.is_set():
+            result = BookingResult(BookingStatus.CANCELLED, error="cancelled before the final POST")
+            attempt -= 1
+            break
+        result = make_booking_post_request(None, form_parameters, booking_details,
+                                           {"hfCaptchaId": captcha_id, "hfCaptchaValue": captcha_text}, session)
+        report_captcha_verdict(captcha_text, result.status)
+        if result.status is not BookingStatus.CAPTCHA_REJECTED:
+            break
+        print(f"[book_with_captcha_retry] Captcha \"{captcha_text}\" rejected (attempt {attempt}/{max_attempts}).")
+        if attempt == max_attempts:
+            break
+        form_parameters = form_params_after_rejection(result, form_parameters)
+        if form_parameters is None:
+            break
+    result.attempts = attempt
+    return result
 
 if __name__ == '__main__':
     print("Testing booking_service.py (individual functions)...")
@@ -342,8 +637,8 @@ if __name__ == '__main__':
                 mock_captcha_details_final
             )
 
-            if final_booking_response:
-                print("make_booking_post_request: Success (request sent).")
+            if final_booking_response.status is not BookingStatus.ERROR:
+                print(f"make_booking_post_request: Success (request sent, verdict: {final_booking_response.status}).")
                 print(f"  Response Status: {final_booking_response.status_code}")
             else:
                 print("make_booking_post_request: Failed (or critical param missing).")
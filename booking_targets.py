@@ -0,0 +1,103 @@
+import fnmatch
+
+# Time slots mapping based on user's guide
+TIME_SLOTS_MAPPING = {
+    "06": "[申請]06~08", "07": "[申請]07~09", "08": "[申請]08~10", "09": "[申請]09~11",
+    "10": "[申請]10~12", "11": "[申請]11~13", "12": "[申請]12~14", "13": "[申請]13~15",
+    "14": "[申請]14~16", "15": "[申請]15~17", "16": "[申請]16~17", "17": "[申請]17~19",
+    "18": "[申請]18~19", "19": "[申請]19~21", "20": "[申請]20~21", "21": "[申請]21~23",
+    "22": "[申請]22~23"
+}
+
+# Venue codes mapping based on user's guide
+VENUE_CODES_MAPPING = {
+    "ARO0A": "ARO0A柔道教室A", "BSB0A": "BSB0A棒球場", "BSK02": "BSK02高爾夫球場",
+    "BSK0A": "BSK0A籃球場A", "BSK0B": "BSK0B籃球場B", "BSK0C": "BSK0C籃球場C",
+    "BSK0D": "BSK0D籃球場D", "BSK0E": "BSK0E籃球場E", "BSK0F": "BSK0F籃球場F",
+    "BSK0G": "BSK0G籃球場I (K書中心)", "BSK0H": "BSK0H籃球場J (k書中心)",
+    "BSK0J": "BSK0J籃球場L (集賢館場地)", "BSK0K": "BSK0K籃球場K (集賢館場地)",
+    "BSKR1": "BSKR1籃球場G (原R1)", "BSKR2": "BSKR2籃球場H (原R2)", "GYM0A": "GYM0A韻律教室",
+    "PLA0A": "PLA0A體育室前廣場", "SFT0B": "SFT0B志學門壘球場1", "TNS0G": "TNS0G網球場G",
+    "TNS0H": "TNS0H網球場H", "TRK0A": "TRK0A田徑場", "VOL0A": "VOL0A排球場A-女",
+    "VOL0B": "VOL0B排球場B-男", "VOL0C": "VOL0C排球場C-女", "VOL0D": "VOL0D排球場D-男",
+    "VOL0E": "VOL0E排球場E-女", "VOL0F": "VOL0F排球場F-男", "VOL0G": "VOL0G排球場G-女",
+    "VOL0H": "VOL0H排球場H-男", "VOL0J": "VOL0J排球場L-女 (集賢館場地)",
+    "VOL0K": "VOL0K排球場K-男 (集賢館場地)", "VOLR1": "VOLR1排球場I-女 (原R1)",
+    "VOLR2": "VOLR2排球場J-男 (原R2)", "XDNCE": "XDNCE壽豐館-舞蹈教室",
+    "XGMB1": "XGMB1壽館場B-羽1", "XGMB2": "XGMB2壽館場B-羽2", "XGMB3": "XGMB3壽館場B-羽3",
+    "XGMB4": "XGMB4壽館場B-羽4", "XGMC1": "XGMC1壽館場C-排1", "XGMC2": "XGMC2壽館場C-排2",
+    "XGMC3": "XGMC3壽館場C-排3", "XGMC4": "XGMC4壽館場C-排4", "XGYMA": "XGYMA壽館場A-籃球",
+    "XTKDO": "XTKDO壽豐館-跆拳道教室", "XTNA1": "XTNA1網球場1", "XTNA2": "XTNA2網球場2",
+    "XTNB1": "XTNB1網球場3", "XTNB2": "XTNB2網球場4", "XTNB3": "XTNB3網球場5",
+    "XTNB4": "XTNB4網球場6 (紅土)", "XTNB5": "XTNB5網球場7 (紅土)",
+    "XTT0W": "XTT0W壽豐體育館桌球室全部"
+}
+
+
+def parse_time_slot(start_hour_key):
+    """
+    將開始時間索引 (例如 "06") 轉成 (time_slot_plain, start_hour, end_hour)。
+
+    Returns:
+        tuple: ("[申請]06~08", "06", "08")；索引無效或格式無法解析時回傳 None。
+    """
+    time_slot_plain = TIME_SLOTS_MAPPING.get(start_hour_key)
+    if not time_slot_plain:
+        return None
+    try:
+        start_hour, end_hour = time_slot_plain.split(']')[1].split('~')
+    except (IndexError, ValueError):
+        return None
+    return time_slot_plain, start_hour, end_hour
+
+
+def build_booking_details(date, start_hour_key, venue_code, department, email, phone,
+                          reason="運動", note="自動預約測試"):
+    """
+    組出 booking_service.make_booking_post_request 需要的 booking_details。
+
+    Returns:
+        dict: booking_details；開始時間索引或場地代碼無效時回傳 None。
+    """
+    parsed_slot = parse_time_slot(start_hour_key)
+    if not parsed_slot or venue_code not in VENUE_CODES_MAPPING:
+        return None
+    time_slot_plain, start_hour, end_hour = parsed_slot
+    return {
+        "date": date,
+        "time_slot_plain": time_slot_plain, # This is "hfPlainYMDH"
+        "start_hour": start_hour,           # This is "BHDDL1"
+        "end_hour": end_hour,               # This is "EHDDL1"
+        "venue_code": venue_code,           # This is "DropDownList1"
+        "department": department,
+        "email": email,
+        "phone": phone,
+        "reason": reason,
+        "note": note,
+    }
+
+
+def expand_venues(venue_patterns):
+    """將場地代碼或萬用字元樣式 (例如 "VOL*") 展開成 VENUE_CODES_MAPPING 中的場地代碼，保留輸入順序。"""
+    venues = []
+    for pattern in venue_patterns:
+        for code in VENUE_CODES_MAPPING:
+            if fnmatch.fnmatchcase(code, pattern) and code not in venues:
+                venues.append(code)
+    return venues
+
+
+def expand_candidates(venue_patterns, start_hour_keys):
+    """
+    產生 (venue_code, start_hour_key) 候選清單 (場地 × 時段)，順序即優先順序。
+
+    Raises:
+        ValueError: 樣式沒有對應到任何場地，或時段索引不在 TIME_SLOTS_MAPPING 中。
+    """
+    venues = expand_venues(venue_patterns)
+    if not venues:
+        raise ValueError(f"場地 {list(venue_patterns)} 不在 VENUE_CODES_MAPPING 中")
+    invalid_hours = [key for key in start_hour_keys if key not in TIME_SLOTS_MAPPING]
+    if invalid_hours:
+        raise ValueError(f"時段 {invalid_hours} 不在 TIME_SLOTS_MAPPING 中")
+    return [(venue, hour) for hour in start_hour_keys for venue in venues]
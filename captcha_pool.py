@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+from captcha_preprocess import prepare_captcha
+from captcha_service import get_captcha
+
+DEFAULT_POOL_SIZE = 4
+# SysCaptcha 驗證碼的有效時間未公開，預設保守地只保留 60 秒
+DEFAULT_TTL = 60.0
+
+
+class CaptchaPool:
+    """
+    背景預先獲取並辨識驗證碼的池子。
+
+    工作執行緒持續從 SysCaptcha Generate 取得驗證碼並進行 OCR，結果以 captchaId 為 key
+    存放在有上限的 OrderedDict 中；超過 TTL 的項目會被丟棄。當表單接受外部驗證碼時，
+    take() 可以立即取得一組已辨識好的 (captcha_id, text)，把 OCR 從關鍵路徑上移除。
+    """
+
+    def __init__(self, ocr_func, max_size=DEFAULT_POOL_SIZE, ttl=DEFAULT_TTL, workers=1,
+                 session=None, retry_interval=1.0):
+        """
+        Args:
+            ocr_func (callable): 驗證碼辨識函式，簽名為 func(base64_image_data) -> str or None。
+            max_size (int, optional): 池中最多保留的已辨識驗證碼數量。
+            ttl (float, optional): 驗證碼自取得起的有效秒數。
+            workers (int, optional): 背景工作執行緒數量。
+            session (requests.Session, optional): 取得驗證碼使用的 session，預設為共用 session。
+            retry_interval (float, optional): 獲取或辨識失敗後的等待秒數。
+        """
+        self.ocr_func = ocr_func
+        self.max_size = max_size
+        self.ttl = ttl
+        self.workers = workers
+        self.session = session
+        self.retry_interval = retry_interval
+        self._entries = OrderedDict()  # captchaId -> (text, fetched_at)
+        self._lock = threading.Lock()
+        self._space_available = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """啟動背景工作執行緒 (daemon)。"""
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"captcha-pool-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        """停止背景工作執行緒。"""
+        self._stop.set()
+        with self._lock:
+            self._space_available.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def __len__(self):
+        with self._lock:
+            self._prune()
+            return len(self._entries)
+
+    def take(self):
+        """
+        取出最新一組仍在有效期限內的驗證碼。
+
+        Returns:
+            tuple: (captcha_id, recognized_text)；池中沒有可用項目時回傳 None。
+        """
+        with self._lock:
+            self._prune()
+            if not self._entries:
+                return None
+            captcha_id, (text, _) = self._entries.popitem(last=True)
+            self._space_available.notify()
+            return captcha_id, text
+
+    def _prune(self):
+        """移除過期項目 (呼叫者需持有 lock)。"""
+        now = time.monotonic()
+        expired = [cid for cid, (_, fetched_at) in self._entries.items() if now - fetched_at > self.ttl]
+        for captcha_id in expired:
+            del self._entries[captcha_id]
+        if expired:
+            self._space_available.notify_all()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                self._prune()
+                while len(self._entries) >= self.max_size and not self._stop.is_set():
+                    # 等到有空位；定期醒來檢查過期項目
+                    oldest_fetched_at = next(iter(self._entries.values()))[1]
+                    self._space_available.wait(max(0.05, self.ttl - (time.monotonic() - oldest_fetched_at)))
+                    self._prune()
+            if self._stop.is_set():
+                return
+
+            fetched_at = time.monotonic()
+            image_data, captcha_id, _ = get_captcha(session=self.session)
+            text = self.ocr_func(prepare_captcha(image_data)) if image_data and captcha_id else None
+            if text is None:
+                self._stop.wait(self.retry_interval)
+                continue
+
+            with self._lock:
+                self._entries[captcha_id] = (text, fetched_at)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
@@ -0,0 +1,199 @@
+"""
+驗證碼圖片前處理：解碼一次後裁切到字元範圍、轉成灰階或黑白、縮小並重新編碼成精簡的 PNG，
+再交給 OCR。結果 (PreparedCaptcha) 本身就是 data URI 字串，可直接傳給任何
+func(base64_image_data) 形式的辨識器；本機辨識器則直接使用附帶的二值化陣列，不必再解碼。
+
+模式 (--captcha-preprocess 或環境變數 NDHU_CAPTCHA_PREPROCESS)：
+  gray    裁切 + 灰階 + 縮小 (預設)
+  binary  裁切 + 黑白 (Otsu 門檻、去除孤立雜點) + 縮小，圖片最小
+  off     不處理，只補上 data URI 前綴
+
+numpy / Pillow 為選用依賴 (pip install "test[local-ocr]")，未安裝時一律視為 off。
+兩者在第一次使用時才 import，可先呼叫 warm_up() 在背景載入。
+"""
+import base64
+import io
+import os
+
+import telemetry
+
+CAPTCHA_PREPROCESS_ENV = "NDHU_CAPTCHA_PREPROCESS"
+MODES = ("gray", "binary", "off")
+# 縮小後的最大高度 (像素)；驗證碼只有一行字，這個高度仍清晰可辨
+DEFAULT_MAX_HEIGHT = 40
+# 裁切時在字元範圍外保留的邊界 (像素)
+CROP_MARGIN = 2
+
+_default_mode = os.getenv(CAPTCHA_PREPROCESS_ENV, "gray")
+np = None
+Image = None
+
+
+class PreparedCaptcha(str):
+    """
+    前處理後的驗證碼 data URI。
+
+    Attributes:
+        mask: 裁切後的前景 (字元) bool 陣列，解析度與原圖相同；未處理時為 None。
+        gray: 裁切後的灰階 uint8 陣列；未處理時為 None。
+        source_bytes: 原始圖片的位元組數。
+    """
+    mask = None
+    gray = None
+    source_bytes = 0
+
+
+def dependencies_available():
+    """numpy 與 Pillow 是否已安裝 (第一次呼叫時才 import)。"""
+    global np, Image
+    if np is None or Image is None:
+        try:
+            import numpy
+            from PIL import Image as pil_image
+        except ImportError:
+            return False
+        np, Image = numpy, pil_image
+    return True
+
+
+def warm_up():
+    """預先 import numpy / Pillow，讓第一張驗證碼不必等待 (可在背景執行緒呼叫)。"""
+    if _default_mode != "off":
+        dependencies_available()
+
+
+def set_default_mode(mode):
+    if mode not in MODES:
+        raise ValueError(f"未知的前處理模式 '{mode}' (可用: {', '.join(MODES)})")
+    global _default_mode
+    _default_mode = mode
+
+
+def split_data_uri(base64_image_data):
+    """回傳 (mime type, base64 內容)；沒有 data URI 前綴時依內容判斷 (預設 image/jpeg)。"""
+    data = base64_image_data.strip()
+    if data.startswith("data:") and "," in data:
+        header, encoded = data.split(",", 1)
+        return header[len("data:"):].split(";", 1)[0] or "image/jpeg", encoded
+    return ("image/png" if data.startswith("iVBOR") else "image/jpeg"), data
+
+
+def to_data_uri(mime_type, encoded):
+    return f"data:{mime_type};base64,{encoded}"
+
+
+def decode_image(base64_image_data):
+    """將 Base64 圖片資料 (可含 data URI 前綴) 解碼成灰階 PIL 圖片。"""
+    dependencies_available()
+    return Image.open(io.BytesIO(base64.b64decode(split_data_uri(base64_image_data)[1]))).convert("L")
+
+
+def _otsu_threshold(gray):
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = gray.size
+    cumulative_count = np.cumsum(histogram)
+    cumulative_sum = np.cumsum(histogram * np.arange(256))
+    background = cumulative_count
+    foreground = total - cumulative_count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_background = cumulative_sum / background
+        mean_foreground = (cumulative_sum[-1] - cumulative_sum) / foreground
+        between = background * foreground * (mean_background - mean_foreground) ** 2
+    if np.isnan(between).all():  # 單色圖片
+        return int(gray.max())
+    return int(np.nanargmax(between))
+
+
+def binarize(image):
+    """
+    以 Otsu 門檻二值化，回傳前景 (字元) 為 True 的 bool 陣列。
+
+    前景取像素較少的一側，因此深底淺字與淺底深字都能處理；
+    鄰居少於兩個的孤立點 (干擾雜點) 會被移除。
+    """
+    gray = np.asarray(image, dtype=np.uint8)
+    threshold = _otsu_threshold(gray)
+    dark = gray <= threshold
+    mask = dark if dark.sum() <= dark.size / 2 else ~dark
+    padded = np.pad(mask, 1)
+    neighbours = sum(
+        padded[1 + dy:padded.shape[0] - 1 + dy, 1 + dx:padded.shape[1] - 1 + dx]
+        for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx
+    )
+    return mask & (neighbours >= 2)
+
+
+def crop_box(mask, margin=CROP_MARGIN):
+    """前景範圍 (含 margin) 的 (top, bottom, left, right)；沒有前景時為整張圖。"""
+    rows = np.flatnonzero(mask.any(axis=1))
+    columns = np.flatnonzero(mask.any(axis=0))
+    if not rows.size:
+        return 0, mask.shape[0], 0, mask.shape[1]
+    return (max(rows[0] - margin, 0), min(rows[-1] + 1 + margin, mask.shape[0]),
+            max(columns[0] - margin, 0), min(columns[-1] + 1 + margin, mask.shape[1]))
+
+
+def _encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _prepare(encoded, mode, max_height):
+    image = Image.open(io.BytesIO(base64.b64decode(encoded))).convert("L")
+    mask = binarize(image)
+    top, bottom, left, right = crop_box(mask)
+    mask = mask[top:bottom, left:right]
+    gray = np.asarray(image, dtype=np.uint8)[top:bottom, left:right]
+
+    if mode == "binary":
+        output = Image.fromarray(np.where(mask, 0, 255).astype(np.uint8))
+    else:
+        output = Image.fromarray(gray)
+    if output.height > max_height:
+        width = max(1, round(output.width * max_height / output.height))
+        output = output.resize((width, max_height), Image.LANCZOS)
+    if mode == "binary":
+        output = output.point(lambda value: 255 if value >= 128 else 0).convert("1")
+
+    prepared = PreparedCaptcha(to_data_uri("image/png", _encode_png(output)))
+    prepared.mask, prepared.gray = mask, gray
+    return prepared
+
+
+def prepare_captcha(base64_image_data, mode=None, max_height=DEFAULT_MAX_HEIGHT):
+    """
+    前處理驗證碼圖片。已經是 PreparedCaptcha 時直接回傳。
+
+    Args:
+        base64_image_data (str): Base64 圖片資料 (可含 data URI 前綴)。
+        mode (str, optional): "gray" / "binary" / "off"，預設為 set_default_mode 或環境變數的設定。
+        max_height (int, optional): 縮小後的最大高度 (像素)。
+
+    Returns:
+        PreparedCaptcha: 圖片無法解碼或缺少依賴時，內容為原圖 (補上 data URI 前綴)，陣列為 None。
+    """
+    if isinstance(base64_image_data, PreparedCaptcha):
+        return base64_image_data
+    mode = mode or _default_mode
+    mime_type, encoded = split_data_uri(base64_image_data)
+    source_bytes = len(encoded) * 3 // 4
+    if mode == "off" or not dependencies_available():
+        prepared = PreparedCaptcha(to_data_uri(mime_type, encoded))
+        prepared.source_bytes = source_bytes
+        return prepared
+
+    with telemetry.span("captcha.preprocess", mode=mode, bytes_in=source_bytes) as attrs:
+        try:
+            prepared = _prepare(encoded, mode, max_height)
+        except Exception as e:
+            print(f"[captcha_preprocess] 無法處理驗證碼圖片，使用原圖: {e}")
+            prepared = PreparedCaptcha(to_data_uri(mime_type, encoded))
+        if len(prepared.split(",", 1)[1]) > len(encoded):
+            # 重新編碼反而變大 (原圖已很小)：送原圖，但保留陣列給本機辨識器
+            original = PreparedCaptcha(to_data_uri(mime_type, encoded))
+            original.mask, original.gray = prepared.mask, prepared.gray
+            prepared = original
+        prepared.source_bytes = source_bytes
+        attrs.update(bytes_out=len(prepared.split(",", 1)[1]) * 3 // 4)
+    return prepared
@@ -1,23 +1,27 @@
 import requests
 import json
-import urllib3
+from http_client import get_session, merge_cookies
+from captcha_preprocess import prepare_captcha
+import telemetry
 
-# 禁用 SSL 警告
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+CAPTCHA_URL = 'https://web.ndhu.edu.tw/INC/SysCaptcha/api/Captcha/Generate'
 
-def get_captcha(session_cookies=None):
+@telemetry.timed("step.captcha_fetch")
+def get_captcha(session_cookies=None, session=None):
     """
     向指定的 URL 發送 GET 請求以獲取驗證碼。
 
     Args:
         session_cookies (dict, optional): Cookies to be sent with the request. Defaults to None.
+                                          會先合併進 session 的 cookie jar。
+        session (requests.Session, optional): 要使用的 session，預設為 http_client 的共用 session。
 
     Returns:
         tuple: 包含 (imageBase64, captchaId, response_cookies) 的元組，如果成功。
                response_cookies is a dict of cookies set by the captcha server.
                如果失敗，則回傳 (None, None, None)。
     """
-    captcha_url = 'https://web.ndhu.edu.tw/INC/SysCaptcha/api/Captcha/Generate'
+    captcha_url = CAPTCHA_URL
     headers = {
         'accept': '*/*',
         'accept-language': 'zh-TW,zh;q=0.9',
@@ -35,8 +39,10 @@ def get_captcha(session_cookies=None):
 
     try:
         print(f"[*] 正在向 {captcha_url} 發送 GET 請求以獲取驗證碼...")
-        # Pass session_cookies if provided
-        response = requests.get(captcha_url, headers=headers, cookies=session_cookies, timeout=10, verify=False)
+        # 透過共用 session 發送，沿用 keep-alive 連線與 cookie jar
+        http = session or get_session()
+        merge_cookies(session_cookies, http)
+        response = http.get(captcha_url, headers=headers, timeout=10)
         response.raise_for_status()  # 如果請求失敗 (狀態碼 4xx 或 5xx)，會拋出異常
         
         print(f"[*] GET 請求成功，狀態碼: {response.status_code}")
@@ -73,6 +79,53 @@ def get_captcha(session_cookies=None):
         traceback.print_exc()
         return None, None, None
 
+@telemetry.timed("step.captcha_solve")
+def solve_form_captcha(form_params, ocr_func, session=None, captcha_pool=None):
+    """
+    辨識表單內嵌的驗證碼；表單沒有內嵌驗證碼時改向外部服務獲取。
+
+    Args:
+        form_params (dict): booking_service._extract_aspnet_form_params 的結果。
+        ocr_func (callable): 接收 Base64 圖片資料、回傳辨識文字 (或 None) 的函式，
+                             例如 gemini_service.get_text_from_image_gemini。
+        session (requests.Session, optional): 外部驗證碼請求要使用的 session。
+        captcha_pool (captcha_pool.CaptchaPool, optional): 表單沒有內嵌驗證碼時，
+                             優先從池中取用已辨識好的驗證碼。
+
+    Returns:
+        tuple: (captcha_id, recognized_text)；任一步驟失敗時回傳 (None, None)。
+    """
+    captcha_id = form_params.get("ctl00$MainContent$hfCaptchaId")
+    captcha_image = form_params.get("ctl00$MainContent$hfCaptchaImageBase64")
+
+    if not (captcha_id and captcha_image):
+        solved = captcha_pool.take() if captcha_pool is not None else None
+        if solved:
+            print(f"[*] 從預先辨識池取得驗證碼 ID: {solved[0]}")
+            return solved
+        captcha_image, captcha_id, _ = get_captcha(session=session)
+        if not (captcha_image and captcha_id):
+            return None, None
+
+    # 解碼一次並裁切/縮小 (captcha_preprocess)；結果仍是 data URI 字串，任何 ocr_func 都能接受
+    recognized_text = ocr_func(prepare_captcha(captcha_image))
+    if recognized_text is None:
+        return None, None
+    return captcha_id, recognized_text
+
+def report_captcha_verdict(captcha_text, status):
+    """
+    將最終 POST 的判定回報給產生此答案的辨識器 (例如 ocr_router 的 RoutedAnswer)，供其統計通過率。
+
+    Args:
+        captcha_text (str): 送出的驗證碼答案；一般字串 (沒有 report_verdict) 會直接略過。
+        status (str): booking_service.BookingStatus；只有 success / failure (驗證碼已通過)
+                      與 captcha_rejected 會被回報。
+    """
+    report_verdict = getattr(captcha_text, "report_verdict", None)
+    if report_verdict is not None and status in ("success", "failure", "captcha_rejected"):
+        report_verdict(status != "captcha_rejected")
+
 if __name__ == '__main__':
     print("正在測試獲取驗證碼功能...")
     # For standalone testing, you might not have session_cookies or they might be empty
@@ -0,0 +1,167 @@
+"""
+本機驗證碼辨識器的資料蒐集、標記、訓練與評估工具。
+
+    python captcha_tools.py collect --count 200          # 從 SysCaptcha 下載驗證碼
+    python captcha_tools.py label [--suggest]            # 逐張輸入答案 (--suggest 先用 Gemini 預填)
+    python captcha_tools.py train                        # 訓練 models/captcha_knn.npz
+    python captcha_tools.py report [--gemini]            # 本機 (與 Gemini) 的正確率 / 延遲比較
+
+樣本存放在 captcha_samples/ (圖片為 <captchaId>.<副檔名>)，答案記錄在 captcha_samples/labels.csv。
+"""
+import argparse
+import base64
+import csv
+import os
+import random
+import statistics
+import time
+
+from local_captcha import DEFAULT_MODEL_PATH, get_text_from_image_local, train_model
+
+DEFAULT_SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "captcha_samples")
+LABELS_FILE = "labels.csv"
+
+
+def _labels_path(samples_dir):
+    return os.path.join(samples_dir, LABELS_FILE)
+
+
+def load_labels(samples_dir):
+    """讀取 labels.csv，回傳 {檔名: 答案}。"""
+    path = _labels_path(samples_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        return {row["file"]: row["text"] for row in csv.DictReader(f)}
+
+
+def save_labels(samples_dir, labels):
+    with open(_labels_path(samples_dir), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["file", "text"])
+        writer.writeheader()
+        for file_name, text in sorted(labels.items()):
+            writer.writerow({"file": file_name, "text": text})
+
+
+def read_sample(samples_dir, file_name):
+    """讀取樣本圖片並轉成 data URI (與 SysCaptcha / 表單內嵌的格式相同)。"""
+    extension = os.path.splitext(file_name)[1].lstrip(".").lower() or "jpeg"
+    mime = "jpeg" if extension == "jpg" else extension
+    with open(os.path.join(samples_dir, file_name), "rb") as f:
+        return f"data:image/{mime};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def collect(samples_dir, count, delay):
+    """從 captcha_service.get_captcha 下載驗證碼圖片。"""
+    from captcha_service import get_captcha
+
+    os.makedirs(samples_dir, exist_ok=True)
+    saved = 0
+    for _ in range(count):
+        image_data, captcha_id, _ = get_captcha()
+        if not (image_data and captcha_id):
+            continue
+        header, _, encoded = image_data.partition(",") if image_data.startswith("data:") else ("", "", image_data)
+        extension = header.split("/")[1].split(";")[0] if header else "jpeg"
+        with open(os.path.join(samples_dir, f"{captcha_id}.{extension}"), "wb") as f:
+            f.write(base64.b64decode(encoded))
+        saved += 1
+        time.sleep(delay)
+    print(f"[collect] 已儲存 {saved} 張驗證碼到 {samples_dir}")
+
+
+def label(samples_dir, suggest):
+    """逐張顯示未標記的樣本路徑並輸入答案；直接按 Enter 接受建議，輸入 - 略過，輸入 q 結束。"""
+    labels = load_labels(samples_dir)
+    pending = sorted(f for f in os.listdir(samples_dir) if f != LABELS_FILE and f not in labels)
+    print(f"[label] 未標記樣本 {len(pending)} 張。")
+    if suggest:
+        from gemini_service import get_text_from_image_gemini
+    try:
+        for file_name in pending:
+            suggestion = get_text_from_image_gemini(read_sample(samples_dir, file_name)) if suggest else None
+            prompt = f"{os.path.join(samples_dir, file_name)} [{suggestion or ''}]: "
+            answer = input(prompt).strip()
+            if answer == "q":
+                break
+            if answer == "-":
+                continue
+            answer = answer or suggestion
+            if answer:
+                labels[file_name] = answer
+    finally:
+        save_labels(samples_dir, labels)
+        print(f"[label] 已標記 {len(labels)} 張。")
+
+
+def _split(labels, holdout, seed):
+    files = sorted(labels)
+    random.Random(seed).shuffle(files)
+    cut = int(len(files) * (1 - holdout))
+    return files[:cut], files[cut:]
+
+
+def train(samples_dir, model_path, holdout, seed):
+    labels = load_labels(samples_dir)
+    train_files, _ = _split(labels, holdout, seed)
+    stats = train_model(((read_sample(samples_dir, f), labels[f]) for f in train_files), model_path)
+    print(f"[train] 使用 {stats['used']} 張 (略過 {stats['skipped']} 張切割不符)，共 {stats['glyphs']} 個字元，"
+          f"驗證碼長度 {stats['expected_length']}。模型: {model_path}")
+
+
+def _evaluate(name, recognizer, samples):
+    latencies, correct = [], 0
+    for image_data, expected in samples:
+        started_at = time.perf_counter()
+        text = recognizer(image_data)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        correct += text == expected
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name:<10} 正確率 {correct / len(samples):6.1%} ({correct}/{len(samples)})  "
+          f"延遲 p50 {statistics.median(latencies):8.1f} ms  p95 {p95:8.1f} ms")
+
+
+def report(samples_dir, model_path, holdout, seed, with_gemini):
+    labels = load_labels(samples_dir)
+    _, test_files = _split(labels, holdout, seed)
+    if not test_files:
+        print("[report] 沒有測試樣本，請先標記更多驗證碼或調整 --holdout。")
+        return
+    samples = [(read_sample(samples_dir, f), labels[f]) for f in test_files]
+    print(f"[report] 測試樣本 {len(samples)} 張")
+    _evaluate("local", lambda data: get_text_from_image_local(data, model_path), samples)
+    if with_gemini:
+        from gemini_service import get_text_from_image_gemini
+        _evaluate("gemini", get_text_from_image_gemini, samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples-dir", default=DEFAULT_SAMPLES_DIR)
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--holdout", type=float, default=0.2, help="保留作為測試集的比例 (train/report 共用)")
+    parser.add_argument("--seed", type=int, default=0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    collect_parser = commands.add_parser("collect")
+    collect_parser.add_argument("--count", type=int, default=100)
+    collect_parser.add_argument("--delay", type=float, default=0.5, help="每次下載之間的間隔秒數")
+    label_parser = commands.add_parser("label")
+    label_parser.add_argument("--suggest", action="store_true", help="先用 Gemini 辨識作為預設答案")
+    commands.add_parser("train")
+    report_parser = commands.add_parser("report")
+    report_parser.add_argument("--gemini", action="store_true", help="同時評估 Gemini 作為比較")
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        collect(args.samples_dir, args.count, args.delay)
+    elif args.command == "label":
+        label(args.samples_dir, args.suggest)
+    elif args.command == "train":
+        train(args.samples_dir, args.model, args.holdout, args.seed)
+    elif args.command == "report":
+        report(args.samples_dir, args.model, args.holdout, args.seed, args.gemini)
+
+
+if __name__ == "__main__":
+    main()
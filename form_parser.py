@@ -0,0 +1,137 @@
+import codecs
+import html
+import re
+
+# 只掃描 <input ...> 標籤；ASP.NET 的隱藏欄位值 (base64) 不會包含 '>'
+_INPUT_TAG_RE = re.compile(r'<input\b[^>]*>', re.IGNORECASE)
+_ATTR_RE = re.compile(r'''([^\s"'=<>/]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?''')
+
+
+def _parse_attrs(tag):
+    """將單一 <input ...> 標籤解析成屬性 dict (屬性名稱轉小寫，值已做 HTML unescape)。"""
+    attrs = {}
+    # 略過開頭的 "<input"
+    for match in _ATTR_RE.finditer(tag, 6, len(tag) - 1):
+        name = match.group(1).lower()
+        if name in attrs:
+            continue
+        value = match.group(2)
+        if value is None:
+            value = match.group(3)
+        if value is None:
+            value = match.group(4)
+        attrs[name] = html.unescape(value) if value else ""
+    return attrs
+
+
+class HiddenFieldExtractor:
+    """
+    單次掃描的 <input> 欄位擷取器，取代 BeautifulSoup 的整棵樹解析。
+
+    可以一次傳入整頁 HTML，也可以用 feed() 逐段餵入 bytes/str (例如串流讀取的回應)。
+    只保留宣告過的 name / id 的 value，每個欄位以第一個帶有 value 的標籤為準，
+    與原本 soup.find(...) 的結果相同。
+    """
+
+    def __init__(self, names=(), ids=(), encoding="utf-8"):
+        self.names = frozenset(names)
+        self.ids = frozenset(ids)
+        self.by_name = {}
+        self.by_id = {}
+        self._carry = ""
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    @property
+    def complete(self):
+        """所有宣告的欄位都已找到時為 True，呼叫者可以提早停止讀取。"""
+        return len(self.by_name) == len(self.names) and len(self.by_id) == len(self.ids)
+
+    def feed(self, data):
+        """餵入一段 HTML (bytes 或 str)。被切斷在段落邊界的標籤會保留到下一段。"""
+        if isinstance(data, (bytes, bytearray)):
+            data = self._decoder.decode(data)
+        buf = self._carry + data if self._carry else data
+        end = 0
+        for match in _INPUT_TAG_RE.finditer(buf):
+            self._handle_tag(match.group(0))
+            end = match.end()
+        # 只保留最後一個尚未閉合的 '<' 之後的內容
+        cut = buf.rfind("<", end)
+        self._carry = buf[cut:] if cut != -1 and ">" not in buf[cut:] else ""
+        return self
+
+    def close(self):
+        """結束輸入並處理解碼器中剩餘的資料。"""
+        tail = self._decoder.decode(b"", final=True)
+        if tail or self._carry:
+            self._carry += tail
+            for match in _INPUT_TAG_RE.finditer(self._carry):
+                self._handle_tag(match.group(0))
+        self._carry = ""
+        return self
+
+    def _handle_tag(self, tag):
+        attrs = _parse_attrs(tag)
+        if "value" not in attrs:
+            return
+        name = attrs.get("name")
+        if name in self.names and name not in self.by_name:
+            self.by_name[name] = attrs["value"]
+        tag_id = attrs.get("id")
+        if tag_id in self.ids and tag_id not in self.by_id:
+            self.by_id[tag_id] = attrs["value"]
+
+
+def extract_input_values(html_content, names=(), ids=()):
+    """
+    從 HTML (str 或 bytes) 中一次取出指定 name / id 的 <input> value。
+
+    Args:
+        html_content (str or bytes): 頁面內容。
+        names (iterable): 要擷取的 input name。
+        ids (iterable, optional): 要擷取的 input id。
+
+    Returns:
+        tuple: (by_name, by_id) 兩個 dict，只包含有找到的欄位。
+    """
+    extractor = HiddenFieldExtractor(names, ids)
+    extractor.feed(html_content).close()
+    return extractor.by_name, extractor.by_id
+
+
+class StreamMatcher:
+    """
+    在逐段讀入的 bytes 中同時搜尋多個字串 (例如預約結果的成功/失敗提示)。
+
+    每段只掃描 新資料 + 上一段結尾 (最長樣式長度 - 1) 的 bytes，跨段落邊界的樣式也找得到。
+    found 記錄每個已出現的樣式第一次出現的位置 (bytes offset)。
+    """
+
+    def __init__(self, patterns, encoding="utf-8"):
+        self._encoding = encoding
+        self._patterns = {pattern: pattern.encode(encoding) for pattern in dict.fromkeys(patterns)}
+        self._keep = max((len(encoded) for encoded in self._patterns.values()), default=1) - 1
+        self._tail = b""
+        self._offset = 0
+        self.found = {}
+
+    def feed(self, data):
+        """餵入一段 bytes (或 str)，回傳這一段新找到的樣式清單。"""
+        if isinstance(data, str):
+            data = data.encode(self._encoding)
+        buf = self._tail + data if self._tail else bytes(data)
+        new = []
+        for pattern, encoded in self._patterns.items():
+            if pattern in self.found:
+                continue
+            index = buf.find(encoded)
+            if index != -1:
+                self.found[pattern] = self._offset + index
+                new.append(pattern)
+        cut = max(len(buf) - self._keep, 0)
+        self._tail = buf[cut:]
+        self._offset += cut
+        return new
+
+    def any_found(self, patterns):
+        return any(pattern in self.found for pattern in patterns)
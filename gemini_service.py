@@ -1,13 +1,15 @@
-import os
+import functools
 import json
-from dotenv import load_dotenv
-from openai import OpenAI, APIError, APITimeoutError, APIConnectionError
+import threading
+import urllib.parse
 
-# 載入 .env 檔案中的環境變數
-load_dotenv()
+import rate_limiter
+import settings
+import telemetry
+import traffic_capture
+from captcha_preprocess import prepare_captcha
 
-# 從環境變數中讀取 API 金鑰
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
 
 # ------------------------------------------------------------------------------
 # OCR 系統提示 (可在此修改)
@@ -18,40 +20,90 @@ SYSTEM_PROMPT_FOR_OCR = """你是一個圖片文字辨識工具，將接收傳
 }"""
 # ------------------------------------------------------------------------------
 
-# 檢查 API 金鑰是否存在
-if not GEMINI_API_KEY:
-    print("錯誤：請在 .env 檔案中設定 GEMINI_API_KEY")
+DEFAULT_OCR_MODEL = "gemini-2.5-flash-preview-05-20"
 
-# 初始化 OpenAI client
-# 如果 GEMINI_API_KEY 未設定，client 仍然會被初始化，但在呼叫時會失敗
-client = OpenAI(
-    api_key=GEMINI_API_KEY,
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-)
+# OpenAI client 在第一次辨識時才建立 (openai 套件的 import 就要數百毫秒)；每個 (base_url, api_key) 一個
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def get_api_key():
+    """從 .env / 環境變數讀取 GEMINI_API_KEY。"""
+    return settings.getenv('GEMINI_API_KEY')
+
+
+def get_client(base_url=None, api_key=None):
+    """
+    回傳共用的 OpenAI client，第一次呼叫時才 import openai 並建立。
+
+    Args:
+        base_url (str, optional): OpenAI 相容 API 的位址，預設為 Gemini (GEMINI_BASE_URL)。
+        api_key (str, optional): 預設為 GEMINI_API_KEY。
+    """
+    key = (base_url or GEMINI_BASE_URL, api_key or get_api_key())
+    client = _clients.get(key)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(key)
+            if client is None:
+                from openai import OpenAI
+                # 啟用 rate_limiter 時由它統一重試，openai 本身不再重試
+                max_retries = 0 if rate_limiter.get_limiter() else 2
+                client = _clients[key] = OpenAI(api_key=key[1], base_url=key[0], max_retries=max_retries)
+    return client
+
+
+def _error_status(exc):
+    """openai 例外對應的 HTTP 狀態碼 (供 rate_limiter 判斷是否重試)；連線錯誤為 0，逾時不重試。"""
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+    if isinstance(exc, APITimeoutError):
+        return None
+    if isinstance(exc, APIStatusError):
+        return exc.status_code
+    if isinstance(exc, APIConnectionError):
+        return 0
+    return None
+
+
+def _load_completion(data):
+    """回放時將錄製的 JSON 還原成 ChatCompletion。"""
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.model_validate(data)
 
 def get_text_from_image_gemini(base64_image_data: str,
-                               model_name: str = "gemini-2.5-flash-preview-05-20"):
+                               model_name: str = DEFAULT_OCR_MODEL,
+                               base_url: str = None,
+                               api_key: str = None,
+                               timeout: float = None):
     """
     使用 Gemini API (透過 OpenAI 函式庫) 從 Base64 圖片資料中提取文字。
 
     Args:
-        base64_image_data (str): Base64 編碼的圖片資料 (包含 data URI 前綴，例如 "data:image/jpeg;base64,...").
+        base64_image_data (str): Base64 編碼的圖片資料 (可含 data URI 前綴，例如 "data:image/jpeg;base64,...")。
+                                 尚未前處理時會先經過 captcha_preprocess.prepare_captcha。
         model_name (str, optional): 要使用的模型名稱。
                                     預設為 "gemini-2.5-flash-preview-05-20"。
                                     注意：此模型可能需要支援視覺輸入。
+        base_url (str, optional): 改用其他 OpenAI 相容的 API (例如 mock_ndhu_server 的 /v1/)。
+        api_key (str, optional): 該 API 的金鑰，預設為 GEMINI_API_KEY。
+        timeout (float, optional): 單次請求的逾時秒數，預設使用 openai 套件的設定。
 
     Returns:
         str: 辨識出的文字，如果成功。
              如果失敗或 AI 回應格式不符，則回傳 None。
     """
-    if not GEMINI_API_KEY:
-        print("[!] Gemini API 金鑰未設定。請檢查 .env 檔案。")
+    if not (api_key or get_api_key() or traffic_capture.replaying()):
+        print("[!] Gemini API 金鑰未設定。請在 .env 檔案中設定 GEMINI_API_KEY。")
         return None
 
     if not base64_image_data:
         print("[!] 未提供 Base64 圖片資料。")
         return None
 
+    from openai import APIError, APITimeoutError, APIConnectionError
+
+    image = prepare_captcha(base64_image_data)
+
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT_FOR_OCR},
         {
@@ -60,7 +112,7 @@ def get_text_from_image_gemini(base64_image_data: str,
                 {"type": "text", "text": "請辨識這張圖片中的文字，並嚴格按照系統提示的JSON格式回覆。"},
                 {
                     "type": "image_url",
-                    "image_url": {"url": base64_image_data} # Base64 data URI
+                    "image_url": {"url": image} # Base64 data URI
                 },
             ],
         },
@@ -68,11 +120,29 @@ def get_text_from_image_gemini(base64_image_data: str,
 
     try:
         print(f"[*] 正在使用 OpenAI 函式庫向 Gemini API (模型: {model_name}) 發送圖片辨識請求...")
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            # max_tokens=150 # 根據需要調整，確保 JSON 回應完整
-        )
+        with telemetry.span("ocr.gemini", model=model_name, image_bytes=len(image)):
+            def create():
+                return get_client(base_url, api_key).chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    **({"timeout": timeout} if timeout else {}),  # 傳 None 會取消 openai 的預設逾時
+                    # max_tokens=150 # 根據需要調整，確保 JSON 回應完整
+                )
+
+            send = create
+            limiter = rate_limiter.get_limiter()
+            if limiter is not None:
+                send = functools.partial(limiter.call, urllib.parse.urlsplit(base_url or GEMINI_BASE_URL).netloc,
+                                         create, _error_status)
+            capture = traffic_capture.get_capture()
+            if capture is None:
+                response = send()
+            else:
+                # 錄製 / 回放 (回放時不建立 client，也不需要 API 金鑰)
+                response = capture.call("openai", "POST", urllib.parse.urljoin(base_url or GEMINI_BASE_URL, "chat/completions"),
+                                        {"model": model_name, "messages": messages}, send,
+                                        dump=lambda completion: completion.model_dump(mode="json"),
+                                        load=_load_completion)
         
         print(f"[*] API 請求成功。")
         
@@ -133,7 +203,7 @@ def get_text_from_image_gemini(base64_image_data: str,
 if __name__ == '__main__':
     print("正在測試使用 Gemini API 進行圖片文字辨識功能...")
     
-    if not GEMINI_API_KEY:
+    if not get_api_key():
         print("無法進行測試，因為 GEMINI_API_KEY 未在 .env 中設定。")
     else:
         # 為了測試，我們需要 captcha_service.py 中的 get_captcha
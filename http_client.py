@@ -0,0 +1,207 @@
+import socket
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import rate_limiter
+import telemetry
+import traffic_capture
+
+# 禁用 SSL 警告
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# 連線池設定：
+#   POOL_CONNECTIONS 為快取的 host 連線池數量 (sys.ndhu.edu.tw、web.ndhu.edu.tw 等)
+#   POOL_MAXSIZE 為每個 host 可保留的 keep-alive 連線數，同時競速多個候選時需要足夠大
+POOL_CONNECTIONS = 8
+POOL_MAXSIZE = 16
+
+_shared_session = None
+# 目前執行緒正在進行的 HTTP 請求的各階段耗時 (毫秒)，由 TimedHTTPAdapter 設定
+_phase_state = threading.local()
+
+
+def _current_phases():
+    return getattr(_phase_state, "phases", None)
+
+
+class _TimedConnectionMixin:
+    """
+    新建連線時分別量測 DNS 與 TCP connect：先自行解析位址，再暫時把 _dns_host
+    換成解析結果讓 urllib3 直接連線 (TLS 的 SNI 與憑證驗證仍使用原本的 host)。
+    """
+
+    def _new_conn(self):
+        phases = _current_phases()
+        if phases is None:
+            return super()._new_conn()
+        host = self._dns_host
+        started_at = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            address = None  # 交由 urllib3 解析並丟出它自己的例外
+        resolved_at = time.perf_counter()
+        phases["dns"] = (resolved_at - started_at) * 1000
+        if address:
+            self._dns_host = address
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+            phases["connect"] = (time.perf_counter() - resolved_at) * 1000
+
+    def connect(self):
+        phases = _current_phases()
+        if phases is None:
+            return super().connect()
+        started_at = time.perf_counter()
+        super().connect()
+        if isinstance(self, HTTPSConnection):
+            elapsed = (time.perf_counter() - started_at) * 1000
+            phases["tls"] = max(elapsed - phases.get("dns", 0.0) - phases.get("connect", 0.0), 0.0)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    啟用 telemetry 時，記錄每個 HTTP 請求的 dns / connect / tls / ttfb / body / total (毫秒)。
+    每個請求都先經過 rate_limiter 的 per-host 限速與重試 (停用時直接送出)；重試的每一次各記錄一筆。
+    traffic_capture 錄製時每一次送出各寫一筆，回放時由錄製檔回應而不連線。
+
+    沿用 keep-alive 連線的請求沒有 dns / connect / tls 階段 (reused=True)。
+    非串流請求的 body 在此讀完，requests.Session 之後不會再讀一次；
+    串流請求 (stream=True) 的 body 由呼叫者讀取，不列入量測。
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+    def send(self, request, stream=False, **kwargs):
+        limiter = rate_limiter.get_limiter()
+        if limiter is None:
+            return self._send_timed(request, stream=stream, **kwargs)
+        url = urllib.parse.urlsplit(request.url)
+        return limiter.send(url.netloc, request.method, lambda: self._send_timed(request, stream=stream, **kwargs),
+                            path=url.path)
+
+    def _send_network(self, request, stream=False, **kwargs):
+        capture = traffic_capture.get_capture()
+        if capture is None:
+            return super().send(request, stream=stream, **kwargs)
+        return capture.send(self, request, lambda: super(TimedHTTPAdapter, self).send(request, stream=stream, **kwargs))
+
+    def _send_timed(self, request, stream=False, **kwargs):
+        if not telemetry.enabled():
+            return self._send_network(request, stream=stream, **kwargs)
+        url = urllib.parse.urlsplit(request.url)
+        attrs = {"method": request.method, "host": url.hostname, "path": url.path}
+        phases = {}
+        previous = _current_phases()
+        _phase_state.phases = phases
+        started_at = time.perf_counter()
+        try:
+            response = self._send_network(request, stream=stream, **kwargs)
+            headers_at = time.perf_counter()
+            if not stream:
+                response.content
+        except Exception as e:
+            phases["total"] = (time.perf_counter() - started_at) * 1000
+            telemetry.record_phases("http", phases, error=type(e).__name__, **attrs)
+            raise
+        finally:
+            _phase_state.phases = previous
+        finished_at = time.perf_counter()
+        setup = sum(phases.get(phase, 0.0) for phase in ("dns", "connect", "tls"))
+        phases["ttfb"] = (headers_at - started_at) * 1000 - setup
+        phases["body"] = None if stream else (finished_at - headers_at) * 1000
+        phases["total"] = (finished_at - started_at) * 1000
+        telemetry.record_phases("http", phases, status=response.status_code, reused="connect" not in phases,
+                                bytes=None if stream else len(response.content), **attrs)
+        return response
+
+
+def create_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    """
+    建立一個新的 requests.Session，每個 host 都有自己的 keep-alive 連線池。
+
+    Args:
+        pool_connections (int, optional): 要快取的 host 連線池數量。
+        pool_maxsize (int, optional): 每個 host 連線池保留的最大連線數。
+
+    Returns:
+        requests.Session: 設定好連線池的 session (verify=False，與原本各模組一致)。
+                          請求會經過 rate_limiter 的限速與重試；啟用 telemetry 時會記錄每個請求的各階段耗時。
+    """
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.verify = False
+    return session
+
+
+def get_session():
+    """回傳所有模組共用的 session (第一次呼叫時建立)。Cookie jar 也統一由它管理。"""
+    global _shared_session
+    if _shared_session is None:
+        _shared_session = create_session()
+    return _shared_session
+
+
+def reset_session():
+    """關閉並丟棄共用 session，下次 get_session() 會重新建立 (清空 cookies 與連線池)。"""
+    global _shared_session
+    if _shared_session is not None:
+        _shared_session.close()
+    _shared_session = None
+
+
+def merge_cookies(cookies, session=None):
+    """
+    將呼叫者傳入的 cookie dict 合併進 session 的 cookie jar。
+
+    同名 cookie 會先移除再設定，避免 jar 中出現同名不同 domain 的重複 cookie。
+    值相同的 cookie 則保持不動 (保留伺服器設定的 domain/path)。
+
+    Args:
+        cookies (dict or None): 要合併的 cookies。
+        session (requests.Session, optional): 目標 session，預設為共用 session。
+    """
+    if not cookies:
+        return
+    jar = (session or get_session()).cookies
+    existing = jar.get_dict()
+    for name, value in cookies.items():
+        if existing.get(name) == value:
+            continue
+        for cookie in [c for c in jar if c.name == name]:
+            jar.clear(cookie.domain, cookie.path, cookie.name)
+        jar.set(name, value)
+
+
+def get_cookies(session=None):
+    """回傳 session 目前的 cookies (dict 形式，僅供顯示或相容舊介面)。"""
+    return (session or get_session()).cookies.get_dict()
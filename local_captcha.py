@@ -0,0 +1,202 @@
+import os
+
+from captcha_preprocess import decode_image, binarize  # noqa: F401 (保留舊的匯入路徑)
+
+# numpy / Pillow 為選用依賴 (pip install "test[local-ocr]")，未安裝時辨識函式回傳 None
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+    Image = None
+
+# 預設模型路徑 (由 captcha_tools.py train 產生)
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "captcha_knn.npz")
+# 每個字元正規化後的大小 (像素)
+GLYPH_SIZE = 16
+# 寬度小於此值的欄位區段視為雜訊
+MIN_SEGMENT_WIDTH = 2
+
+_model_cache = {}
+
+
+def dependencies_available():
+    """numpy 與 Pillow 是否已安裝。"""
+    return np is not None and Image is not None
+
+
+def segment(mask, expected_length=None):
+    """
+    以垂直投影切割字元，回傳每個字元的 (x_start, x_end) 區段。
+
+    指定 expected_length 時，會反覆切開最寬的區段 (黏在一起的字元)
+    或合併最窄的相鄰區段，直到數量相符。
+    """
+    columns = mask.sum(axis=0) > 0
+    segments = []
+    start = None
+    for x, filled in enumerate(columns):
+        if filled and start is None:
+            start = x
+        elif not filled and start is not None:
+            segments.append((start, x))
+            start = None
+    if start is not None:
+        segments.append((start, len(columns)))
+    segments = [s for s in segments if s[1] - s[0] >= MIN_SEGMENT_WIDTH]
+
+    if expected_length:
+        while segments and len(segments) < expected_length:
+            widest = max(range(len(segments)), key=lambda i: segments[i][1] - segments[i][0])
+            x0, x1 = segments[widest]
+            if x1 - x0 < 2 * MIN_SEGMENT_WIDTH:
+                break
+            middle = x0 + (x1 - x0) // 2
+            segments[widest:widest + 1] = [(x0, middle), (middle, x1)]
+        while len(segments) > expected_length:
+            narrowest = min(range(len(segments)), key=lambda i: segments[i][1] - segments[i][0])
+            if narrowest == 0:
+                neighbour = 1
+            elif narrowest == len(segments) - 1:
+                neighbour = narrowest - 1
+            else:
+                # 與間距較小的一側合併
+                left_gap = segments[narrowest][0] - segments[narrowest - 1][1]
+                right_gap = segments[narrowest + 1][0] - segments[narrowest][1]
+                neighbour = narrowest - 1 if left_gap <= right_gap else narrowest + 1
+            first, second = sorted((narrowest, neighbour))
+            segments[first:second + 1] = [(segments[first][0], segments[second][1])]
+    return segments
+
+
+def glyph_vectors(mask, segments):
+    """將每個字元區段裁切到內容範圍、縮放成 GLYPH_SIZE × GLYPH_SIZE，回傳 L2 正規化的向量陣列。"""
+    vectors = []
+    for x0, x1 in segments:
+        glyph = mask[:, x0:x1]
+        rows = np.flatnonzero(glyph.any(axis=1))
+        if rows.size:
+            glyph = glyph[rows[0]:rows[-1] + 1]
+        resized = Image.fromarray((glyph * 255).astype(np.uint8)).resize((GLYPH_SIZE, GLYPH_SIZE), Image.BILINEAR)
+        vector = np.asarray(resized, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        vectors.append(vector / norm if norm else vector)
+    return np.array(vectors, dtype=np.float32).reshape(len(vectors), GLYPH_SIZE * GLYPH_SIZE)
+
+
+def extract_glyphs(base64_image_data, expected_length=None):
+    """
+    解碼、二值化並切割驗證碼圖片，回傳字元向量陣列。
+
+    傳入 captcha_preprocess.PreparedCaptcha 時直接使用其中已裁切的二值化陣列，不再解碼。
+    """
+    mask = getattr(base64_image_data, "mask", None)
+    if mask is None:
+        mask = binarize(decode_image(base64_image_data))
+    return glyph_vectors(mask, segment(mask, expected_length))
+
+
+def train_model(samples, model_path=DEFAULT_MODEL_PATH):
+    """
+    以已標記樣本訓練 k-NN 模型並儲存。
+
+    Args:
+        samples (iterable): (base64_image_data, label) 組合。
+        model_path (str, optional): 模型輸出路徑 (.npz)。
+
+    Returns:
+        dict: used / skipped 樣本數與字元數；切割出的字元數與標記長度不符的樣本會被略過。
+    """
+    samples = list(samples)
+    lengths = [len(label) for _, label in samples]
+    expected_length = max(set(lengths), key=lengths.count) if lengths else 0
+
+    vectors, labels = [], []
+    used = skipped = 0
+    for image_data, label in samples:
+        glyphs = extract_glyphs(image_data, len(label))
+        if len(glyphs) != len(label):
+            skipped += 1
+            continue
+        vectors.append(glyphs)
+        labels.extend(label)
+        used += 1
+    if not vectors:
+        raise ValueError("沒有可用的訓練樣本 (切割結果與標記長度全部不符)")
+
+    os.makedirs(os.path.dirname(os.path.abspath(model_path)), exist_ok=True)
+    np.savez_compressed(
+        model_path,
+        vectors=np.concatenate(vectors),
+        labels=np.array(labels),
+        expected_length=np.array(expected_length),
+        glyph_size=np.array(GLYPH_SIZE),
+    )
+    _model_cache.pop(model_path, None)
+    return {"used": used, "skipped": skipped, "glyphs": len(labels), "expected_length": expected_length}
+
+
+def load_model(model_path=DEFAULT_MODEL_PATH):
+    """載入 (並快取) k-NN 模型；檔案不存在時回傳 None。"""
+    if model_path not in _model_cache:
+        if not os.path.exists(model_path):
+            return None
+        with np.load(model_path) as data:
+            if int(data["glyph_size"]) != GLYPH_SIZE:
+                print(f"[!] 模型字元大小 {int(data['glyph_size'])} 與程式設定 {GLYPH_SIZE} 不符，請重新訓練。")
+                return None
+            _model_cache[model_path] = {
+                "vectors": data["vectors"],
+                "labels": data["labels"],
+                "expected_length": int(data["expected_length"]) or None,
+            }
+    return _model_cache[model_path]
+
+
+def classify(glyphs, model, k=3):
+    """以 cosine 相似度的 k-NN 投票辨識每個字元向量。"""
+    similarities = glyphs @ model["vectors"].T
+    text = []
+    for row in similarities:
+        nearest = np.argpartition(-row, min(k, len(row)) - 1)[:k]
+        votes = {}
+        for index in nearest:
+            label = str(model["labels"][index])
+            votes[label] = votes.get(label, 0.0) + float(row[index])
+        text.append(max(votes, key=votes.get))
+    return "".join(text)
+
+
+def get_text_from_image_local(base64_image_data: str, model_path: str = DEFAULT_MODEL_PATH):
+    """
+    在本機 (CPU) 辨識 NDHU SysCaptcha 驗證碼，可直接取代 get_text_from_image_gemini。
+
+    Args:
+        base64_image_data (str): Base64 編碼的圖片資料 (可含 data URI 前綴)。
+        model_path (str, optional): k-NN 模型路徑，預設為 models/captcha_knn.npz。
+
+    Returns:
+        str: 辨識出的文字，如果成功。
+             如果依賴未安裝、模型不存在或圖片無法處理，則回傳 None。
+    """
+    if not dependencies_available():
+        print("[!] 本機驗證碼辨識需要 numpy 與 Pillow，請先安裝。")
+        return None
+    if not base64_image_data:
+        print("[!] 未提供 Base64 圖片資料。")
+        return None
+
+    model = load_model(model_path)
+    if model is None:
+        print(f"[!] 找不到本機驗證碼模型: {model_path}。請先執行 captcha_tools.py train。")
+        return None
+
+    try:
+        glyphs = extract_glyphs(base64_image_data, model["expected_length"])
+    except Exception as e:
+        print(f"[!] 驗證碼圖片處理失敗: {e}")
+        return None
+    if len(glyphs) == 0:
+        print("[!] 驗證碼圖片中找不到任何字元。")
+        return None
+    return classify(glyphs, model)
@@ -1,77 +1,325 @@
 from login_module import perform_login
-from captcha_service import get_captcha as get_external_captcha # Renaming to avoid confusion
-from gemini_service import get_text_from_image_gemini
-from booking_service import trigger_add_application_form, make_booking_post_request, _extract_aspnet_form_params
+from captcha_service import solve_form_captcha, report_captcha_verdict
+from booking_service import (trigger_add_application_form, BookingPayloadTemplate, send_booking_post,
+                             form_params_after_rejection, book_with_captcha_retry, BookingStatus,
+                             CAPTCHA_RETRY_ATTEMPTS)
+from booking_targets import build_booking_details, expand_candidates
+from session_cache import restore_or_login
+from http_client import get_cookies
+import captcha_preprocess
+import rate_limiter
+import settings
+import telemetry
+import traffic_capture
+import argparse
+import atexit
 import os
-from dotenv import load_dotenv
-import urllib.parse
-
-# Time slots mapping based on user's guide
-TIME_SLOTS_MAPPING = {
-    "06": "[申請]06~08", "07": "[申請]07~09", "08": "[申請]08~10", "09": "[申請]09~11",
-    "10": "[申請]10~12", "11": "[申請]11~13", "12": "[申請]12~14", "13": "[申請]13~15",
-    "14": "[申請]14~16", "15": "[申請]15~17", "16": "[申請]16~17", "17": "[申請]17~19",
-    "18": "[申請]18~19", "19": "[申請]19~21", "20": "[申請]20~21", "21": "[申請]21~23",
-    "22": "[申請]22~23"
-}
-
-# Venue codes mapping based on user's guide
-VENUE_CODES_MAPPING = {
-    "ARO0A": "ARO0A柔道教室A", "BSB0A": "BSB0A棒球場", "BSK02": "BSK02高爾夫球場",
-    "BSK0A": "BSK0A籃球場A", "BSK0B": "BSK0B籃球場B", "BSK0C": "BSK0C籃球場C",
-    "BSK0D": "BSK0D籃球場D", "BSK0E": "BSK0E籃球場E", "BSK0F": "BSK0F籃球場F",
-    "BSK0G": "BSK0G籃球場I (K書中心)", "BSK0H": "BSK0H籃球場J (k書中心)",
-    "BSK0J": "BSK0J籃球場L (集賢館場地)", "BSK0K": "BSK0K籃球場K (集賢館場地)",
-    "BSKR1": "BSKR1籃球場G (原R1)", "BSKR2": "BSKR2籃球場H (原R2)", "GYM0A": "GYM0A韻律教室",
-    "PLA0A": "PLA0A體育室前廣場", "SFT0B": "SFT0B志學門壘球場1", "TNS0G": "TNS0G網球場G",
-    "TNS0H": "TNS0H網球場H", "TRK0A": "TRK0A田徑場", "VOL0A": "VOL0A排球場A-女",
-    "VOL0B": "VOL0B排球場B-男", "VOL0C": "VOL0C排球場C-女", "VOL0D": "VOL0D排球場D-男",
-    "VOL0E": "VOL0E排球場E-女", "VOL0F": "VOL0F排球場F-男", "VOL0G": "VOL0G排球場G-女",
-    "VOL0H": "VOL0H排球場H-男", "VOL0J": "VOL0J排球場L-女 (集賢館場地)",
-    "VOL0K": "VOL0K排球場K-男 (集賢館場地)", "VOLR1": "VOLR1排球場I-女 (原R1)",
-    "VOLR2": "VOLR2排球場J-男 (原R2)", "XDNCE": "XDNCE壽豐館-舞蹈教室",
-    "XGMB1": "XGMB1壽館場B-羽1", "XGMB2": "XGMB2壽館場B-羽2", "XGMB3": "XGMB3壽館場B-羽3",
-    "XGMB4": "XGMB4壽館場B-羽4", "XGMC1": "XGMC1壽館場C-排1", "XGMC2": "XGMC2壽館場C-排2",
-    "XGMC3": "XGMC3壽館場C-排3", "XGMC4": "XGMC4壽館場C-排4", "XGYMA": "XGYMA壽館場A-籃球",
-    "XTKDO": "XTKDO壽豐館-跆拳道教室", "XTNA1": "XTNA1網球場1", "XTNA2": "XTNA2網球場2",
-    "XTNB1": "XTNB1網球場3", "XTNB2": "XTNB2網球場4", "XTNB3": "XTNB3網球場5",
-    "XTNB4": "XTNB4網球場6 (紅土)", "XTNB5": "XTNB5網球場7 (紅土)",
-    "XTT0W": "XTT0W壽豐體育館桌球室全部"
-}
-
-def main():
-    load_dotenv()  # Load environment variables from .env file
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 只在用到的模式才 import 的模組 (openai、asyncio 等啟動成本較高)：
+#   gemini_service (gemini OCR)、booking_engine (競速)、sniper (排程)、captcha_pool、
+#   booking_jobs (批次)、watcher / availability (監看、--only-free)
+
+# 預設預約目標 (可用命令列參數覆寫)
+DEFAULT_TARGET_VENUE = "VOL0C"    # 場地為VOL0C
+DEFAULT_TARGET_START_HOUR = "06"  # 時段為06
+DEFAULT_TARGET_DATE = "2025/06/05"  # 日期為2025/06/05
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="東華大學場地自動預約")
+    parser.add_argument("--venues", default=DEFAULT_TARGET_VENUE,
+                        help="場地代碼，以逗號分隔，可使用萬用字元 (例如 VOL0C,VOL0D 或 VOL*)")
+    parser.add_argument("--hours", default=DEFAULT_TARGET_START_HOUR,
+                        help="開始時間索引，以逗號分隔 (例如 06,07)")
+    parser.add_argument("--date", default=DEFAULT_TARGET_DATE, help="預約日期 YYYY/MM/DD")
+    parser.add_argument("--race", action="store_true",
+                        help="同時對所有 場地 × 時段 候選競速預約，成功一個即取消其餘")
+    parser.add_argument("--only-free", action="store_true",
+                        help="競速模式：先擷取借用狀況，只對未被借用的候選送出")
+    parser.add_argument("--max-parallel", type=int, default=None, help="競速模式同時進行的候選數量上限")
+    parser.add_argument("--no-session-cache", action="store_true",
+                        help="不使用 .session_cache.json 中快取的登入狀態，每次都完整登入")
+    parser.add_argument("--ocr", choices=["gemini", "local", "hedged", "router"], default="gemini",
+                        help="驗證碼辨識方式：gemini (預設)、local (本機模型，需先以 captcha_tools.py 訓練)、"
+                             "hedged (同時送多個模型並多數決) 或 router (依各後端的延遲與通過率自動選擇)")
+    parser.add_argument("--ocr-backends", default=None, metavar="SPEC",
+                        help="router 模式的後端，例如 \"gemini,gemini:gemini-2.0-flash,local\" (格式見 ocr_router.py)")
+    parser.add_argument("--captcha-pool", type=int, default=0, metavar="SIZE",
+                        help="登入後於背景預先獲取並辨識 SIZE 張外部驗證碼，表單接受外部驗證碼時直接取用")
+    parser.add_argument("--captcha-preprocess", choices=captcha_preprocess.MODES, default=None,
+                        help="OCR 前的驗證碼前處理：gray (裁切 + 灰階 + 縮小，預設)、binary (黑白，圖片最小) 或 off "
+                             f"(亦可設定 {captcha_preprocess.CAPTCHA_PREPROCESS_ENV})")
+    parser.add_argument("--captcha-ttl", type=float, default=60.0, help="預先辨識驗證碼的有效秒數 (預設 60)")
+    parser.add_argument("--captcha-attempts", type=int, default=CAPTCHA_RETRY_ATTEMPTS,
+                        help=f"驗證碼被拒時，以拒絕頁面重新辨識並送出，最多共送出幾次 (預設 {CAPTCHA_RETRY_ATTEMPTS})")
+    parser.add_argument("--at", default=None,
+                        help="排程模式：於此開放時間 (台灣時間 YYYY/MM/DD HH:MM[:SS]) 準時送出預約")
+    parser.add_argument("--prepare-lead", type=float, default=20.0,
+                        help="排程模式：開放前幾秒開始 新增申請 與驗證碼辨識 (預設 20)")
+    parser.add_argument("--jobs", default=None, metavar="FILE",
+                        help="批次模式：從工作檔 (.csv / .toml / .yaml) 讀取多筆預約，依優先順序執行")
+    parser.add_argument("--job-concurrency", type=int, default=2, help="批次模式：同時執行的工作數 (預設 2)")
+    parser.add_argument("--watch", action="store_true",
+                        help="監看模式：持續輪詢借用狀況，想要的時段一空出來就競速預約")
+    parser.add_argument("--watch-days", type=int, default=1, help="監看模式：從 --date 起監看的天數 (預設 1)")
+    parser.add_argument("--poll-min", type=float, default=5.0, help="監看模式：最短輪詢間隔秒數 (預設 5)")
+    parser.add_argument("--poll-max", type=float, default=120.0, help="監看模式：最長輪詢間隔秒數 (預設 120)")
+    parser.add_argument("--rate-limit", type=float, default=None, metavar="RATE",
+                        help="每個 host 每秒的初始請求數 (依 429 / 5xx 與延遲自動調整，0 停用限速與重試；"
+                             f"預設 {rate_limiter.DEFAULT_RATE:g}，亦可設定 {rate_limiter.RATE_LIMIT_ENV})")
+    parser.add_argument("--record", default=None, metavar="FILE",
+                        help="將所有請求與回應 (遮蔽帳密、cookies、金鑰) 連同耗時錄製到 FILE (.jsonl.gz，"
+                             f"亦可設定 {traffic_capture.RECORD_ENV})")
+    parser.add_argument("--replay", default=None, metavar="FILE",
+                        help="不連線，以 --record 錄製的回應執行 (帳密可為任意值；"
+                             f"亦可設定 {traffic_capture.REPLAY_ENV})")
+    parser.add_argument("--replay-timing", action="store_true", help="回放時依錄製的耗時等待")
+    parser.add_argument("--trace", default=None, metavar="FILE",
+                        help=f"將各步驟耗時以 JSON lines 寫入 FILE，結束時列出統計 (亦可設定 {telemetry.TRACE_FILE_ENV})")
+    parser.add_argument("--import-report", nargs="?", const=15, type=int, default=None, metavar="N",
+                        help="列出啟動時 import 耗時最多的 N 個模組 (python -X importtime，預設 15) 後結束")
+    args = parser.parse_args(argv)
+    if args.captcha_attempts < 1:
+        parser.error("--captcha-attempts 至少為 1")
+    return args
+
+def print_import_report(top=15, modules=("main",)):
+    """在新的直譯器中以 -X importtime 匯入 modules，依累計耗時列出前 top 個模組。"""
+    code = "; ".join(f"import {module}" for module in modules)
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    if completed.returncode != 0 or not rows:
+        print(f"[主程式] 無法取得 import 耗時：\n{completed.stderr[-2000:]}")
+        return
+    total_us = next((cumulative for cumulative, _, name in reversed(rows) if name.strip() in modules), None)
+    print(f"import {', '.join(modules)}：共 {(total_us or 0) / 1000:.1f} ms (依累計耗時排序，縮排表示被誰匯入)")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {name}")
+
+def resolve_ocr_func(name):
+    """依命令列選項回傳驗證碼辨識函式 (簽名皆為 func(base64_image_data) -> str or None)。"""
+    if name == "local":
+        from local_captcha import get_text_from_image_local
+        return get_text_from_image_local
+    if name == "hedged":
+        from ocr_hedge import make_hedged_ocr
+        return make_hedged_ocr()
+    if name == "router":
+        from ocr_router import get_router
+        return get_router()
+    from gemini_service import get_text_from_image_gemini
+    return get_text_from_image_gemini
+
+def run_race_mode(args, active_session, user_details, captcha_pool=None):
+    """競速模式：對所有候選同時執行 新增申請 → 驗證碼 → 最終 POST。"""
+    from booking_engine import also_booked, run_race
+    try:
+        candidates = expand_candidates(args.venues.split(","), args.hours.split(","))
+    except ValueError as e:
+        print(f"[主程式] 錯誤：{e}")
+        return
+    if args.only_free:
+        from availability import scrape_availability
+        slot_index = scrape_availability(args.date, session=active_session)
+        if slot_index is not None:
+            # 狀態未知 (None) 的候選仍保留
+            candidates = [(venue, hour) for venue, hour in candidates
+                          if slot_index.is_free(venue, args.date, hour) is not False]
+        if not candidates:
+            print("[主程式] 所有候選皆已被借用。")
+            return
+    print(f"\n[主程式] 競速模式：{len(candidates)} 個候選 {candidates}")
+    winner, results = run_race(candidates, args.date, user_details, ocr_func=resolve_ocr_func(args.ocr),
+                               session=active_session, max_parallel=args.max_parallel,
+                               captcha_pool=captcha_pool, captcha_attempts=args.captcha_attempts)
+    for result in results:
+        print(f"  {result['venue_code']}@{result['start_hour_key']}: {result['status']} "
+              f"({result['elapsed']:.2f}s){' - ' + result['error'] if result['error'] else ''}")
+    if winner:
+        print(f"\n[主程式] 預約可能成功！場地 {winner['venue_code']} 時段 {winner['start_hour_key']}。請檢查回應內容確認。")
+        for extra in also_booked(winner, results):
+            print(f"[主程式] 注意：場地 {extra['venue_code']} 時段 {extra['start_hour_key']} 也預約成功 (重複預約)。")
+    else:
+        print("\n[主程式] 所有候選皆未確認成功。")
+
+def run_sniper_mode(args, active_session, user_details):
+    """排程模式：提前登入與準備，於開放瞬間送出最終 POST。"""
+    from sniper import parse_release_time, snipe
+    try:
+        release_epoch = parse_release_time(args.at)
+    except ValueError as e:
+        print(f"[主程式] 錯誤：{e}")
+        return
+    target_venue_key = args.venues.split(",")[0]
+    target_start_hour_key = args.hours.split(",")[0]
+    print(f"\n[主程式] 排程模式：{args.at} 預約 {target_venue_key} 時段 {target_start_hour_key} ({args.date})")
+    result = snipe(release_epoch, args.date, target_start_hour_key, target_venue_key, user_details,
+                   ocr_func=resolve_ocr_func(args.ocr), session=active_session,
+                   prepare_lead=args.prepare_lead, captcha_attempts=args.captcha_attempts)
+    if result.ok:
+        print("\n[主程式] 預約可能成功！請檢查回應內容確認。")
+    else:
+        print(f"\n[主程式] 排程預約結果: {result.status}")
+
+def run_jobs_mode(args, jobs, active_session, user_details, captcha_pool=None):
+    """批次模式：依優先順序執行工作檔中的所有預約。"""
+    from booking_jobs import print_job_results, run_jobs_sync
+    print(f"\n[主程式] 批次模式：{len(jobs)} 筆工作，同時執行 {args.job_concurrency} 筆")
+    results = run_jobs_sync(jobs, user_details, ocr_func=resolve_ocr_func(args.ocr), session=active_session,
+                            max_concurrent=args.job_concurrency, captcha_pool=captcha_pool,
+                            captcha_attempts=args.captcha_attempts)
+    print_job_results(results)
+
+def run_watch_mode(args, active_session, user_details):
+    """監看模式：輪詢借用狀況，想要的時段空出時競速預約。"""
+    from watcher import AdaptivePoller, default_hot_windows, watch
+    hours = args.hours.split(",")
+    poller = AdaptivePoller(min_interval=args.poll_min, max_interval=args.poll_max,
+                            hot_windows=default_hot_windows(hours))
+    print(f"\n[主程式] 監看模式：{args.venues} 時段 {hours}，{args.date} 起 {args.watch_days} 天 (Ctrl+C 結束)")
+    try:
+        booked = watch(args.date, args.watch_days, args.venues.split(","), hours, user_details,
+                       ocr_func=resolve_ocr_func(args.ocr), session=active_session, poller=poller,
+                       max_parallel=args.max_parallel, relogin=perform_login)
+    except KeyboardInterrupt:
+        print("\n[主程式] 已停止監看。")
+        return
+    for winner in booked:
+        print(f"\n[主程式] 預約可能成功！場地 {winner['venue_code']} 時段 {winner['start_hour_key']} ({winner['date']})。")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.import_report is not None:
+        print_import_report(args.import_report)
+        return
+    settings.load_env()  # Load environment variables from .env file (once)
     print("主程式開始執行...")
+    if args.trace:
+        telemetry.enable(args.trace)
+    else:
+        telemetry.enable_from_env()
+    if args.record or args.replay:
+        try:
+            traffic_capture.configure(args.record, args.replay, args.replay_timing)
+        except (OSError, ValueError) as e:
+            print(f"[主程式] 錯誤：{e}")
+            return
+        # 每次都完整登入，錄製檔才包含登入流程；回放時也不會把遮蔽過的 cookies 寫進 .session_cache.json
+        args.no_session_cache = True
+        if args.replay and args.rate_limit is None:
+            args.rate_limit = 0  # 回放不需要限速與重試
+    if args.rate_limit is not None:
+        rate_limiter.configure(args.rate_limit)
+    if telemetry.enabled():
+        atexit.register(telemetry.print_summary)
+    if args.captcha_preprocess:
+        captcha_preprocess.set_default_mode(args.captcha_preprocess)
+    if args.ocr == "router":
+        # 建立共用的路由器 (之後 resolve_ocr_func("router") 都取用同一個，統計才會累積)
+        from ocr_router import get_router
+        try:
+            router = get_router(args.ocr_backends)
+        except ValueError as e:
+            print(f"[主程式] 錯誤：{e}")
+            return
+        threading.Thread(target=router.warm_up, daemon=True).start()
+    # numpy / Pillow 在登入期間於背景載入，不佔用第一張驗證碼的時間
+    threading.Thread(target=captcha_preprocess.warm_up, daemon=True).start()
+
+    jobs = None
+    if args.jobs:
+        # 登入前先驗證工作檔，避免浪費登入與驗證碼
+        from booking_jobs import load_jobs
+        try:
+            jobs = load_jobs(args.jobs)
+        except (OSError, ValueError) as e:
+            print(f"[主程式] 錯誤：{e}")
+            return
 
     user_department_env = os.getenv("USER_DEPARTMENT", "材料科學與工程學系")
     user_email_env = os.getenv("USER_EMAIL", "your_email@gms.ndhu.edu.tw") # PLEASE REPLACE
     user_phone_env = os.getenv("USER_PHONE", "0912345678") # PLEASE REPLACE
 
-    # 執行登入
-    active_session, login_response, initial_login_cookies = perform_login()
+    # 執行登入 (預設先嘗試快取的登入狀態)
+    if args.no_session_cache:
+        active_session, login_response, initial_login_cookies = perform_login()
+    else:
+        active_session, login_response, initial_login_cookies = restore_or_login(perform_login, os.getenv("NDHU_USERNAME"))
 
     if not (active_session and login_response):
         print("\n[主程式] 登入失敗或模組未回傳有效的 session/response。")
         return
 
     print("\n[主程式] 登入成功。")
-    current_cookies = active_session.cookies.get_dict()
-    if initial_login_cookies:
-        current_cookies.update(initial_login_cookies)
-    print(f"  登入後 Cookies: {current_cookies}")
+    # Cookies 由 http_client 的共用 session 統一管理，後續各步驟不需再手動合併
+    print(f"  登入後 Cookies: {get_cookies(active_session)}")
+
+    user_details = {"department": user_department_env, "email": user_email_env, "phone": user_phone_env}
+    if args.at:
+        run_sniper_mode(args, active_session, user_details)
+        return
+    if args.watch:
+        run_watch_mode(args, active_session, user_details)
+        return
+
+    captcha_pool = None
+    if args.captcha_pool > 0:
+        from captcha_pool import CaptchaPool
+        print(f"\n[主程式] 啟動預先辨識驗證碼池 (大小 {args.captcha_pool}，TTL {args.captcha_ttl:.0f} 秒)...")
+        captcha_pool = CaptchaPool(resolve_ocr_func(args.ocr), max_size=args.captcha_pool,
+                                   ttl=args.captcha_ttl, session=active_session).start()
+    try:
+        if jobs:
+            run_jobs_mode(args, jobs, active_session, user_details, captcha_pool)
+        elif args.race:
+            run_race_mode(args, active_session, user_details, captcha_pool)
+        else:
+            _book_single_target(args, active_session, user_details, captcha_pool)
+    finally:
+        if captcha_pool is not None:
+            captcha_pool.stop(timeout=0)
+
+def _book_single_target(args, active_session, user_details, captcha_pool=None):
+    """單一目標流程：新增申請 → 驗證碼 (背景) → 最終 POST。"""
+    user_department_env = user_details["department"]
+    user_email_env = user_details["email"]
+    user_phone_env = user_details["phone"]
 
     # --- Step 1: Trigger "Add Application" form to get latest parameters and pre-filled data ---
     print("\n[主程式] Step 1: 觸發「新增申請」表單...")
-    add_app_response, cookies_after_add_app, form_params_after_add_app = trigger_add_application_form(current_cookies)
+    add_app_response, cookies_after_add_app, form_params_after_add_app = trigger_add_application_form(session=active_session)
 
     if not (add_app_response and form_params_after_add_app):
         print("[主程式] 觸發「新增申請」表單失敗。無法繼續。")
         return
     
     print("[主程式] 成功觸發「新增申請」表單。")
-    current_cookies = cookies_after_add_app # Update cookies
+    captcha_received_at = time.perf_counter()
     current_form_params = form_params_after_add_app # These are the most up-to-date params
 
+    # --- Step 2: Start CAPTCHA OCR on a worker right away (form-embedded, or external service as fallback) ---
+    # Everything below up to the final POST is prepared while OCR is running.
+    captcha_id_from_form = current_form_params.get("ctl00$MainContent$hfCaptchaId")
+    if captcha_id_from_form and current_form_params.get("ctl00$MainContent$hfCaptchaImageBase64"):
+        print(f"\n[主程式] Step 2: 偵測到表單內嵌驗證碼，於背景辨識 ({args.ocr})...")
+        print(f"  表單內嵌 Captcha ID: {captcha_id_from_form}")
+    else:
+        print("\n[主程式] Step 2: 表單未包含驗證碼圖片/ID，於背景從外部服務獲取並辨識驗證碼...")
+    ocr_executor = ThreadPoolExecutor(max_workers=1)
+    ocr_future = ocr_executor.submit(_timed_solve_captcha, current_form_params, resolve_ocr_func(args.ocr),
+                                     active_session, captcha_pool)
+
     # Extract user details from the form if available, otherwise use .env
     form_department = current_form_params.get("AppDeptTextBox_Value", user_department_env)
     form_email = current_form_params.get("EmailTextBox_Value", user_email_env)
@@ -85,149 +333,101 @@ def main():
     final_user_department = form_department if form_department else user_department_env
     final_user_email = form_email if form_email else user_email_env
     final_user_phone = form_phone if form_phone else user_phone_env
-    
-    # --- Step 2: Get CAPTCHA from the refreshed form (if present) or external service ---
-    # The CAPTCHA might now be part of form_params_after_add_app
-    captcha_id_from_form = current_form_params.get("ctl00$MainContent$hfCaptchaId")
-    captcha_image_base64_from_form = current_form_params.get("ctl00$MainContent$hfCaptchaImageBase64")
-    
-    recognized_text = None
-    actual_captcha_id_for_submission = None
 
-    if captcha_id_from_form and captcha_image_base64_from_form:
-        print("\n[主程式] Step 2: 偵測到表單內嵌驗證碼。")
-        print(f"  表單內嵌 Captcha ID: {captcha_id_from_form}")
-        # The image might be 'data:image/jpeg;base64,ActualDataHere' or just 'ActualDataHere'
-        if ',' in captcha_image_base64_from_form:
-            captcha_image_base64_data_only = captcha_image_base64_from_form.split(',', 1)[1]
-        else:
-            captcha_image_base64_data_only = captcha_image_base64_from_form
-        
-        print("\n[主程式] 正在使用 Gemini API 辨識內嵌驗證碼文字...")
-        recognized_text = get_text_from_image_gemini(captcha_image_base64_data_only)
-        actual_captcha_id_for_submission = captcha_id_from_form
-    else:
-        print("\n[主程式] Step 2: 表單未包含驗證碼圖片/ID，嘗試從外部服務獲取驗證碼...")
-        # This path might be less common if "Add Application" always provides one.
-        ext_captcha_image_base64, ext_captcha_id, ext_captcha_cookies = get_external_captcha(current_cookies)
-        if ext_captcha_image_base64 and ext_captcha_id:
-            print("  成功從外部服務獲取驗證碼。")
-            print(f"    External Captcha ID: {ext_captcha_id}")
-            if ext_captcha_cookies:
-                current_cookies.update(ext_captcha_cookies)
-                print(f"    Cookies after external CAPTCHA GET: {current_cookies}")
-            
-            print("\n[主程式] 正在使用 Gemini API 辨識外部驗證碼文字...")
-            recognized_text = get_text_from_image_gemini(ext_captcha_image_base64) # Assuming it's already base64 data
-            actual_captcha_id_for_submission = ext_captcha_id
-        else:
-            print("[主程式] 從外部服務獲取驗證碼失敗。")
+    # --- Step 3: Prepare the final booking payload while OCR runs ---
+    print("\n[主程式] Step 3: 準備最終預約資料 (驗證碼辨識同時進行)...")
+
+    # Define Booking Details (first venue/hour from the command line)
+    target_start_hour_key = args.hours.split(",")[0]
+    target_venue_key = args.venues.split(",")[0]
+    target_date = args.date
+
+    booking_details = build_booking_details(
+        target_date, target_start_hour_key, target_venue_key,
+        department=final_user_department,
+        email=final_user_email,
+        phone=final_user_phone,
+        reason="運動", # Example reason
+        note="自動預約測試" # Example note
+    )
+
+    if booking_details is None:
+        print(f"  錯誤：無效的開始時間索引 '{target_start_hour_key}' 或場地索引 '{target_venue_key}'。跳過預約。")
+        ocr_executor.shutdown(wait=False, cancel_futures=True)
+        return
+    print(f"  預約詳細資料: {booking_details}")
+
+    # The `hfEncryptedYMDH` and `AppYMDH` for the *final* booking payload seem to be related to the
+    # *selected* time slot and might be generated by client-side JS. For now we rely on the values in
+    # `current_form_params` (from `trigger_add_application_form`). This is a known complex part.
+    # The `hfPlainYMDH` is correctly set from `booking_details`.
+    # Everything except the captcha is url-encoded now; only the captcha is encoded after OCR.
+    payload_template = BookingPayloadTemplate(current_form_params)
+
+    # --- Step 4: Wait for OCR, fill in the CAPTCHA and send immediately ---
+    recognized_text, actual_captcha_id_for_submission, ocr_seconds = ocr_future.result()
+    ocr_executor.shutdown(wait=False)
 
     if recognized_text is None or actual_captcha_id_for_submission is None:
         print("\n[主程式] 驗證碼處理失敗 (未獲取到圖片/ID 或辨識失敗)。無法繼續預約。")
         return
 
-    print("\n[主程式] 驗證碼辨識完成。")
-    print(f"  辨識出的文字: \"{recognized_text}\"")
-    print(f"  將用於提交的 Captcha ID: {actual_captcha_id_for_submission}")
+    payload = payload_template.render(booking_details, {"hfCaptchaId": actual_captcha_id_for_submission,
+                                                        "hfCaptchaValue": recognized_text})
+    post_sent_at = time.perf_counter()
+    result = send_booking_post(payload, session=active_session, venue_code=booking_details["venue_code"])
+    report_captcha_verdict(recognized_text, result.status)
 
-    # --- Step 3: Prepare and Make Final Booking ---
-    print("\n[主程式] Step 3: 開始最終預約流程...")
+    print("\n[主程式] 驗證碼辨識完成，最終預約 POST 請求已送出。")
+    print(f"  辨識出的文字: \"{recognized_text}\"")
+    print(f"  使用的 Captcha ID: {actual_captcha_id_for_submission}")
+    print(f"  驗證碼取得 → POST 送出: {(post_sent_at - captcha_received_at) * 1000:.1f} ms "
+          f"(其中 OCR {ocr_seconds * 1000:.1f} ms)")
 
-    # Define Booking Details (example - make this dynamic later)
-    target_start_hour_key = "06"  # 時段為06
-    target_venue_key = "VOL0C"    # 場地為VOL0C
-    target_date = "2025/06/05"  # 日期為2025/06/05
+    if result.status is not BookingStatus.ERROR:
+        print(f"    回應狀態碼: {result.status_code}")
+        read_note = "" if result.complete else f"，判定後提早停止讀取 (已讀 {result.bytes_read} bytes)"
+        response_text_preview = result.preview.replace('\n', ' ').replace('\r', '')
+        print(f"    回應內容 (前1000字元預覽{read_note}):\n    {response_text_preview}...")
 
-    time_slot_plain = TIME_SLOTS_MAPPING.get(target_start_hour_key)
-    actual_start_hour, actual_end_hour = None, None
-    if time_slot_plain:
-        try:
-            parts = time_slot_plain.split(']')[1].split('~')
-            actual_start_hour = parts[0]
-            actual_end_hour = parts[1]
-        except (IndexError, AttributeError) as e:
-            print(f"  錯誤：無法從 \"{time_slot_plain}\" 解析開始/結束時間。錯誤: {e}")
-            time_slot_plain = None 
-
-    if not time_slot_plain or not VENUE_CODES_MAPPING.get(target_venue_key):
-        print(f"  錯誤：無效的開始時間索引 '{target_start_hour_key}' 或場地索引 '{target_venue_key}'。跳過預約。")
-    else:
-        booking_details = {
-            "date": target_date,
-            "time_slot_plain": time_slot_plain, # This is "hfPlainYMDH"
-            "start_hour": actual_start_hour,    # This is "BHDDL1"
-            "end_hour": actual_end_hour,        # This is "EHDDL1"
-            "venue_code": target_venue_key,     # This is "DropDownList1"
-            "department": final_user_department,
-            "email": final_user_email,
-            "phone": final_user_phone,
-            "reason": "運動", # Example reason
-            "note": "自動預約測試" # Example note
-        }
-        print(f"  預約詳細資料: {booking_details}")
-
-        captcha_details_for_booking = {
-            "hfCaptchaId": actual_captcha_id_for_submission,
-            "hfCaptchaValue": recognized_text
-        }
-
-        # Ensure hfEncryptedYMDH and AppYMDH are correctly populated for the final POST
-        # The first curl example for final booking had specific values for these.
-        # If they are not in current_form_params (e.g. after "Add Application"), we might need a strategy.
-        # For now, make_booking_post_request uses fallbacks from the original curl if not found in form_parameters.
-        # Let's ensure what we pass to make_booking_post_request is what we intend.
-        # The `current_form_params` (from `trigger_add_application_form`) should be the most relevant.
-        
-        # The `hfEncryptedYMDH` and `AppYMDH` for the *final* booking payload
-        # are often related to the *selected* date/time/venue, not just static values.
-        # The first curl example showed "vZP1eU%2BZCOVm%2FbjOJHqI0HrBsJf%2FUaFiPmYxh%2FLfDHoK58yb0gGJoQ%3D%3D"
-        # This value might be generated by client-side JS based on selections.
-        # For now, we rely on `make_booking_post_request` to use what's in `current_form_params`
-        # or its hardcoded fallback. This is a potential point of failure if the server expects a specific
-        # encrypted value for the chosen slot that isn't present in `current_form_params`.
-        # The `hfPlainYMDH` is what we construct (e.g., "[申請]09~11").
-        
-        # The `ctl00$MainContent$hfEncryptedYMDH` and `ctl00$MainContent$AppYMDH` in the *payload*
-        # for the final booking seem to be related to the *selected* time slot.
-        # The example from the first curl: "vZP1eU%2BZCOVm%2FbjOJHqI0HrBsJf%2FUaFiPmYxh%2FLfDHoK58yb0gGJoQ%3D%3D"
-        # This needs to be correctly generated or found.
-        # For now, we will pass current_form_params, and make_booking_post_request will use its values
-        # or fallbacks. This is a known complex part.
-        # The `hfPlainYMDH` is correctly set from `booking_details`.
-
-        print("\n  發送最終預約 POST 請求...")
-        post_response = make_booking_post_request(
-            session_cookies=current_cookies,
-            form_parameters=current_form_params, # Use params from "Add Application" response
-            booking_details=booking_details,
-            captcha_details=captcha_details_for_booking
-        )
-
-        if post_response:
-            print("  最終預約 POST 請求已發送。")
-            print(f"    回應狀態碼: {post_response.status_code}")
-            response_text_preview = post_response.text.replace('\n', ' ').replace('\r', '')[:1000] # Increased preview length
-            print(f"    回應內容 (前1000字元預覽):\n    {response_text_preview}...")
-            
-            # Check for multiple success indicators
-            success_indicators = [
-                "預約成功", 
-                "成功借用",
-                '<td align="center" style="white-space:nowrap;">VOL0C</td>' # Specific check for VOL0C
-            ]
-            failure_indicators = ["失敗", "錯誤", "已被預約", "無法借用"]
-
-            if any(indicator in post_response.text for indicator in success_indicators):
-                print("\n[主程式] 預約可能成功！請檢查回應內容確認。")
-            elif any(indicator in post_response.text for indicator in failure_indicators):
-                print("\n[主程式] 預約可能失敗或場地已被預約/無法借用。請檢查回應內容。")
+        retry_error = None
+        if result.status is BookingStatus.CAPTCHA_REJECTED and args.captcha_attempts > 1:
+            # 拒絕頁面已帶有新的 __VIEWSTATE 與驗證碼，直接重新辨識並送出，不必重新登入/新增申請
+            retry_params = form_params_after_rejection(result, current_form_params)
+            if retry_params is None:
+                retry_error = "拒絕頁面缺少重試所需的表單狀態，未重試"
             else:
-                print("\n[主程式] 預約狀態不確定。請手動檢查回應內容。")
+                print("\n[主程式] 驗證碼錯誤，使用拒絕頁面的新驗證碼重試...")
+                retry_result = book_with_captcha_retry(
+                    retry_params, booking_details, resolve_ocr_func(args.ocr), active_session,
+                    args.captcha_attempts - 1, captcha_pool,
+                )
+                if retry_result.status is BookingStatus.ERROR:
+                    retry_error = f"重試失敗 (送出 {retry_result.attempts} 次): {retry_result.error}"
+                else:
+                    result = retry_result
+            if retry_error:
+                print(f"\n[主程式] 驗證碼被拒後{retry_error}")
+        if result.status is BookingStatus.SUCCESS:
+            print("\n[主程式] 預約可能成功！請檢查回應內容確認。")
+        elif result.status is BookingStatus.CAPTCHA_REJECTED and retry_error:
+            print(f"\n[主程式] 驗證碼被拒，{retry_error}，預約未完成。")
+        elif result.status is BookingStatus.CAPTCHA_REJECTED:
+            print("\n[主程式] 驗證碼多次被拒，預約未完成。")
+        elif result.status is BookingStatus.FAILURE:
+            print("\n[主程式] 預約可能失敗或場地已被預約/無法借用。請檢查回應內容。")
         else:
-            print("  最終預約 POST 請求失敗 (模組回傳 None)。")
+            print("\n[主程式] 預約狀態不確定。請手動檢查回應內容。")
+    else:
+        print(f"  最終預約 POST 請求失敗: {result.error}")
     # --- Booking Process Ends Here ---
 
+def _timed_solve_captcha(form_params, ocr_func, session, captcha_pool=None):
+    """在背景執行緒辨識驗證碼，回傳 (recognized_text, captcha_id, OCR 秒數)。"""
+    started_at = time.perf_counter()
+    captcha_id, recognized_text = solve_form_captcha(form_params, ocr_func, session, captcha_pool)
+    return recognized_text, captcha_id, time.perf_counter() - started_at
+
 if __name__ == '__main__':
     main()
 # Removed redundant main block, the one above is the correct one.
@@ -0,0 +1,332 @@
+"""
+本機的東華大學場地借用系統替身伺服器，用於不連線正式站台的測試與效能量測。
+
+會回放 login.aspx、Default.aspx (GET、新增申請 POST、最終 POST) 與 SysCaptcha Generate 的回應，
+並可對每個路由注入延遲。另外提供 OpenAI 相容的 /v1/chat/completions 作為替身 OCR 服務
+(gemini_service 以 base_url 指向 ocr_base_url)，可依模型名稱設定延遲、正確率與錯誤率。回應內容預設為結構與正式站台相同的模擬頁面；以 --fixtures 指定
+錄製的頁面目錄時則改為回放錄製內容 (檔名見 FIXTURE_FILES)。
+
+    python mock_ndhu_server.py --port 8080 --latency-ms 80 --jitter-ms 20
+"""
+import argparse
+import base64
+import collections
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOGIN_PATH = "/gc/sportcenter/SportsFields/login.aspx"
+DEFAULT_PATH = "/gc/sportcenter/SportsFields/Default.aspx"
+CAPTCHA_PATH = "/INC/SysCaptcha/api/Captcha/Generate"
+OCR_PATH = "/v1/chat/completions"
+
+# 替身伺服器接受的驗證碼答案
+MOCK_CAPTCHA_TEXT = "MOCK"
+
+# 路由 -> 錄製頁面檔名
+FIXTURE_FILES = {
+    "login_get": "login.html",
+    "default_get": "default.html",
+    "add_application": "add_application.html",
+    "final_post": "booking_result.html",
+}
+ROUTES = ("login_get", "login_post", "default_get", "add_application", "final_post", "captcha", "ocr")
+
+# 1x1 JPEG，作為驗證碼圖片
+_CAPTCHA_IMAGE = (
+    "data:image/jpeg;base64,/9j/4AAQSkZJRgABAQEASABIAAD/2wBDAP//////////////////////////////////////////////"
+    "////////////////////////////////////////////2wBDAf//////////////////////////////////////////////////////"
+    "////////////////////////////////////wAARCAABAAEDASIAAhEBAxEB/8QAFAABAAAAAAAAAAAAAAAAAAAAA//EABQQAQAAAAAAAA"
+    "AAAAAAAAAAAAD/xAAUAQEAAAAAAAAAAAAAAAAAAAAA/8QAFBEBAAAAAAAAAAAAAAAAAAAAAP/aAAwDAQACEQMRAD8AP//Z"
+)
+
+
+def _hidden(name, value, element_id=None):
+    id_attr = f' id="{element_id}"' if element_id else ""
+    return f'<input type="hidden" name="{name}"{id_attr} value="{value}" />\n'
+
+
+def _aspnet_state(viewstate_bytes):
+    return (
+        _hidden("MainContent_ToolkitScriptManager1_HiddenField", ";;AjaxControlToolkit:zh-TW:mock",
+                "MainContent_ToolkitScriptManager1_HiddenField")
+        + _hidden("__EVENTTARGET", "") + _hidden("__EVENTARGUMENT", "")
+        + _hidden("__VIEWSTATE", base64.b64encode(os.urandom(viewstate_bytes)).decode(), "__VIEWSTATE")
+        + _hidden("__VIEWSTATEGENERATOR", "2A9F5B6C", "__VIEWSTATEGENERATOR")
+        + _hidden("__EVENTVALIDATION", base64.b64encode(os.urandom(512)).decode(), "__EVENTVALIDATION")
+        + _hidden("__RequestVerificationToken", os.urandom(24).hex())
+    )
+
+
+def render_page(route, viewstate_bytes=60_000, captcha_id=None, booking_ok=True):
+    """產生與正式站台結構相同的模擬頁面。"""
+    if route == "login_get":
+        body = (_aspnet_state(2_000) + _hidden("__VIEWSTATEENCRYPTED", "")
+                + '<input name="ctl00$MainContent$TxtUSERNO" type="text" />'
+                  '<input name="ctl00$MainContent$TxtPWD" type="password" />')
+        return f"<html><body><form method=\"post\" action=\"./login.aspx\">{body}</form></body></html>"
+
+    body = _aspnet_state(viewstate_bytes)
+    if route == "add_application":
+        body += (_hidden("ctl00$MainContent$hfEncryptedYMDH", "vZP1eU+ZCOVm/bjOJHqI0HrBsJf/UaFiPmYxh/LfDHoK58yb0gGJoQ==")
+                 + _hidden("ctl00$MainContent$hfCaptchaId", captcha_id or os.urandom(8).hex())
+                 + _hidden("ctl00$MainContent$hfCaptchaImageBase64", _CAPTCHA_IMAGE)
+                 + '<input name="ctl00$MainContent$AppDeptTextBox" type="text" value="材料科學與工程學系" />'
+                   '<input name="ctl00$MainContent$EmailTextBox" type="text" value="mock@gms.ndhu.edu.tw" />'
+                   '<input name="ctl00$MainContent$PhoneTextBox" type="text" value="0912345678" />'
+                   '<input name="ctl00$MainContent$TextBox1" type="text" value="2025/06/02" />'
+                 + _hidden("ctl00$MainContent$AppYMDH", "2025/06/05 06"))
+    elif route == "final_post":
+        body += _hidden("ctl00$MainContent$hfCaptchaErrMsg", "" if booking_ok else "驗證碼錯誤")
+        if booking_ok:
+            body += "<span>預約成功</span>"
+        else:
+            # 拒絕頁面帶有新的驗證碼 (book_with_captcha_retry 會直接使用)
+            body += (_hidden("ctl00$MainContent$hfCaptchaId", captcha_id or os.urandom(8).hex())
+                     + _hidden("ctl00$MainContent$hfCaptchaImageBase64", _CAPTCHA_IMAGE)
+                     + "<span>驗證碼錯誤，預約失敗</span>")
+    rows = "".join(f"<tr><td>{i}</td><td>VOL0A</td><td>2025/06/0{1 + i % 9}</td><td>06~08</td></tr>" for i in range(50))
+    return f"<html><body><form method=\"post\" action=\"./Default.aspx\">{body}<table>{rows}</table></form></body></html>"
+
+
+class MockNDHUServer:
+    """
+    在背景執行緒中執行的替身伺服器 (HTTP/1.1 keep-alive)。
+
+    Args:
+        host (str, optional): 監聽位址。
+        port (int, optional): 監聽埠，0 代表自動選擇。
+        latency (float or dict, optional): 注入的延遲秒數；dict 時以路由名稱 (見 ROUTES) 分別設定。
+        jitter (float, optional): 延遲的隨機抖動上限 (秒)。
+        fixtures_dir (str, optional): 錄製頁面目錄，存在的檔案會取代模擬頁面。
+        viewstate_bytes (int, optional): 模擬頁面 __VIEWSTATE 的原始大小。
+        ocr_models (dict, optional): 替身 OCR 的模型名稱 -> {"latency": 秒, "accuracy": 答對機率,
+                                     "error_rate": 回應 HTTP 500 的機率}；未列出的模型立即回答正確答案。
+        throttle_rate (float, optional): 每秒超過此請求數時回應 429 (Retry-After: throttle_retry_after)。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, fixtures_dir=None, viewstate_bytes=60_000,
+                 ocr_models=None, throttle_rate=None, throttle_retry_after=1):
+        self.latency = latency
+        self.ocr_models = ocr_models or {}
+        self.throttle_rate = throttle_rate
+        self.throttle_retry_after = throttle_retry_after
+        self.throttled_count = 0
+        self._recent = collections.deque()
+        self._throttle_lock = threading.Lock()
+        self.jitter = jitter
+        self.viewstate_bytes = viewstate_bytes
+        self.fixtures = {}
+        if fixtures_dir:
+            for route, file_name in FIXTURE_FILES.items():
+                path = os.path.join(fixtures_dir, file_name)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        self.fixtures[route] = f.read()
+        self.request_counts = {route: 0 for route in ROUTES}
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def ocr_base_url(self):
+        return self.base_url + "/v1/"
+
+    def should_throttle(self):
+        """最近一秒內的請求數超過 throttle_rate 時回傳 True (被拒絕的請求不計入)。"""
+        if not self.throttle_rate:
+            return False
+        with self._throttle_lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.throttle_rate:
+                self.throttled_count += 1
+                return True
+            self._recent.append(now)
+            return False
+
+    def ocr_answer(self, model):
+        """回傳 (HTTP 狀態碼, 答案)；依 ocr_models 的設定延遲並決定是否答對。"""
+        config = self.ocr_models.get(model, {})
+        if config.get("latency"):
+            time.sleep(config["latency"])
+        if random.random() < config.get("error_rate", 0.0):
+            return 500, None
+        return 200, MOCK_CAPTCHA_TEXT if random.random() < config.get("accuracy", 1.0) else "WRONG"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-ndhu-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def delay_for(self, route):
+        latency = self.latency.get(route, 0.0) if isinstance(self.latency, dict) else self.latency
+        return latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def page(self, route, **kwargs):
+        if route in self.fixtures:
+            return self.fixtures[route]
+        return render_page(route, self.viewstate_bytes, **kwargs).encode("utf-8")
+
+    def _make_handler(server):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, route, status=200, body=b"", content_type="text/html; charset=utf-8", headers=None):
+                if server.should_throttle():
+                    status, body, headers = 429, b"Too Many Requests", [("Retry-After", str(server.throttle_retry_after))]
+                else:
+                    server.request_counts[route] += 1
+                delay = server.delay_for(route)
+                if delay > 0:
+                    time.sleep(delay)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or []):
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 用戶端已放棄 (例如 OCR 逾時)
+
+            def _form(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8"), keep_blank_values=True)
+
+            def _logged_in(self):
+                return ".ASPXAUTH=" in (self.headers.get("Cookie") or "")
+
+            def do_GET(self):
+                path = urllib.parse.urlsplit(self.path).path
+                if path == LOGIN_PATH:
+                    self._send("login_get", body=server.page("login_get"),
+                               headers=[("Set-Cookie", f"ASP.NET_SessionId={os.urandom(12).hex()}; path=/; HttpOnly")])
+                elif path == DEFAULT_PATH:
+                    if not self._logged_in():
+                        self._send("default_get", status=302, headers=[("Location", LOGIN_PATH)])
+                    else:
+                        self._send("default_get", body=server.page("default_get"))
+                elif path == CAPTCHA_PATH:
+                    data = {"success": True, "captchaId": os.urandom(8).hex(), "imageBase64": _CAPTCHA_IMAGE}
+                    self._send("captcha", body=json.dumps(data).encode(), content_type="application/json")
+                else:
+                    self.send_error(404)
+
+            def _ocr(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                model = json.loads(self.rfile.read(length) or b"{}").get("model", "")
+                status, answer = server.ocr_answer(model)
+                if status != 200:
+                    body = {"error": {"message": "mock OCR failure", "type": "server_error"}}
+                else:
+                    body = {
+                        "id": f"chatcmpl-{os.urandom(6).hex()}", "object": "chat.completion", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                            "role": "assistant", "content": json.dumps({"respond": answer})}}],
+                    }
+                self._send("ocr", status=status, body=json.dumps(body).encode(), content_type="application/json")
+
+            def do_POST(self):
+                path = urllib.parse.urlsplit(self.path).path
+                if path == OCR_PATH:
+                    self._ocr()
+                    return
+                form = self._form()
+                if path == LOGIN_PATH:
+                    self._send("login_post", status=302, headers=[
+                        ("Location", DEFAULT_PATH),
+                        ("Set-Cookie", f".ASPXAUTH={os.urandom(16).hex()}; path=/; HttpOnly"),
+                    ])
+                elif path == DEFAULT_PATH and "ctl00$MainContent$Button2" in form:
+                    self._send("add_application", body=server.page("add_application"))
+                elif path == DEFAULT_PATH:
+                    captcha_value = form.get("ctl00$MainContent$hfCaptchaValue", [""])[0]
+                    self._send("final_post", body=server.page("final_post", booking_ok=captcha_value == MOCK_CAPTCHA_TEXT))
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+
+def point_clients_at(base_url):
+    """
+    讓 login_module、booking_service、captcha_service、session_cache 改連到替身伺服器。
+
+    Returns:
+        callable: 呼叫後還原原本的 URL。
+    """
+    import booking_service
+    import captcha_service
+    import login_module
+    import session_cache
+
+    originals = (login_module.login_url, booking_service.BASE_URL, captcha_service.CAPTCHA_URL, session_cache.BASE_URL)
+    login_module.login_url = base_url + LOGIN_PATH
+    booking_service.BASE_URL = session_cache.BASE_URL = base_url + DEFAULT_PATH
+    captcha_service.CAPTCHA_URL = base_url + CAPTCHA_PATH
+
+    def restore():
+        (login_module.login_url, booking_service.BASE_URL, captcha_service.CAPTCHA_URL,
+         session_cache.BASE_URL) = originals
+
+    return restore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每個回應注入的延遲 (毫秒)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="延遲的隨機抖動上限 (毫秒)")
+    parser.add_argument("--fixtures", default=None, help="錄製頁面目錄")
+    parser.add_argument("--ocr-model", action="append", default=[], metavar="NAME:LATENCY_MS[:ACCURACY[:ERROR_RATE]]",
+                        help="替身 OCR 模型的延遲、正確率與錯誤率 (可重複指定)")
+    parser.add_argument("--throttle-rate", type=float, default=None, help="每秒超過此請求數時回應 429")
+    args = parser.parse_args()
+
+    ocr_models = {}
+    for spec in args.ocr_model:
+        name, latency_ms, *rates = spec.split(":")
+        ocr_models[name] = {"latency": float(latency_ms) / 1000,
+                            "accuracy": float(rates[0]) if rates else 1.0,
+                            "error_rate": float(rates[1]) if len(rates) > 1 else 0.0}
+    server = MockNDHUServer(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000, args.fixtures,
+                            ocr_models=ocr_models, throttle_rate=args.throttle_rate)
+    print(f"[mock] 替身伺服器已啟動: {server.base_url}{DEFAULT_PATH} (Ctrl+C 結束)")
+    print(f"[mock] 替身 OCR (OpenAI 相容): {server.ocr_base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
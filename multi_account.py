@@ -0,0 +1,198 @@
+"""
+多帳號平行預約：每個帳號在獨立的行程中登入並競速自己分配到的候選。
+
+候選 (場地 × 時段) 以輪流方式分配給各帳號，帳號之間不會搶同一個場地時段。
+
+    python multi_account.py --accounts accounts.csv --venues "VOL0*" --hours 06,07 --date 2025/06/05
+
+帳號檔為 CSV (標題列 username,password[,department,email,phone]) 或同樣欄位的 JSON 陣列。
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from booking_targets import expand_candidates
+
+ACCOUNT_FIELDS = ("username", "password", "department", "email", "phone")
+
+
+def load_accounts(path):
+    """
+    讀取帳號檔 (.json 或 .csv)。
+
+    Returns:
+        list: 每個帳號一個 dict，至少包含 username 與 password。
+
+    Raises:
+        ValueError: 檔案中沒有帳號或有帳號缺少 username / password。
+    """
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    accounts = []
+    for i, row in enumerate(rows, 1):
+        account = {field: (row.get(field) or "").strip() for field in ACCOUNT_FIELDS}
+        if not (account["username"] and account["password"]):
+            raise ValueError(f"帳號檔第 {i} 筆缺少 username 或 password")
+        accounts.append(account)
+    if not accounts:
+        raise ValueError(f"帳號檔 {path} 中沒有帳號")
+    return accounts
+
+
+def assign_targets(candidates, account_count):
+    """將候選以輪流方式分給各帳號，回傳與帳號順序對應的候選清單 (彼此不重疊)。"""
+    return [candidates[i::account_count] for i in range(account_count)]
+
+
+def account_cache_path(username):
+    """每個帳號各自的登入狀態快取檔案。"""
+    import session_cache
+    root, ext = os.path.splitext(session_cache.DEFAULT_CACHE_PATH)
+    return f"{root}.{username}{ext}"
+
+
+def _run_account(account, targets, date, ocr_name, max_parallel, use_session_cache, rate_limit=None):
+    """
+    工作行程的進入點：登入 (或還原快取) 後競速分配到的候選。
+    rate_limit 為此行程分到的每個 host 速率 (次/秒)，None 時沿用 NDHU_RATE_LIMIT。
+
+    Returns:
+        dict: 可跨行程傳遞的結果摘要 (不含 Response 物件)。
+    """
+    from booking_engine import also_booked, run_race
+    from login_module import LoginClient
+    from main import resolve_ocr_func
+    from session_cache import restore_or_login
+    import rate_limiter
+    import settings
+
+    if rate_limit is not None:
+        rate_limiter.configure(rate_limit)
+    summary = {"username": account["username"], "targets": targets, "logged_in": False, "winner": None,
+               "results": [], "login_time": 0.0, "elapsed": 0.0}
+    started_at = time.perf_counter()
+    client = LoginClient(account["username"], account["password"])
+    if use_session_cache:
+        active_session, login_response, _ = restore_or_login(client.login, account["username"],
+                                                             account_cache_path(account["username"]),
+                                                             session=client.session)
+    else:
+        active_session, login_response, _ = client.login()
+    summary["login_time"] = time.perf_counter() - started_at
+    if not (active_session and login_response):
+        summary["elapsed"] = time.perf_counter() - started_at
+        return summary
+    summary["logged_in"] = True
+
+    # 工作行程是新的直譯器，settings.getenv 會先載入 .env
+    user_details = {
+        "department": account["department"] or settings.getenv("USER_DEPARTMENT", "材料科學與工程學系"),
+        "email": account["email"] or settings.getenv("USER_EMAIL", "your_email@gms.ndhu.edu.tw"),
+        "phone": account["phone"] or settings.getenv("USER_PHONE", "0912345678"),
+    }
+    winner, results = run_race(targets, date, user_details, ocr_func=resolve_ocr_func(ocr_name),
+                               session=active_session, max_parallel=max_parallel)
+    summary["results"] = [
+        {key: result[key] for key in ("venue_code", "start_hour_key", "status", "error", "elapsed")}
+        for result in results
+    ]
+    if winner:
+        summary["winner"] = (winner["venue_code"], winner["start_hour_key"])
+        summary["also_booked"] = [(result["venue_code"], result["start_hour_key"])
+                                  for result in also_booked(winner, results)]
+    summary["elapsed"] = time.perf_counter() - started_at
+    return summary
+
+
+def run_accounts(accounts, candidates, date, ocr_name="gemini", max_workers=None, max_parallel=None,
+                 use_session_cache=True, rate_limit=None):
+    """
+    以行程池平行執行各帳號的 登入 → 競速預約，並列出整體吞吐量。
+
+    Args:
+        accounts (list): load_accounts 的結果。
+        candidates (list): (venue_code, start_hour_key) 清單。
+        date (str): 預約日期 "YYYY/MM/DD"。
+        ocr_name (str, optional): 驗證碼辨識方式 ("gemini" / "local" / "hedged" / "router")。
+        max_workers (int, optional): 同時執行的帳號數，預設為全部帳號。
+        max_parallel (int, optional): 每個帳號同時進行的候選數量上限。
+        use_session_cache (bool, optional): 是否使用各帳號的登入狀態快取。
+        rate_limit (float, optional): 所有帳號合計每個 host 每秒的請求數，平均分給同時執行的行程
+                                      (各行程的限速器彼此獨立)；0 停用限速與重試。
+
+    Returns:
+        list: 每個帳號的結果摘要 (順序與 accounts 相同，未分配到候選的帳號不執行)。
+    """
+    assignments = [(account, targets) for account, targets in zip(accounts, assign_targets(candidates, len(accounts)))
+                   if targets]
+    skipped = len(accounts) - len(assignments)
+    if skipped:
+        print(f"[multi_account] 候選數少於帳號數，{skipped} 個帳號未分配到候選。")
+
+    workers = max_workers or len(assignments)
+    rate_share = None if rate_limit is None else rate_limit / min(workers, len(assignments) or 1)
+    started_at = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_run_account, account, targets, date, ocr_name, max_parallel, use_session_cache,
+                            rate_share)
+            for account, targets in assignments
+        ]
+        summaries = []
+        for (account, targets), future in zip(assignments, futures):
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                print(f"[multi_account] 帳號 {account['username']} 的工作行程發生錯誤: {e}")
+                summaries.append({"username": account["username"], "targets": targets, "logged_in": False,
+                                  "winner": None, "results": [], "login_time": 0.0, "elapsed": 0.0,
+                                  "error": str(e)})
+    wall_time = time.perf_counter() - started_at
+
+    attempts = sum(len(s["results"]) for s in summaries)
+    booked = [s for s in summaries if s["winner"]]
+    print(f"\n[multi_account] {len(summaries)} 個帳號，{attempts} 次預約嘗試，{len(booked)} 個成功，"
+          f"耗時 {wall_time:.2f}s (吞吐量 {attempts / wall_time:.2f} 次/秒)")
+    for s in summaries:
+        outcome = f"{s['winner'][0]}@{s['winner'][1]}" if s["winner"] else ("未登入" if not s["logged_in"] else "未成功")
+        if s.get("also_booked"):
+            outcome += " (重複預約：" + ", ".join(f"{venue}@{hour}" for venue, hour in s["also_booked"]) + ")"
+        print(f"  {s['username']}: {outcome}  (登入 {s['login_time']:.2f}s，總計 {s['elapsed']:.2f}s，"
+              f"候選 {len(s['targets'])} 個)")
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", required=True, help="帳號檔 (.csv 或 .json)")
+    parser.add_argument("--venues", required=True, help="場地代碼，逗號分隔，可使用萬用字元")
+    parser.add_argument("--hours", required=True, help="開始時段，逗號分隔")
+    parser.add_argument("--date", required=True, help="預約日期 YYYY/MM/DD")
+    parser.add_argument("--ocr", choices=["gemini", "local", "hedged", "router"], default="gemini")
+    parser.add_argument("--workers", type=int, default=None, help="同時執行的帳號數 (預設為全部)")
+    parser.add_argument("--max-parallel", type=int, default=None, help="每個帳號同時進行的候選數量上限")
+    parser.add_argument("--no-session-cache", action="store_true", help="不使用登入狀態快取")
+    parser.add_argument("--rate-limit", type=float, default=None, metavar="RATE",
+                        help="所有帳號合計每個 host 每秒的初始請求數，平均分給各行程 (0 停用)")
+    args = parser.parse_args(argv)
+
+    try:
+        accounts = load_accounts(args.accounts)
+        candidates = expand_candidates(args.venues.split(","), args.hours.split(","))
+    except (OSError, ValueError) as e:
+        print(f"[multi_account] 錯誤：{e}")
+        return
+    run_accounts(accounts, candidates, args.date, ocr_name=args.ocr, max_workers=args.workers,
+                 max_parallel=args.max_parallel, use_session_cache=not args.no_session_cache,
+                 rate_limit=args.rate_limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import functools
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+
+# 預設同時送出的模型 (同一模型重複代表對同一模型多送一次請求)
+DEFAULT_HEDGE_MODELS = (
+    "gemini-2.5-flash-preview-05-20",
+    "gemini-2.0-flash",
+    "gemini-2.5-flash-preview-05-20",
+)
+DEFAULT_QUORUM = 2
+DEFAULT_DEADLINE = 4.0
+
+
+def normalize_answer(text):
+    """比對投票時使用的正規化：去除所有空白。"""
+    return "".join(text.split())
+
+
+def _safe_call(recognizer, base64_image_data):
+    try:
+        return recognizer(base64_image_data)
+    except Exception as e:
+        print(f"[ocr_hedge] 辨識請求發生錯誤: {e}")
+        return None
+
+
+def hedged_ocr(base64_image_data, recognizers, quorum=DEFAULT_QUORUM, deadline=DEFAULT_DEADLINE):
+    """
+    將同一張驗證碼同時送給多個辨識器，以多數決決定答案。
+
+    - 任一答案得到 quorum 票時立即回傳，不等待其餘請求。
+    - 超過 deadline 秒仍未達 quorum 時，回傳目前票數最多的答案 (同票取最早到達者)；
+      若還沒有任何答案，則最多再等 deadline 秒，回傳之後第一個到達的答案。
+
+    Args:
+        base64_image_data (str): Base64 圖片資料，原樣傳給每個辨識器。
+        recognizers (list): 辨識函式清單，簽名為 func(base64_image_data) -> str or None。
+        quorum (int, optional): 提早回傳所需的相同答案數。
+        deadline (float, optional): 等待 quorum 的秒數上限。
+
+    Returns:
+        str: 選出的答案；全部辨識器都失敗或逾時時回傳 None。
+    """
+    started_at = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=len(recognizers))
+    futures = [executor.submit(_safe_call, recognizer, base64_image_data) for recognizer in recognizers]
+    votes = Counter()
+    first_seen = {}  # 正規化答案 -> (到達順序, 原始答案)
+
+    def _record(text):
+        key = normalize_answer(text)
+        votes[key] += 1
+        first_seen.setdefault(key, (len(first_seen), text))
+        return key
+
+    try:
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                text = future.result()
+                if text is None:
+                    continue
+                key = _record(text)
+                if votes[key] >= quorum:
+                    print(f"[ocr_hedge] {votes[key]}/{len(recognizers)} 票一致 \"{first_seen[key][1]}\" "
+                          f"({(time.perf_counter() - started_at) * 1000:.0f} ms)")
+                    return first_seen[key][1]
+        except FuturesTimeoutError:
+            print(f"[ocr_hedge] 超過 {deadline:.1f} 秒仍未達 {quorum} 票一致。")
+
+        if not votes:
+            # 期限內沒有任何答案：採用之後最快到達的答案 (同樣最多等 deadline 秒)
+            try:
+                for future in as_completed([f for f in futures if not f.done()], timeout=deadline):
+                    text = future.result()
+                    if text is not None:
+                        _record(text)
+                        break
+            except FuturesTimeoutError:
+                print(f"[ocr_hedge] 再等 {deadline:.1f} 秒仍沒有任何答案，放棄。")
+                return None
+        if not votes:
+            return None
+        best = max(votes, key=lambda key: (votes[key], -first_seen[key][0]))
+        print(f"[ocr_hedge] 採用 \"{first_seen[best][1]}\" ({votes[best]} 票，"
+              f"{(time.perf_counter() - started_at) * 1000:.0f} ms)")
+        return first_seen[best][1]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def make_hedged_ocr(models=DEFAULT_HEDGE_MODELS, quorum=DEFAULT_QUORUM, deadline=DEFAULT_DEADLINE, extra_recognizers=()):
+    """
+    建立一個與 get_text_from_image_gemini 相同簽名的多模型投票辨識函式。
+
+    Args:
+        models (iterable): 每個元素對應一個 Gemini 請求 (可重複同一模型)。
+        extra_recognizers (iterable, optional): 其他辨識函式 (例如 local_captcha.get_text_from_image_local) 一併投票。
+    """
+    from gemini_service import get_text_from_image_gemini
+
+    recognizers = [functools.partial(get_text_from_image_gemini, model_name=model) for model in models]
+    recognizers.extend(extra_recognizers)
+
+    def get_text_from_image_hedged(base64_image_data):
+        return hedged_ocr(base64_image_data, recognizers, quorum=quorum, deadline=deadline)
+
+    return get_text_from_image_hedged
@@ -0,0 +1,371 @@
+"""
+OCR 路由：在多個驗證碼辨識後端 (不同的 Gemini 模型、本機模型、其他 OpenAI 相容服務) 之間，
+為每張驗證碼選出「預期多久能讓最終 POST 通過」最短的後端。
+
+每個後端以 EWMA 追蹤：
+  latency      成功回應的延遲 (秒；逾時以逾時秒數計)
+  error_rate   沒有答案 (例外、回傳 None、逾時) 的比例
+  accept_rate  答案被伺服器接受的比例 (最終 POST 判定後由 captcha_service.report_captcha_verdict 回報)
+
+每次嘗試的成本是 OCR 延遲，加上有答案時一次最終 POST (retry_cost)；成功機率為
+(1 - error_rate) × accept_rate，因此 (幾何分佈的期望值)：
+
+  預期時間 = (latency + (1 - error_rate) × retry_cost) / ((1 - error_rate) × accept_rate)
+
+連續失敗 failure_threshold 次的後端會被斷路 cooldown 秒 (試探再失敗則加倍，上限 max_cooldown)；
+冷卻結束後只放行一個試探請求，成功才恢復。統計存於 .ocr_router_stats.json，下次執行時沿用。
+
+後端設定 (--ocr-backends 或環境變數 NDHU_OCR_BACKENDS，以逗號分隔)：
+  local                       本機模型 (local_captcha，需先訓練)
+  gemini / gemini:<model>     Gemini (預設模型 / 指定模型)
+  <model>@<base_url>          其他 OpenAI 相容 API (金鑰取自 NDHU_OCR_API_KEY)，例如
+                              MOCK@http://127.0.0.1:8080/v1/ (mock_ndhu_server 的替身 OCR)
+"""
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from dataclasses import dataclass
+
+import settings
+import telemetry
+
+OCR_BACKENDS_ENV = "NDHU_OCR_BACKENDS"
+OCR_API_KEY_ENV = "NDHU_OCR_API_KEY"
+DEFAULT_STATS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ocr_router_stats.json")
+DEFAULT_BACKENDS = "gemini,gemini:gemini-2.0-flash"
+DEFAULT_ALPHA = 0.2
+DEFAULT_TIMEOUT = 8.0
+# 隨機改用非最佳後端的機率，讓較少被選到的後端統計不至於過時
+DEFAULT_EXPLORE = 0.05
+# 答錯一次的額外成本：一次最終 POST 的來回 (秒)
+DEFAULT_RETRY_COST = 0.5
+FAILURE_THRESHOLD = 3
+COOLDOWN = 30.0
+MAX_COOLDOWN = 300.0
+# 計算預期時間時成功率的下限，避免除以 0
+MIN_SUCCESS_RATE = 0.02
+
+_router = None
+_router_lock = threading.Lock()
+
+
+class RoutedAnswer(str):
+    """路由器回傳的答案；記得由哪個後端產生，最終 POST 判定後以 report_verdict 回報。"""
+    backend = None
+    router = None
+
+    def report_verdict(self, accepted):
+        if self.router is not None:
+            self.router.record_verdict(self.backend, accepted)
+
+
+@dataclass
+class OcrBackend:
+    """
+    單一辨識後端與其統計。latency / error_rate / accept_rate 的初始值為先驗估計，
+    先驗視為一個樣本，樣本數少時以 1/(n+1) 的權重平均 (比 alpha 大)，之後才是一般的 EWMA。
+    """
+    name: str
+    func: object  # func(base64_image_data) -> str or None
+    warm_up: object = None  # 預先建立連線 / client 的函式 (可為 None)
+    timeout: float = DEFAULT_TIMEOUT
+    latency: float = 2.0
+    error_rate: float = 0.0
+    accept_rate: float = 0.8
+    calls: int = 0
+    verdicts: int = 0
+    consecutive_failures: int = 0
+    open_until: float = 0.0  # 斷路到何時 (time.monotonic)；0 代表未斷路
+    cooldown: float = COOLDOWN
+    probing: bool = False  # 冷卻結束後的試探請求是否進行中
+
+    def expected_time(self, retry_cost=DEFAULT_RETRY_COST):
+        answered = 1 - self.error_rate
+        return (self.latency + answered * retry_cost) / max(answered * self.accept_rate, MIN_SUCCESS_RATE)
+
+    def state(self, now=None):
+        if not self.open_until:
+            return "closed"
+        if self.probing or (now or time.monotonic()) < self.open_until:
+            return "open"
+        return "half-open"
+
+    def stats(self):
+        return {"latency": round(self.latency, 4), "error_rate": round(self.error_rate, 4),
+                "accept_rate": round(self.accept_rate, 4), "calls": self.calls, "verdicts": self.verdicts}
+
+
+class OcrRouter:
+    """
+    依預期時間選擇後端的驗證碼辨識器；本身就是 func(base64_image_data) -> str or None 的辨識函式。
+
+    Args:
+        backends (list): OcrBackend 清單 (名稱不可重複)。
+        alpha (float, optional): EWMA 中新樣本的權重。
+        explore (float, optional): 隨機改用其他可用後端的機率。
+        retry_cost (float, optional): 答錯一次的額外秒數 (最終 POST 的來回)。
+        max_attempts (int, optional): 同一張驗證碼最多嘗試幾個後端 (沒有答案或逾時就改用下一個)。
+        failure_threshold (int, optional): 連續失敗幾次後斷路。
+        cooldown (float, optional): 斷路秒數；試探失敗時加倍，上限 max_cooldown。
+        stats_path (str, optional): 統計檔路徑，None 代表不讀寫。
+    """
+
+    def __init__(self, backends, alpha=DEFAULT_ALPHA, explore=DEFAULT_EXPLORE, retry_cost=DEFAULT_RETRY_COST,
+                 max_attempts=2, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN, max_cooldown=MAX_COOLDOWN,
+                 stats_path=None):
+        if not backends:
+            raise ValueError("至少需要一個 OCR 後端")
+        self.backends = {}
+        for backend in backends:
+            if backend.name in self.backends:
+                raise ValueError(f"OCR 後端名稱重複: {backend.name}")
+            backend.cooldown = cooldown
+            self.backends[backend.name] = backend
+        self.alpha = alpha
+        self.explore = explore
+        self.retry_cost = retry_cost
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.stats_path = stats_path
+        self._lock = threading.Lock()
+        # 逾時的請求無法中斷，會繼續佔用一個執行緒直到結束，因此保留額外的執行緒
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(backends)), thread_name_prefix="ocr-router")
+        if stats_path:
+            self.load_stats()
+
+    def rank(self):
+        """未斷路的後端，依預期時間由短到長排序。"""
+        now = time.monotonic()
+        with self._lock:
+            available = [backend for backend in self.backends.values() if backend.state(now) != "open"]
+            return sorted(available, key=lambda backend: backend.expected_time(self.retry_cost))
+
+    def warm_up(self):
+        """預先建立各後端的 client (例如 import openai)，避免第一次辨識的延遲被算進統計。"""
+        for backend in self.backends.values():
+            if backend.warm_up is not None:
+                try:
+                    backend.warm_up()
+                except Exception as e:
+                    print(f"[ocr_router] {backend.name} 預熱失敗: {e}")
+
+    def _weight(self, samples):
+        return max(self.alpha, 1 / (samples + 1))
+
+    def _plan(self):
+        ranked = self.rank()
+        if not ranked:
+            # 全部斷路：仍嘗試最早恢復的後端，總比直接放棄好
+            return [min(self.backends.values(), key=lambda backend: backend.open_until)]
+        if len(ranked) > 1 and random.random() < self.explore:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked[:self.max_attempts]
+
+    def _admit(self, backend):
+        """冷卻結束的後端只放行一個試探請求；回傳是否可以呼叫。"""
+        with self._lock:
+            state = backend.state()
+            if state == "half-open":
+                backend.probing = True
+            return state != "open" or len(self.backends) == 1 or all(
+                other.state() == "open" for other in self.backends.values())
+
+    def __call__(self, base64_image_data):
+        for backend in self._plan():
+            if not self._admit(backend):
+                continue
+            text = self._call(backend, base64_image_data)
+            if text is not None:
+                answer = RoutedAnswer(text)
+                answer.backend, answer.router = backend.name, self
+                return answer
+        return None
+
+    def _call(self, backend, base64_image_data):
+        timed_out = False
+        with telemetry.span("ocr.route", backend=backend.name) as attrs:
+            started_at = time.perf_counter()
+            # 複製 contextvars，讓後端內的 span 仍屬於目前的追蹤
+            future = self._executor.submit(contextvars.copy_context().run, backend.func, base64_image_data)
+            try:
+                text = future.result(timeout=backend.timeout)
+            except FuturesTimeoutError:
+                text, timed_out = None, True
+                print(f"[ocr_router] {backend.name} 超過 {backend.timeout:.1f} 秒未回應。")
+            except Exception as e:
+                text = None
+                print(f"[ocr_router] {backend.name} 辨識時發生錯誤: {e}")
+            elapsed = time.perf_counter() - started_at
+            attrs["outcome"] = "timeout" if timed_out else ("ok" if text is not None else "error")
+        self.record_call(backend.name, elapsed, text is not None, timed_out)
+        return text
+
+    def record_call(self, name, seconds, ok, timed_out=False):
+        """記錄一次辨識請求的結果，並更新斷路器狀態。"""
+        with self._lock:
+            backend = self.backends[name]
+            backend.calls += 1
+            weight = self._weight(backend.calls)
+            backend.error_rate += weight * ((0.0 if ok else 1.0) - backend.error_rate)
+            if ok or timed_out:
+                backend.latency += weight * ((backend.timeout if timed_out else seconds) - backend.latency)
+
+            if ok:
+                if backend.open_until:
+                    print(f"[ocr_router] {name} 已恢復。")
+                backend.consecutive_failures = 0
+                backend.open_until = 0.0
+                backend.cooldown = self.cooldown
+                backend.probing = False
+                return
+            backend.consecutive_failures += 1
+            if backend.probing:
+                backend.cooldown = min(backend.cooldown * 2, self.max_cooldown)
+            elif backend.consecutive_failures < self.failure_threshold:
+                return
+            backend.open_until = time.monotonic() + backend.cooldown
+            backend.probing = False
+            print(f"[ocr_router] {name} 連續失敗 {backend.consecutive_failures} 次，暫停使用 {backend.cooldown:.0f} 秒。")
+
+    def record_verdict(self, name, accepted):
+        """記錄某個後端的答案是否被伺服器接受。"""
+        with self._lock:
+            backend = self.backends.get(name)
+            if backend is None:
+                return
+            backend.verdicts += 1
+            backend.accept_rate += self._weight(backend.verdicts) * ((1.0 if accepted else 0.0) - backend.accept_rate)
+        self.save_stats()
+
+    def snapshot(self):
+        """各後端的統計、預期時間與斷路器狀態 (依預期時間排序)。"""
+        now = time.monotonic()
+        with self._lock:
+            rows = [dict(name=backend.name, **backend.stats(),
+                         expected_time=round(backend.expected_time(self.retry_cost), 4), state=backend.state(now))
+                    for backend in self.backends.values()]
+        return sorted(rows, key=lambda row: row["expected_time"])
+
+    def load_stats(self):
+        try:
+            with open(self.stats_path, encoding="utf-8") as f:
+                saved = json.load(f).get("backends", {})
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[ocr_router] 無法讀取統計檔 {self.stats_path}: {e}")
+            return
+        with self._lock:
+            for name, stats in saved.items():
+                backend = self.backends.get(name)
+                if backend is None:
+                    continue
+                for field in ("latency", "error_rate", "accept_rate", "calls", "verdicts"):
+                    if field in stats:
+                        setattr(backend, field, type(getattr(backend, field))(stats[field]))
+
+    def save_stats(self):
+        if not self.stats_path:
+            return
+        with self._lock:
+            data = {"updated_at": time.time(),
+                    "backends": {backend.name: backend.stats() for backend in self.backends.values()}}
+        temp_path = f"{self.stats_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.stats_path)
+        except OSError as e:
+            print(f"[ocr_router] 無法寫入統計檔 {self.stats_path}: {e}")
+
+    def close(self):
+        self.save_stats()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def gemini_backend(model=None, base_url=None, api_key=None, timeout=DEFAULT_TIMEOUT, name=None, latency=2.0):
+    """以 gemini_service 呼叫 Gemini 或其他 OpenAI 相容 API 的後端。"""
+    from gemini_service import DEFAULT_OCR_MODEL, get_client, get_text_from_image_gemini
+
+    model = model or DEFAULT_OCR_MODEL
+    func = functools.partial(get_text_from_image_gemini, model_name=model, base_url=base_url, api_key=api_key,
+                             timeout=timeout)
+    return OcrBackend(name or f"gemini:{model}", func, warm_up=functools.partial(get_client, base_url, api_key),
+                      timeout=timeout, latency=latency)
+
+
+def local_backend(model_path=None, timeout=2.0):
+    """本機 k-NN 模型 (local_captcha) 的後端。"""
+    from local_captcha import DEFAULT_MODEL_PATH, get_text_from_image_local
+
+    func = functools.partial(get_text_from_image_local, model_path=model_path or DEFAULT_MODEL_PATH)
+    return OcrBackend("local", func, warm_up=local_model_available, timeout=timeout, latency=0.05)
+
+
+def local_model_available():
+    from local_captcha import DEFAULT_MODEL_PATH, dependencies_available
+    return dependencies_available() and os.path.exists(DEFAULT_MODEL_PATH)
+
+
+def parse_backends(spec, timeout=DEFAULT_TIMEOUT):
+    """將逗號分隔的後端設定 (格式見模組說明) 轉成 OcrBackend 清單。"""
+    backends = []
+    for item in (part.strip() for part in spec.split(",")):
+        if not item:
+            continue
+        if item == "local":
+            backends.append(local_backend())
+        elif "@" in item:
+            model, base_url = item.split("@", 1)
+            # 自訂的 API 不送出 GEMINI_API_KEY
+            backends.append(gemini_backend(model, base_url, api_key=settings.getenv(OCR_API_KEY_ENV) or "unused",
+                                           timeout=timeout, name=item))
+        elif item == "gemini" or item.startswith("gemini:"):
+            backends.append(gemini_backend(item.partition(":")[2] or None, timeout=timeout))
+        else:
+            raise ValueError(f"無法解析的 OCR 後端 '{item}' (可用: local、gemini[:model]、model@base_url)")
+    return backends
+
+
+def get_router(spec=None):
+    """
+    回傳共用的路由器；第一次呼叫時依 spec、NDHU_OCR_BACKENDS 或預設後端建立
+    (預設為兩個 Gemini 模型，已訓練本機模型時再加上 local)，程式結束時儲存統計。
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            spec = spec or settings.getenv(OCR_BACKENDS_ENV)
+            if not spec:
+                spec = DEFAULT_BACKENDS + (",local" if local_model_available() else "")
+            _router = OcrRouter(parse_backends(spec), stats_path=DEFAULT_STATS_PATH)
+            atexit.register(_router.close)
+        return _router
+
+
+def print_snapshot(rows):
+    print(f"{'backend':<40} {'expected':>9} {'latency':>9} {'errors':>7} {'accept':>7} {'calls':>6}  state")
+    for row in rows:
+        print(f"{row['name']:<40} {row['expected_time']:>8.2f}s {row['latency']:>8.2f}s {row['error_rate']:>7.0%} "
+              f"{row['accept_rate']:>7.0%} {row['calls']:>6}  {row['state']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列出 OCR 路由器目前的後端統計 (.ocr_router_stats.json)")
+    parser.add_argument("--backends", default=None, help=f"後端設定，預設為 {OCR_BACKENDS_ENV} 或內建預設")
+    args = parser.parse_args()
+    router = get_router(args.backends)
+    print_snapshot(router.snapshot())
+
+
+if __name__ == '__main__':
+    main()
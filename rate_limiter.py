@@ -0,0 +1,310 @@
+"""
+每個 host 的自適應速率限制與重試 (AIMD token bucket)。
+
+經過 http_client session 的請求 (sys.ndhu.edu.tw、SysCaptcha 等) 與 gemini_service 的 OCR 請求，
+送出前都先向所屬 host 的 token bucket 取得 token：
+
+- 回應正常且延遲沒有明顯上升時，速率加 increase (加法增加，上限 max_rate)；
+- 收到 429 / 5xx、連線失敗，或延遲明顯超過同一 (方法, 路徑) 的基準 (伺服器開始排隊) 時，速率乘以
+  decrease (乘法減少，下限 min_rate；hold 秒內只減一次)。Retry-After 會暫停整個 host。
+  延遲基準依 (方法, 路徑) 分開計算，輕量的 GET 與較重的 POST 不會互相比較。
+
+可重試的失敗以 full jitter 指數退避重試 (RetryPolicy)：
+- GET 等冪等請求：連線失敗、逾時、429、502 / 503 / 504；
+- POST (登入、新增申請、最終預約)：只在伺服器確定沒有處理時 (連線建立失敗、429、503)，避免重複送出。
+
+速率以環境變數 NDHU_RATE_LIMIT (每個 host 每秒的初始請求數，0 代表停用) 或 main --rate-limit 設定。
+"""
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+import telemetry
+
+RATE_LIMIT_ENV = "NDHU_RATE_LIMIT"
+DEFAULT_RATE = 20.0
+# 可以連續送出的請求數；16 個候選的競速 (新增申請 + 最終 POST) 不會被延後
+DEFAULT_BURST = 32
+MIN_RATE = 0.5
+MAX_RATE = 50.0
+INCREASE = 0.5
+DECREASE = 0.5
+# 延遲超過基準幾倍、且至少多出 SLOW_MARGIN 秒，視為伺服器開始排隊
+SLOW_FACTOR = 3.0
+SLOW_MARGIN = 0.5
+# 同一路徑累積幾個樣本後才判斷是否變慢
+SLOW_MIN_SAMPLES = 5
+# 兩次乘法減少之間至少間隔的秒數 (同一波失敗只減一次)
+DECREASE_HOLD = 1.0
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# 伺服器確定沒有處理請求的狀態碼，POST 也可以重試
+UNPROCESSED_STATUSES = frozenset({429, 503})
+
+_limiter = None
+_limiter_configured = False
+_limiter_lock = threading.Lock()
+
+
+@dataclass
+class RetryPolicy:
+    """
+    重試次數與退避時間。
+
+    Attributes:
+        max_retries: 第一次之外最多重試幾次。
+        backoff_base / backoff_cap: 第 n 次重試前等待 uniform(0, min(cap, base × 2^n)) 秒。
+        max_retry_after: 伺服器要求等待 (Retry-After) 超過此秒數時不重試，直接回傳回應。
+    """
+    max_retries: int = 2
+    backoff_base: float = 0.2
+    backoff_cap: float = 4.0
+    max_retry_after: float = 10.0
+
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+
+class HostBucket:
+    """單一 host 的 token bucket 與 AIMD 速率。"""
+
+    def __init__(self, host, rate=DEFAULT_RATE, burst=DEFAULT_BURST, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.latencies = {}  # (方法, 路徑) -> [延遲基準 (EWMA，秒), 樣本數]
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """預約一個 token，回傳送出前需要等待的秒數 (token 不足時排在前面的預約之後)。"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, self.blocked_until - now, 0.0)
+
+    def observe(self, latency=None, status=None, retry_after=None, failed=False, route=None):
+        """
+        依一次請求的結果調整速率。
+
+        Args:
+            latency (float, optional): 送出到收到回應標頭的秒數。
+            status (int, optional): HTTP 狀態碼。
+            retry_after (float, optional): 伺服器要求等待的秒數。
+            failed (bool, optional): 連線失敗或逾時 (沒有回應)。
+            route (tuple, optional): (方法, 路徑)，延遲基準依此分開計算。
+        """
+        with self._lock:
+            now = time.monotonic()
+            throttled = failed or (status is not None and (status == 429 or status >= 500))
+            slow = False
+            if latency is not None and not throttled:
+                baseline = self.latencies.get(route)
+                if baseline is None:
+                    self.latencies[route] = [latency, 1]
+                else:
+                    slow = (baseline[1] >= SLOW_MIN_SAMPLES and latency > baseline[0] * SLOW_FACTOR
+                            and latency - baseline[0] > SLOW_MARGIN)
+                    # 變慢的樣本只緩慢拉高基準，伺服器長期變慢時最終仍會適應
+                    baseline[0] += (0.02 if slow else 0.1) * (latency - baseline[0])
+                    baseline[1] += 1
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if throttled or slow:
+                if now - self.last_decrease >= DECREASE_HOLD:
+                    previous = self.rate
+                    self.rate = max(self.min_rate, self.rate * DECREASE)
+                    self.last_decrease = now
+                    self.throttled += 1
+                    if slow:
+                        reason = f"延遲 {latency * 1000:.0f} ms"
+                    else:
+                        reason = f"HTTP {status}" if status else "連線失敗"
+                    print(f"[rate_limiter] {self.host} {reason}，速率 {previous:.1f} → {self.rate:.1f} 次/秒")
+            elif status is not None:
+                self.rate = min(self.max_rate, self.rate + INCREASE)
+
+    def snapshot(self):
+        with self._lock:
+            return {"host": self.host, "rate": round(self.rate, 2), "tokens": round(self.tokens, 2),
+                    "latency_ms": {" ".join(route) if route else "-": round(baseline[0] * 1000, 1)
+                                   for route, baseline in self.latencies.items()},
+                    "throttled": self.throttled}
+
+
+def parse_retry_after(value):
+    """Retry-After 標頭 (秒數或 HTTP 日期) 轉成秒數；無法解析時回傳 None。"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def connect_failed(exc):
+    """requests 的例外是否發生在連線建立階段 (請求確定沒有送達伺服器)。"""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        cause = exc.args[0]  # 通常是 urllib3 的 MaxRetryError，reason 為實際的錯誤
+        return isinstance(getattr(cause, "reason", cause), NewConnectionError)
+    return False
+
+
+class RateLimiter:
+    """
+    各 host 共用的速率限制與重試。
+
+    Args:
+        rate (float, optional): 每個 host 的初始速率 (次/秒)。
+        burst (int, optional): token bucket 容量。
+        policy (RetryPolicy, optional): 重試設定。
+        host_rates (dict, optional): host -> 初始速率，覆寫個別 host 的設定。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, policy=None, host_rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.policy = policy or RetryPolicy()
+        self.host_rates = dict(host_rates or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(host)
+                if bucket is None:
+                    rate = self.host_rates.get(host, self.rate)
+                    bucket = self._buckets[host] = HostBucket(host, rate, self.burst, max_rate=max(MAX_RATE, rate))
+        return bucket
+
+    def acquire(self, host):
+        """等到 host 有 token 可用；回傳等待的秒數。"""
+        wait = self.bucket(host).reserve()
+        if wait > 0:
+            telemetry.record("ratelimit.wait", wait * 1000, host=host)
+            time.sleep(wait)
+        return wait
+
+    def _retry_wait(self, host, attempt, reason, retry_after=None):
+        delay = self.policy.backoff(attempt, retry_after)
+        print(f"[rate_limiter] {host} {reason}，{delay:.2f} 秒後重試 ({attempt + 1}/{self.policy.max_retries})")
+        telemetry.record("ratelimit.backoff", delay * 1000, host=host, reason=reason)
+        time.sleep(delay)
+
+    def send(self, host, method, send_func, path=""):
+        """
+        限速並依重試規則執行一個 HTTP 請求 (http_client 的 adapter 使用)。
+
+        Args:
+            host (str): 限速的 host (含連接埠)。
+            method (str): HTTP 方法，決定哪些失敗可以重試。
+            send_func (callable): 實際送出請求、回傳 requests.Response 的函式 (可重複呼叫)。
+            path (str, optional): 請求路徑，延遲基準依 (方法, 路徑) 分開計算。
+        """
+        import requests
+
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        route = (method.upper(), path)
+        bucket = self.bucket(host)
+        for attempt in range(self.policy.max_retries + 1):
+            self.acquire(host)
+            started_at = time.perf_counter()
+            try:
+                response = send_func()
+            except requests.RequestException as e:
+                bucket.observe(failed=True)
+                retryable = connect_failed(e) or (idempotent and isinstance(e, (requests.ConnectionError,
+                                                                                requests.Timeout)))
+                if not retryable or attempt == self.policy.max_retries:
+                    raise
+                self._retry_wait(host, attempt, type(e).__name__)
+                continue
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            bucket.observe(time.perf_counter() - started_at, response.status_code, retry_after, route=route)
+            retryable = response.status_code in (RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES)
+            if (not retryable or attempt == self.policy.max_retries
+                    or (retry_after or 0.0) > self.policy.max_retry_after):
+                return response
+            response.close()
+            self._retry_wait(host, attempt, f"HTTP {response.status_code}", retry_after)
+
+    def call(self, host, func, error_status=None):
+        """
+        以同樣的限速與重試執行其他用戶端的請求 (例如 openai client)，視為冪等請求。
+
+        Args:
+            host (str): 限速的 host。
+            func (callable): 送出請求的函式，回傳值原樣回傳。
+            error_status (callable, optional): 例外 -> HTTP 狀態碼 (連線失敗回傳 0)；
+                                               回傳 None 表示不是可重試的錯誤，直接拋出。
+        """
+        bucket = self.bucket(host)
+        for attempt in range(self.policy.max_retries + 1):
+            self.acquire(host)
+            started_at = time.perf_counter()
+            try:
+                result = func()
+            except Exception as e:
+                status = error_status(e) if error_status else None
+                if status is None:
+                    raise
+                bucket.observe(status=status or None, failed=status == 0)
+                if (status and status not in RETRY_STATUSES) or attempt == self.policy.max_retries:
+                    raise
+                self._retry_wait(host, attempt, f"HTTP {status}" if status else type(e).__name__)
+                continue
+            bucket.observe(time.perf_counter() - started_at, 200, route=("CALL", ""))
+            return result
+
+    def snapshot(self):
+        with self._lock:
+            buckets = list(self._buckets.values())
+        return [bucket.snapshot() for bucket in buckets]
+
+
+def configure(rate=None, **kwargs):
+    """
+    設定共用的 RateLimiter (取代既有的)。rate 預設取自 NDHU_RATE_LIMIT，為 0 時停用限速與重試。
+
+    Returns:
+        RateLimiter or None
+    """
+    global _limiter, _limiter_configured
+    with _limiter_lock:
+        if rate is None:
+            rate = float(os.getenv(RATE_LIMIT_ENV) or DEFAULT_RATE)
+        _limiter = RateLimiter(rate, **kwargs) if rate > 0 else None
+        _limiter_configured = True
+        return _limiter
+
+
+def get_limiter():
+    """回傳共用的 RateLimiter (第一次呼叫時依 NDHU_RATE_LIMIT 建立)；停用時回傳 None。"""
+    if not _limiter_configured:
+        configure()
+    return _limiter
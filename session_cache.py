@@ -0,0 +1,120 @@
+import json
+import os
+import time
+
+import requests
+
+from booking_service import BASE_URL, COMMON_HEADERS
+from http_client import get_session
+
+# 預設快取檔案 (已加入 .gitignore；內容等同登入憑證，請勿分享)
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".session_cache.json")
+# 重導目標包含登入頁面，或回應內容出現帳密欄位，即代表登入狀態已失效
+LOGIN_REDIRECT_MARKER = "login.aspx"
+LOGIN_FORM_MARKER = "ctl00$MainContent$TxtPWD"
+
+
+def save_session(session, username, path=DEFAULT_CACHE_PATH):
+    """將 session 的 cookie jar (ASP.NET_SessionId、.ASPXAUTH、RequestVerificationToken 等) 寫入快取檔案。"""
+    cookies = [
+        {
+            "name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+            "secure": c.secure, "expires": c.expires,
+        }
+        for c in session.cookies
+    ]
+    data = {"username": username, "saved_at": time.time(), "cookies": cookies}
+    # 以 0600 權限建立，避免其他使用者讀取
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    print(f"[session_cache] 已儲存 {len(cookies)} 個 cookies 到 {path}")
+
+
+def load_session(session, username, path=DEFAULT_CACHE_PATH):
+    """
+    從快取檔案還原 cookies 到 session。
+
+    Returns:
+        bool: 快取存在、屬於同一帳號且至少還原了一個未過期的 cookie 時為 True。
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return False
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[session_cache] 無法讀取快取檔案: {e}")
+        return False
+
+    if data.get("username") != username:
+        print("[session_cache] 快取屬於其他帳號，略過。")
+        return False
+
+    now = time.time()
+    restored = 0
+    for cookie in data.get("cookies", []):
+        if cookie.get("expires") and cookie["expires"] < now:
+            continue
+        session.cookies.set(
+            cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"],
+            secure=cookie["secure"], expires=cookie["expires"],
+        )
+        restored += 1
+    return restored > 0
+
+
+def probe_session(session):
+    """
+    以一次不跟隨重導的 GET Default.aspx 確認登入狀態是否仍有效。
+
+    被重導到 login.aspx 或回應中出現登入表單時視為已失效。
+
+    Returns:
+        requests.Response: 登入狀態有效時回傳該次 GET 的回應，否則回傳 None。
+    """
+    try:
+        response = session.get(BASE_URL, headers=COMMON_HEADERS, timeout=10, allow_redirects=False)
+    except requests.exceptions.RequestException as e:
+        print(f"[session_cache] 驗證 session 時發生錯誤: {e}")
+        return None
+    if response.is_redirect:
+        location = response.headers.get("Location", "")
+        return None if LOGIN_REDIRECT_MARKER in location.lower() else response
+    if response.status_code != 200 or LOGIN_FORM_MARKER in response.text:
+        return None
+    return response
+
+
+def is_session_valid(session):
+    """session 的登入狀態是否仍有效 (見 probe_session)。"""
+    return probe_session(session) is not None
+
+
+def restore_or_login(login_func, username, path=DEFAULT_CACHE_PATH, session=None):
+    """
+    優先使用快取的登入狀態，失效時才執行完整登入並更新快取。
+
+    Args:
+        login_func (callable): 完整登入函式，回傳值與 login_module.perform_login 相同。
+        username (str): 目前的帳號 (快取只會還原給同一帳號)。
+        path (str, optional): 快取檔案路徑。
+        session (requests.Session, optional): 要還原到的 session，預設為共用 session。
+
+    Returns:
+        tuple: 與 perform_login 相同的 (session, response, initial_cookies)；
+               使用快取時 response 為驗證用的 GET 回應，initial_cookies 為 None。
+    """
+    http = session or get_session()
+    if load_session(http, username, path):
+        probe_response = probe_session(http)
+        if probe_response is not None:
+            print("[session_cache] 快取的登入狀態仍有效，略過登入。")
+            return http, probe_response, None
+        print("[session_cache] 快取的登入狀態已失效，重新登入。")
+        http.cookies.clear()
+
+    active_session, login_response, initial_cookies = login_func()
+    if active_session and login_response:
+        save_session(active_session, username, path)
+    return active_session, login_response, initial_cookies
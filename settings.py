@@ -0,0 +1,21 @@
+"""
+執行環境設定。
+
+.env 只在第一次呼叫 load_env() 時讀取，之後的呼叫直接回傳；各模組在需要帳密或 API 金鑰時
+才呼叫，import 時不讀檔，也不檢查設定是否存在。
+"""
+import functools
+import os
+
+
+@functools.lru_cache(maxsize=None)
+def load_env():
+    """載入 .env 中的環境變數 (已存在的環境變數不會被覆寫)。"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def getenv(name, default=None):
+    """先確保 .env 已載入，再讀取環境變數。"""
+    load_env()
+    return os.getenv(name, default)
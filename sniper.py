@@ -0,0 +1,199 @@
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from booking_service import BASE_URL, COMMON_HEADERS, trigger_add_application_form, BookingPayloadTemplate, send_booking_post
+from booking_service import form_params_after_rejection, book_with_captcha_retry, BookingResult, BookingStatus, CAPTCHA_RETRY_ATTEMPTS
+from booking_targets import build_booking_details
+from captcha_service import solve_form_captcha, report_captcha_verdict
+from http_client import get_session
+
+# 東華大學系統時間 (台灣時間，UTC+8)
+NDHU_TIMEZONE = timezone(timedelta(hours=8))
+# 距離目標時間還剩多少秒時改為忙碌等待，避免 time.sleep 的排程誤差
+BUSY_WAIT_THRESHOLD = 0.02
+
+
+def parse_release_time(value):
+    """將 "YYYY/MM/DD HH:MM[:SS]" (台灣時間) 轉成 UTC epoch 秒數。"""
+    for fmt in ("%Y/%m/%d %H:%M:%S", "%Y/%m/%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=NDHU_TIMEZONE).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"無法解析時間 '{value}'，請使用 YYYY/MM/DD HH:MM[:SS] 格式")
+
+
+def calibrate_clock(session=None, samples=8, url=BASE_URL):
+    """
+    從 Default.aspx 回應的 `Date` 標頭估計伺服器時鐘偏移與 RTT。
+
+    `Date` 只有秒的精度，因此每個樣本只能給出一個區間：伺服器在本機時間
+    [t0, t1] 之間的某一刻產生回應，且當時伺服器時間位於 [Date, Date + 1)。
+    所以 offset (= 伺服器時間 - 本機時間) 落在 [Date - t1, Date + 1 - t0]。
+    樣本之間以不同的次秒相位送出，取所有區間的交集可以把誤差縮小到遠小於一秒。
+
+    Returns:
+        dict: offset (秒)、uncertainty (交集區間半寬，秒)、rtt (RTT 中位數，秒)、samples (有效樣本數)；
+              全部樣本都失敗時回傳 None。
+    """
+    http = session or get_session()
+    headers = COMMON_HEADERS.copy()
+    lower, upper = float("-inf"), float("inf")
+    midpoints, rtts = [], []
+
+    for i in range(samples):
+        try:
+            t0_wall, t0 = time.time(), time.perf_counter()
+            response = http.get(url, headers=headers, timeout=10, stream=True)
+            t1 = time.perf_counter()
+            t1_wall = t0_wall + (t1 - t0)
+            # 讀完內容，讓連線回到連線池供最終 POST 使用
+            response.content
+        except requests.exceptions.RequestException as e:
+            print(f"[sniper] 校時請求失敗: {e}")
+            continue
+
+        date_header = response.headers.get("Date")
+        if not date_header:
+            print("[sniper] 回應沒有 Date 標頭，略過此樣本。")
+            continue
+        try:
+            server_time = parsedate_to_datetime(date_header)
+        except (TypeError, ValueError):
+            print(f"[sniper] 無法解析 Date 標頭 {date_header!r}，略過此樣本。")
+            continue
+        if server_time.tzinfo is None:
+            server_time = server_time.replace(tzinfo=timezone.utc)  # HTTP 日期一律為 GMT
+        server_second = server_time.timestamp()
+
+        sample_lower, sample_upper = server_second - t1_wall, server_second + 1 - t0_wall
+        lower, upper = max(lower, sample_lower), min(upper, sample_upper)
+        midpoints.append((sample_lower + sample_upper) / 2)
+        rtts.append(t1 - t0)
+
+        # 錯開下一個樣本在一秒內的相位
+        if i < samples - 1:
+            time.sleep((1.0 / samples) + 0.013)
+
+    if not rtts:
+        return None
+    if lower <= upper:
+        offset, uncertainty = (lower + upper) / 2, (upper - lower) / 2
+    else:
+        # 網路抖動造成區間沒有交集時，退回使用各樣本中點的中位數
+        offset, uncertainty = statistics.median(midpoints), 0.5
+    return {"offset": offset, "uncertainty": uncertainty, "rtt": statistics.median(rtts), "samples": len(rtts)}
+
+
+def sleep_until(target_wall_time):
+    """睡到本機時間 target_wall_time，最後一小段改為忙碌等待以取得毫秒級精度。"""
+    while True:
+        remaining = target_wall_time - time.time()
+        if remaining <= 0:
+            return
+        if remaining > BUSY_WAIT_THRESHOLD:
+            time.sleep(remaining - BUSY_WAIT_THRESHOLD)
+
+
+def prepare_booking(date, start_hour_key, venue_code, user_details, ocr_func, session=None):
+    """
+    提前完成 新增申請 與驗證碼辨識，並組好最終 POST 的 payload (已 url-encode 的 bytes)。
+
+    Returns:
+        dict: payload、booking_details、form_params 與 captcha_text；任一步驟失敗時回傳 None。
+    """
+    add_app_response, _, form_params = trigger_add_application_form(session=session)
+    if not (add_app_response and form_params):
+        print("[sniper] 觸發「新增申請」表單失敗。")
+        return None
+
+    captcha_id, captcha_text = solve_form_captcha(form_params, ocr_func, session)
+    if captcha_id is None:
+        print("[sniper] 驗證碼處理失敗。")
+        return None
+
+    booking_details = build_booking_details(
+        date, start_hour_key, venue_code,
+        department=form_params.get("AppDeptTextBox_Value") or user_details["department"],
+        email=form_params.get("EmailTextBox_Value") or user_details["email"],
+        phone=form_params.get("PhoneTextBox_Value") or user_details["phone"],
+    )
+    if booking_details is None:
+        print(f"[sniper] 無效的場地 '{venue_code}' 或時段 '{start_hour_key}'。")
+        return None
+
+    payload = BookingPayloadTemplate(form_params).render(booking_details,
+                                                         {"hfCaptchaId": captcha_id, "hfCaptchaValue": captcha_text})
+    return {"payload": payload, "booking_details": booking_details, "form_params": form_params,
+            "captcha_text": captcha_text}
+
+
+def snipe(release_epoch, date, start_hour_key, venue_code, user_details, ocr_func=None,
+          session=None, prepare_lead=20.0, calibration_samples=8, extra_lead=0.0,
+          captcha_attempts=CAPTCHA_RETRY_ATTEMPTS):
+    """
+    排程模式：在開放時間前準備好一切，於伺服器時間 release_epoch 的瞬間送出最終 POST。
+
+    發射時間 (本機) = release_epoch - offset - RTT/2 - extra_lead，
+    讓請求抵達伺服器時剛好是開放時間。
+
+    Args:
+        release_epoch (float): 開放時間 (UTC epoch 秒數，伺服器時間)。
+        prepare_lead (float, optional): 開放前幾秒開始 新增申請 + 驗證碼辨識。
+        calibration_samples (int, optional): 校時樣本數。
+        extra_lead (float, optional): 額外提早的秒數 (可為負值以延後)。
+        captcha_attempts (int, optional): 最多共送出幾次最終 POST；驗證碼被拒時以拒絕頁面立即重試。
+
+    Returns:
+        BookingResult: 最終 POST 的結果；準備失敗時 status 為 BookingStatus.ERROR。
+    """
+    if ocr_func is None:
+        from gemini_service import get_text_from_image_gemini
+        ocr_func = get_text_from_image_gemini
+    http = session or get_session()
+
+    # 粗略校時，決定何時開始準備
+    calibration = calibrate_clock(http, samples=3)
+    offset = calibration["offset"] if calibration else 0.0
+    prepare_at = release_epoch - offset - prepare_lead
+    if prepare_at > time.time():
+        print(f"[sniper] 等待 {prepare_at - time.time():.1f} 秒後開始準備...")
+        sleep_until(prepare_at)
+
+    prepared = prepare_booking(date, start_hour_key, venue_code, user_details, ocr_func, http)
+    if prepared is None:
+        return BookingResult(BookingStatus.ERROR, error="準備失敗")
+
+    # 準備完成後再精確校時 (同時讓連線保持溫熱)
+    calibration = calibrate_clock(http, samples=calibration_samples) or calibration
+    if calibration is None:
+        print("[sniper] 無法校時，使用本機時鐘。")
+        calibration = {"offset": 0.0, "uncertainty": 0.5, "rtt": 0.0, "samples": 0}
+    print(f"[sniper] 時鐘偏移 {calibration['offset'] * 1000:+.1f} ms (±{calibration['uncertainty'] * 1000:.1f} ms)，"
+          f"RTT {calibration['rtt'] * 1000:.1f} ms，樣本數 {calibration['samples']}")
+
+    fire_at = release_epoch - calibration["offset"] - calibration["rtt"] / 2 - extra_lead
+    if fire_at < time.time():
+        print("[sniper] 已超過發射時間，立即送出。")
+    else:
+        print(f"[sniper] 將於 {fire_at - time.time():.3f} 秒後送出最終 POST。")
+        sleep_until(fire_at)
+
+    fired_at = time.time()
+    result = send_booking_post(prepared["payload"], session=http, venue_code=venue_code)
+    report_captcha_verdict(prepared["captcha_text"], result.status)
+    print(f"[sniper] POST 送出時的伺服器時間估計: "
+          f"{datetime.fromtimestamp(fired_at + calibration['offset'], NDHU_TIMEZONE).isoformat(timespec='milliseconds')}")
+    if result.status is BookingStatus.CAPTCHA_REJECTED and captcha_attempts > 1:
+        retry_params = form_params_after_rejection(result, prepared["form_params"])
+        if retry_params is not None:
+            print("[sniper] 驗證碼被拒，立即以拒絕頁面的新驗證碼重試。")
+            retry_result = book_with_captcha_retry(retry_params, prepared["booking_details"], ocr_func,
+                                                   http, captcha_attempts - 1)
+            retry_result.attempts += result.attempts
+            result = retry_result
+    return result
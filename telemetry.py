@@ -0,0 +1,202 @@
+import contextvars
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# 設定此環境變數即可在不改程式的情況下輸出 JSON lines
+TRACE_FILE_ENV = "NDHU_TRACE_FILE"
+# 直方圖桶的成長比例 (2 的 1/8 次方，誤差約 ±4.5%)
+_BUCKET_BASE = 2 ** (1 / 8)
+
+_lock = threading.Lock()
+_enabled = False
+_sink = None
+_histograms = {}
+# 目前所在的 span 名稱；巢狀的 span (例如 HTTP 請求) 會以 parent 屬性記錄它。
+# asyncio.to_thread 會複製 context，所以在工作執行緒中一樣有效。
+_current_span = contextvars.ContextVar("telemetry_current_span", default=None)
+# 目前的收集器 (callable)；在 collect() 區塊內記錄的每一行 span 都會另外傳給它
+_collector = contextvars.ContextVar("telemetry_collector", default=None)
+
+
+class Histogram:
+    """對數桶直方圖：固定記憶體用量，百分位數誤差約一個桶寬。"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value):
+        index = math.ceil(math.log(value, _BUCKET_BASE)) if value > 0 else 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        target = pct / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                upper = _BUCKET_BASE ** index if index > 0 else 0.0
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+
+def enable(path=None):
+    """
+    開始收集 span。指定 path 時每個 span 會以一行 JSON 附加寫入該檔案；
+    未指定時僅累積在記憶體中的直方圖。
+    """
+    global _enabled, _sink
+    with _lock:
+        if path and _sink is None:
+            _sink = open(path, "a", encoding="utf-8")
+        _enabled = True
+
+
+def disable():
+    global _enabled, _sink
+    with _lock:
+        _enabled = False
+        if _sink is not None:
+            _sink.close()
+            _sink = None
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    """清空所有直方圖。"""
+    with _lock:
+        _histograms.clear()
+
+
+def record(name, duration_ms, **attrs):
+    """記錄一個已完成的 span (毫秒)。"""
+    if not _enabled:
+        return
+    _emit(name, duration_ms, attrs, {name: duration_ms})
+
+
+def record_phases(name, phases, **attrs):
+    """
+    記錄一個包含多個階段的 span (例如 HTTP 請求的 dns / connect / tls / ttfb / body)。
+    JSON line 只寫一行，直方圖則以 "<name>.<phase>" 分別累積。
+    """
+    if not _enabled:
+        return
+    values = {f"{name}.{phase}": value for phase, value in phases.items() if value is not None}
+    _emit(name, phases.get("total"), dict(attrs, phases=phases), values)
+
+
+def _emit(name, duration_ms, attrs, histogram_values):
+    line = {"ts": round(time.time(), 6), "span": name, "ms": duration_ms, "thread": threading.current_thread().name}
+    parent = _current_span.get()
+    if parent is not None and parent != name:
+        line["parent"] = parent
+    line.update(attrs)
+    with _lock:
+        for key, value in histogram_values.items():
+            if value is not None:
+                _histograms.setdefault(key, Histogram()).add(value)
+        if _sink is not None:
+            _sink.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+            _sink.flush()
+    collector = _collector.get()
+    if collector is not None:
+        collector(line)
+
+
+@contextmanager
+def collect(callback):
+    """
+    區塊內 (包含由此建立的 asyncio task 與 to_thread 工作執行緒) 記錄的每個 span
+    都會以 dict (與 JSON line 相同內容) 呼叫 callback，例如把單一工作的各步驟耗時回傳給提交者。
+    只在 enable() 之後有效；callback 可能在其他執行緒中被呼叫。
+    """
+    token = _collector.set(callback)
+    try:
+        yield
+    finally:
+        _collector.reset(token)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    計時一段程式碼。yield 出的 dict 可在區塊內加入額外屬性；
+    發生例外時會記錄 error 屬性並重新拋出。
+    """
+    if not _enabled:
+        yield attrs
+        return
+    token = _current_span.set(name)
+    started_at = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        elapsed = (time.perf_counter() - started_at) * 1000
+        _current_span.reset(token)
+        record(name, elapsed, **attrs)
+
+
+def timed(name):
+    """將整個函式包成一個 span 的裝飾器。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary():
+    """回傳 {名稱: {count, mean, p50, p95, p99, max}} (毫秒)。"""
+    with _lock:
+        return {
+            name: {
+                "count": h.count, "mean": h.total / h.count,
+                "p50": h.percentile(50), "p95": h.percentile(95), "p99": h.percentile(99), "max": h.max,
+            }
+            for name, h in sorted(_histograms.items())
+        }
+
+
+def print_summary():
+    rows = summary()
+    if not rows:
+        return
+    print(f"\n{'span':<34} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+    for name, row in rows.items():
+        print(f"{name:<34} {row['count']:>6} {row['p50']:>9.2f} {row['p95']:>9.2f} {row['p99']:>9.2f} {row['max']:>9.2f}")
+
+
+def enable_from_env():
+    """
+    若設定了 TRACE_FILE_ENV (環境變數或 .env)，開始收集並寫入該檔案。
+    在程式進入點呼叫，而不是 import 時讀取，.env 中的設定才會生效。
+    """
+    import settings
+    path = settings.getenv(TRACE_FILE_ENV)
+    if path:
+        enable(path)
+    return bool(path)
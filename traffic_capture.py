@@ -0,0 +1,450 @@
+"""
+錄製 / 回放網路流量，用於離線效能分析與回歸測試。
+
+錄製 (main --record FILE 或環境變數 NDHU_RECORD)：經過 http_client session 的每個請求
+(login_module、booking_service、captcha_service 等) 與 gemini_service 的 OCR 呼叫，連同耗時寫入
+gzip 壓縮的 JSON lines。寫入前遮蔽機密：登入帳密 (TxtUSERNO / TxtPWD)、Cookie / Set-Cookie 的值、
+Authorization 與 API 金鑰，以及這些值出現在其他請求或頁面中的任何位置。路徑中的 {pid}
+會換成行程編號 (multi_account 的每個行程各寫一個檔案)。
+
+回放 (main --replay FILE 或 NDHU_REPLAY)：不連線，依 (來源, 方法, 路徑) 的順序回傳錄製的回應，
+同樣經過 http_client (telemetry、串流讀取、cookies) 與 gemini_service 的解析流程。某個路徑的錄製用完後
+重複最後一筆；沒有錄製的請求視為連線失敗。--replay-timing (NDHU_REPLAY_TIMING=1) 會依錄製的耗時等待。
+
+    python main.py --record capture.jsonl.gz --venues VOL0C --hours 06 --date 2025/06/05
+    python main.py --replay capture.jsonl.gz --venues VOL0C --hours 06 --date 2025/06/05
+    python traffic_capture.py show capture.jsonl.gz
+    python traffic_capture.py extract capture.jsonl.gz recorded/   # mock_ndhu_server --fixtures 用的頁面
+"""
+import argparse
+import atexit
+import base64
+import collections
+import gzip
+import io
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+RECORD_ENV = "NDHU_RECORD"
+REPLAY_ENV = "NDHU_REPLAY"
+REPLAY_TIMING_ENV = "NDHU_REPLAY_TIMING"
+FORMAT = "ndhu-traffic"
+FORMAT_VERSION = 1
+REDACTED = "REDACTED"
+
+# 表單欄位名稱以這些結尾時遮蔽其值 (ASP.NET 的名稱如 ctl00$MainContent$TxtPWD)
+SECRET_FORM_FIELDS = ("TxtUSERNO", "TxtPWD")
+SECRET_HEADERS = frozenset({"cookie", "authorization", "proxy-authorization", "api-key", "x-api-key", "x-goog-api-key"})
+SECRET_QUERY_PARAMS = frozenset({"key", "api_key", "apikey", "access_token"})
+# 這些環境變數的值出現在任何地方都會被遮蔽
+SECRET_ENV_VARS = ("NDHU_USERNAME", "NDHU_PASSWORD", "GEMINI_API_KEY", "NDHU_OCR_API_KEY")
+# 短於此長度的值不做全文取代，避免誤傷一般內容 (例如 lang_code=tw)
+MIN_SECRET_LENGTH = 6
+# 錄製時不保留的回應標頭：body 存的是解碼後的內容，長度另外重算
+_DROPPED_HEADERS = frozenset({"content-encoding", "transfer-encoding", "content-length"})
+
+_capture = None
+_capture_configured = False
+_capture_lock = threading.Lock()
+
+
+class Redactor:
+    """遮蔽機密；看過的機密值 (帳密、cookie 值) 之後在任何文字中出現都會被取代。"""
+
+    def __init__(self, secrets=()):
+        self._secrets = set()
+        for secret in secrets:
+            self.add(secret)
+
+    def add(self, value):
+        if value and len(value) >= MIN_SECRET_LENGTH and value != REDACTED:
+            self._secrets.add(value)
+            self._secrets.add(urllib.parse.quote_plus(value))
+
+    def text(self, value):
+        if not value:
+            return value
+        for secret in sorted(self._secrets, key=len, reverse=True):
+            if secret in value:
+                value = value.replace(secret, REDACTED)
+        return value
+
+    def form(self, body):
+        """application/x-www-form-urlencoded 的 body：遮蔽帳密欄位並記住其值。"""
+        pairs = urllib.parse.parse_qsl(body, keep_blank_values=True)
+        if not any(name.endswith(SECRET_FORM_FIELDS) for name, _ in pairs):
+            return self.text(body)
+        redacted = []
+        for name, value in pairs:
+            if name.endswith(SECRET_FORM_FIELDS):
+                self.add(value)
+                value = REDACTED
+            redacted.append((name, value))
+        return self.text(urllib.parse.urlencode(redacted))
+
+    def url(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.query:
+            query = [(name, REDACTED if name.lower() in SECRET_QUERY_PARAMS else value)
+                     for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)]
+            parts = parts._replace(query=urllib.parse.urlencode(query))
+        return self.text(urllib.parse.urlunsplit(parts))
+
+    def headers(self, pairs):
+        redacted = []
+        for name, value in pairs:
+            lower = name.lower()
+            if lower in SECRET_HEADERS:
+                value = REDACTED
+            elif lower == "set-cookie":
+                cookie, _, attributes = value.partition(";")
+                cookie_name, _, cookie_value = cookie.partition("=")
+                self.add(cookie_value.strip())
+                value = f"{cookie_name}={REDACTED}" + (f";{attributes}" if attributes else "")
+            else:
+                value = self.text(value)
+            redacted.append([name, value])
+        return redacted
+
+
+def _env_secrets():
+    import settings
+    return [settings.getenv(name) for name in SECRET_ENV_VARS]
+
+
+def _encode_body(body, redactor, form=False):
+    """bytes / str -> 可寫入 JSON 的欄位 (文字存 body，二進位存 body_b64)。"""
+    if body is None:
+        return {}
+    if isinstance(body, bytes):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return {"body_b64": base64.b64encode(body).decode("ascii")}
+    return {"body": redactor.form(body) if form else redactor.text(body)}
+
+
+def _decode_body(fields):
+    if "body_b64" in fields:
+        return base64.b64decode(fields["body_b64"])
+    return (fields.get("body") or "").encode("utf-8")
+
+
+def _route_key(source, method, url):
+    parts = urllib.parse.urlsplit(url)
+    return source, method.upper(), parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+def _header_pairs(headers):
+    """requests / urllib3 的標頭 -> [(name, value)]，同名標頭 (Set-Cookie) 各自保留。"""
+    getlist = getattr(headers, "getlist", None)
+    if getlist is None:
+        return list(headers.items())
+    return [(name, value) for name in headers.keys() for value in getlist(name)]
+
+
+class TrafficRecorder:
+    """將流量寫入 gzip JSON lines (執行緒安全)。"""
+
+    replaying = False
+
+    def __init__(self, path):
+        self.path = path.format(pid=os.getpid())
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.redactor = Redactor(_env_secrets())
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._started_at = time.perf_counter()
+        self._write({"format": FORMAT, "version": FORMAT_VERSION, "created_at": time.time()})
+        print(f"[traffic_capture] 錄製流量到 {self.path}")
+
+    def _write(self, record):
+        with self._lock:
+            if self._file is None:
+                return
+            if "format" not in record:
+                self._seq += 1
+                record = {"seq": self._seq, **record}
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def send(self, adapter, request, send_func):
+        """錄製一個 requests 的請求；串流回應會先完整讀取 (之後的 iter_content 直接讀取暫存的內容)。"""
+        started_at = time.perf_counter()
+        content_type = request.headers.get("Content-Type", "")
+        record = {
+            "t": round(started_at - self._started_at, 4), "source": "http", "method": request.method,
+            "url": self.redactor.url(request.url),
+            "request_headers": self.redactor.headers(request.headers.items()),
+        }
+        try:
+            response = send_func()
+            headers_at = time.perf_counter()
+            body = response.content
+        except Exception as e:
+            record.update(_encode_body(request.body, self.redactor, "form-urlencoded" in content_type),
+                          error=type(e).__name__, elapsed_ms=round((time.perf_counter() - started_at) * 1000, 2))
+            self._write(record)
+            raise
+        finished_at = time.perf_counter()
+        request_body = {f"request_{key}": value
+                        for key, value in _encode_body(request.body, self.redactor,
+                                                       "form-urlencoded" in content_type).items()}
+        headers = [(name, value) for name, value in _header_pairs(response.raw.headers)
+                   if name.lower() not in _DROPPED_HEADERS]
+        record.update(request_body, status=response.status_code, reason=response.reason,
+                      headers=self.redactor.headers(headers),
+                      elapsed_ms=round((headers_at - started_at) * 1000, 2),
+                      total_ms=round((finished_at - started_at) * 1000, 2),
+                      **_encode_body(body, self.redactor))
+        self._write(record)
+        return response
+
+    def call(self, source, method, url, request_data, func, dump, load=None):
+        """
+        錄製一次非 requests 的呼叫 (例如 openai client)。
+
+        Args:
+            request_data (dict): 要記錄的請求內容。
+            func (callable): 實際的呼叫。
+            dump (callable): 回傳值 -> 可 JSON 序列化的 dict。
+            load (callable, optional): 回放時使用，錄製時忽略。
+        """
+        started_at = time.perf_counter()
+        record = {"t": round(started_at - self._started_at, 4), "source": source, "method": method,
+                  "url": self.redactor.url(url),
+                  "request_body": self.redactor.text(json.dumps(request_data, ensure_ascii=False))}
+        try:
+            result = func()
+        except Exception as e:
+            record.update(error=type(e).__name__, elapsed_ms=round((time.perf_counter() - started_at) * 1000, 2))
+            self._write(record)
+            raise
+        elapsed_ms = round((time.perf_counter() - started_at) * 1000, 2)
+        record.update(status=200, elapsed_ms=elapsed_ms, total_ms=elapsed_ms,
+                      body=self.redactor.text(json.dumps(dump(result), ensure_ascii=False)))
+        self._write(record)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                print(f"[traffic_capture] 已錄製 {self._seq} 筆到 {self.path}")
+
+
+class _RecordedMessage:
+    """讓 requests 從回放的回應取出 Set-Cookie (requests.cookies.MockResponse 需要 .msg)。"""
+
+    def __init__(self, pairs):
+        import http.client
+        self.msg = http.client.HTTPMessage()
+        for name, value in pairs:
+            self.msg[name] = value  # HTTPMessage 的 __setitem__ 會保留同名標頭
+
+    def isclosed(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class TrafficReplayer:
+    """依錄製檔回放流量，不連線。"""
+
+    replaying = True
+
+    def __init__(self, path, timing=False):
+        self.path = path
+        self.timing = timing
+        self._queues = collections.defaultdict(collections.deque)
+        self._last = {}
+        self._lock = threading.Lock()
+        self.served = 0
+        self.missing = 0
+        _, records = load_archive(path)
+        for record in records:
+            self._queues[_route_key(record["source"], record["method"], record["url"])].append(record)
+        print(f"[traffic_capture] 回放 {path} ({len(records)} 筆，{'依錄製耗時' if timing else '不等待'})")
+
+    def next_record(self, source, method, url):
+        """依順序取出下一筆同路徑的錄製；用完後重複最後一筆，沒有錄製時回傳 None。"""
+        key = _route_key(source, method, url)
+        with self._lock:
+            queue = self._queues.get(key)
+            record = queue.popleft() if queue else self._last.get(key)
+            if record is None:
+                self.missing += 1
+                return None
+            self._last[key] = record
+            self.served += 1
+        if self.timing and record.get("elapsed_ms"):
+            time.sleep(record["elapsed_ms"] / 1000)
+        return record
+
+    def send(self, adapter, request, send_func):
+        import requests
+        from urllib3 import HTTPResponse
+        from urllib3._collections import HTTPHeaderDict
+
+        record = self.next_record("http", request.method, request.url)
+        if record is None:
+            raise requests.ConnectionError(f"[traffic_capture] 沒有 {request.method} {request.url} 的錄製")
+        if record.get("error"):
+            raise requests.ConnectionError(f"[traffic_capture] 錄製時發生 {record['error']}")
+        body = _decode_body(record)
+        headers = HTTPHeaderDict()
+        for name, value in record.get("headers", []):
+            headers.add(name, value)
+        headers["Content-Length"] = str(len(body))
+        raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=record["status"],
+                           reason=record.get("reason"), preload_content=False, decode_content=False,
+                           original_response=_RecordedMessage(record.get("headers", [])), request_url=request.url)
+        return adapter.build_response(request, raw)
+
+    def call(self, source, method, url, request_data, func, dump, load=None):
+        record = self.next_record(source, method, url)
+        if record is None:
+            raise ConnectionError(f"[traffic_capture] 沒有 {source} {method} {url} 的錄製")
+        if record.get("error"):
+            raise ConnectionError(f"[traffic_capture] 錄製時發生 {record['error']}")
+        data = json.loads(record["body"])
+        return load(data) if load else data
+
+    def close(self):
+        print(f"[traffic_capture] 回放結束：{self.served} 筆命中，{self.missing} 筆沒有錄製")
+
+
+def load_archive(path):
+    """讀取錄製檔，回傳 (header, records)。"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines or lines[0].get("format") != FORMAT:
+        raise ValueError(f"{path} 不是流量錄製檔")
+    return lines[0], lines[1:]
+
+
+def configure(record=None, replay=None, timing=False):
+    """
+    開始錄製或回放 (取代既有的設定)；兩者都沒有指定時停用。
+
+    Returns:
+        TrafficRecorder, TrafficReplayer or None
+    """
+    global _capture, _capture_configured
+    if record and replay:
+        raise ValueError("不能同時錄製與回放")
+    with _capture_lock:
+        if _capture is not None:
+            _capture.close()
+        if record:
+            _capture = TrafficRecorder(record)
+        elif replay:
+            _capture = TrafficReplayer(replay, timing)
+        else:
+            _capture = None
+        if not _capture_configured:
+            atexit.register(stop)
+        _capture_configured = True
+        return _capture
+
+
+def get_capture():
+    """目前的錄製器 / 回放器 (第一次呼叫時依 NDHU_RECORD / NDHU_REPLAY 設定)；停用時回傳 None。"""
+    if not _capture_configured:
+        configure(os.getenv(RECORD_ENV), os.getenv(REPLAY_ENV), os.getenv(REPLAY_TIMING_ENV) == "1")
+    return _capture
+
+
+def replaying():
+    capture = get_capture()
+    return capture is not None and capture.replaying
+
+
+def stop():
+    global _capture
+    with _capture_lock:
+        if _capture is not None:
+            _capture.close()
+        _capture = None
+
+
+def route_of(record):
+    """HTTP 錄製對應的 mock_ndhu_server 路由名稱 (見 mock_ndhu_server.ROUTES)；無法對應時回傳 None。"""
+    if record.get("source") != "http" or record.get("error"):
+        return None
+    path = urllib.parse.urlsplit(record["url"]).path.lower()
+    method = record["method"].upper()
+    if path.endswith("/login.aspx"):
+        return "login_get" if method == "GET" else "login_post"
+    if path.endswith("/default.aspx"):
+        if method == "GET":
+            return "default_get"
+        return "add_application" if "Button2" in record.get("request_body", "") else "final_post"
+    if "captcha" in path:
+        return "captcha"
+    return None
+
+
+def extract_fixtures(path, out_dir):
+    """
+    將錄製中的頁面存成 mock_ndhu_server --fixtures 使用的檔案 (每種頁面取最後一筆 200 回應)。
+
+    Returns:
+        dict: 路由名稱 -> 寫入的檔案路徑。
+    """
+    from mock_ndhu_server import FIXTURE_FILES
+
+    _, records = load_archive(path)
+    pages = {}
+    for record in records:
+        route = route_of(record)
+        if route in FIXTURE_FILES and record.get("status") == 200:
+            pages[route] = _decode_body(record)
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    for route, body in pages.items():
+        written[route] = os.path.join(out_dir, FIXTURE_FILES[route])
+        with open(written[route], "wb") as f:
+            f.write(body)
+    return written
+
+
+def print_archive(path):
+    header, records = load_archive(path)
+    print(f"{path}: {len(records)} 筆 (錄製於 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['created_at']))})")
+    print(f"{'seq':>4} {'t (s)':>8} {'source':<7} {'method':<6} {'status':>6} {'bytes':>8} {'ms':>8}  path")
+    for record in records:
+        size = len(_decode_body(record)) if "status" in record else 0
+        status = record.get("status") or record.get("error", "")
+        print(f"{record['seq']:>4} {record['t']:>8.3f} {record['source']:<7} {record['method']:<6} {status!s:>6} "
+              f"{size:>8} {record.get('elapsed_ms', 0):>8.1f}  {urllib.parse.urlsplit(record['url']).path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="列出錄製的請求與耗時")
+    show.add_argument("archive")
+    extract = commands.add_parser("extract", help="將錄製的頁面存成 mock_ndhu_server --fixtures 目錄")
+    extract.add_argument("archive")
+    extract.add_argument("out_dir")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "show":
+            print_archive(args.archive)
+        else:
+            for route, file_path in extract_fixtures(args.archive, args.out_dir).items():
+                print(f"[traffic_capture] {route} -> {file_path}")
+    except (OSError, ValueError) as e:
+        print(f"[traffic_capture] 錯誤：{e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+監看模式：定期擷取借用狀況，與前一次快照比較，想要的時段一空出來就立刻競速預約。
+
+輪詢間隔會自動調整：
+  - 借用狀況有變化時回到最短間隔，連續沒有變化則逐次拉長 (指數退避) 到最長間隔；
+  - 熱門時段 (預設為每個想要的時段開始前兩小時，最常有人取消) 內一律使用最短間隔。
+"""
+import random
+import threading
+import time
+from datetime import datetime
+
+from availability import build_index, fetch_schedule_page
+from booking_engine import also_booked, run_race
+from sniper import NDHU_TIMEZONE
+
+# 想要的時段開始前幾小時視為熱門時段
+DEFAULT_HOT_LEAD_HOURS = 2
+# 每次競速同時進行的候選數 (未指定 max_parallel 時)
+DEFAULT_MAX_PARALLEL = 2
+# 第一次擷取時最多嘗試幾個可借用時段 (之後只處理新空出的時段)
+DEFAULT_FIRST_POLL_LIMIT = 4
+
+
+class AdaptivePoller:
+    """
+    計算下一次輪詢前要等待的秒數。
+
+    Args:
+        min_interval (float, optional): 最短間隔 (秒)，熱門時段或剛偵測到變化時使用。
+        max_interval (float, optional): 最長間隔 (秒)。
+        backoff (float, optional): 每次沒有變化時間隔乘上的倍數。
+        hot_windows (iterable, optional): (開始小時, 結束小時) 清單 (台灣時間)，區間內使用最短間隔。
+        jitter (float, optional): 間隔的隨機抖動比例，避免與其他人的輪詢同步。
+    """
+
+    def __init__(self, min_interval=5.0, max_interval=120.0, backoff=1.5, hot_windows=(), jitter=0.1):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.hot_windows = list(hot_windows)
+        self.jitter = jitter
+        self.current = min_interval
+
+    def in_hot_window(self, now=None):
+        hour = datetime.fromtimestamp(now if now is not None else time.time(), NDHU_TIMEZONE).hour
+        return any(start <= hour < end if start <= end else hour >= start or hour < end
+                   for start, end in self.hot_windows)
+
+    def next_interval(self, changed, now=None):
+        """依這次輪詢是否有變化更新並回傳下一次的等待秒數。"""
+        if changed:
+            self.current = self.min_interval
+        else:
+            self.current = min(self.current * self.backoff, self.max_interval)
+        interval = self.min_interval if self.in_hot_window(now) else self.current
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def default_hot_windows(start_hour_keys, lead_hours=DEFAULT_HOT_LEAD_HOURS):
+    """每個想要的時段開始前 lead_hours 小時。"""
+    return [((int(key) - lead_hours) % 24, int(key)) for key in start_hour_keys]
+
+
+def watch(date_from, days, venue_patterns, start_hour_keys, user_details, ocr_func=None, session=None,
+          poller=None, max_bookings=1, max_parallel=None, relogin=None, stop_event=None, max_polls=None,
+          first_poll_limit=DEFAULT_FIRST_POLL_LIMIT):
+    """
+    持續監看並在想要的時段空出來時預約。
+
+    只預約狀態已知 (頁面有列出) 且可借用的時段。第一次擷取時依 日期 → 時段 順序最多嘗試
+    first_poll_limit 個；之後只處理與前一次快照相比新空出的時段。
+    預約失敗或沒有嘗試的時段不會在之後的輪詢中重試，除非它再次被借用後又空出。
+
+    Args:
+        date_from (str): 監看的第一天 "YYYY/MM/DD"。
+        days (int): 監看天數。
+        venue_patterns (list): 場地代碼或萬用字元樣式。
+        start_hour_keys (list): 想要的時段索引。
+        user_details (dict): 同 booking_engine.race_bookings。
+        ocr_func (callable, optional): 驗證碼辨識函式。
+        session (requests.Session, optional): 已登入的 session。
+        poller (AdaptivePoller, optional): 預設以 default_hot_windows 建立。
+        max_bookings (int, optional): 成功預約幾個時段後結束。
+        max_parallel (int, optional): 同時進行的候選數量上限，預設 DEFAULT_MAX_PARALLEL。
+        relogin (callable, optional): 擷取失敗時呼叫以重新登入，回傳值同 perform_login。
+        stop_event (threading.Event, optional): 設定後結束監看。
+        max_polls (int, optional): 最多輪詢次數 (測試用)。
+        first_poll_limit (int, optional): 第一次擷取時最多嘗試的時段數。
+
+    Returns:
+        list: 成功預約的結果 dict (同 race_bookings 的 winner，另加 date)。
+    """
+    poller = poller or AdaptivePoller(hot_windows=default_hot_windows(start_hour_keys))
+    max_parallel = max_parallel or DEFAULT_MAX_PARALLEL
+    stop_event = stop_event or threading.Event()
+    previous = None
+    booked = []
+    polls = 0
+
+    while not stop_event.is_set() and (max_polls is None or polls < max_polls):
+        polls += 1
+        # 監看範圍內只有首頁列出的日期與場地是已知的 (見 availability.scrape_availability)
+        html_content = fetch_schedule_page(session)
+        index = None if html_content is None else build_index([html_content], date_from, days)
+        if index is None:
+            if relogin is not None:
+                new_session, _, _ = relogin()
+                session = new_session or session
+            stop_event.wait(poller.next_interval(changed=False))
+            continue
+
+        if previous is None:
+            freed = index.find_free(venue_patterns, start_hour_keys)
+            changed = bool(freed)
+            if len(freed) > first_poll_limit:
+                print(f"[watcher] 第一次擷取有 {len(freed)} 個可借用時段，只嘗試前 {first_poll_limit} 個。")
+                freed = freed[:first_poll_limit]
+        else:
+            changed = bool(index.changed_cells(previous))
+            freed = index.freed_slots(previous, venue_patterns, start_hour_keys) if changed else []
+        previous = index
+        # 只競速狀態已知且可借用的時段
+        freed = [slot for slot in freed if index.is_free(*slot) is True]
+
+        if freed:
+            print(f"[watcher] 發現 {len(freed)} 個可借用時段: {freed}")
+        for date in sorted({slot_date for _, slot_date, _ in freed}):
+            candidates = [(venue, hour) for venue, slot_date, hour in freed if slot_date == date]
+            winner, results = run_race(candidates, date, user_details, ocr_func=ocr_func, session=session,
+                                       max_parallel=max_parallel)
+            if winner:
+                # 停止前已送出的其他候選也可能成功 (重複預約)，一併列入
+                for success in [winner, *also_booked(winner, results)]:
+                    success["date"] = date
+                    booked.append(success)
+                    print(f"[watcher] 已預約 {success['venue_code']}@{success['start_hour_key']} ({date})")
+                if len(booked) >= max_bookings:
+                    return booked
+
+        interval = poller.next_interval(changed)
+        print(f"[watcher] 第 {polls} 次輪詢完成，{interval:.1f} 秒後再次檢查。")
+        stop_event.wait(interval)
+    return booked